@@ -1,8 +1,16 @@
 from flask import render_template, request, redirect, url_for
+import hashlib
 import logging.config
-from flask import Flask
-from src.create_dataset import Predictions
-from flask_sqlalchemy import SQLAlchemy
+from os import path
+from datetime import datetime, timedelta
+from flask import Flask, jsonify, make_response
+from sqlalchemy.orm import scoped_session
+from app.cache import PredictionCache
+from src.create_dataset import Predictions_Version
+from src.load_data import load_predictions, read_rate_store
+from src.cross_rates import CrossRates
+from src.snapshot import read_manifest
+from src.helpers.helpers import get_engine, get_sessionmaker
 
 # Initialize the Flask application
 app = Flask(__name__)
@@ -12,22 +20,250 @@ app.config.from_pyfile('../config/flask_config.py')
 
 logger = logging.getLogger("xchangeratepred")
 
-# Initialize the database
-db = SQLAlchemy(app)
+# Initialize the database through the process-wide engine, so the app shares its connection pool with the pipeline code
+engine = get_engine(engine_string=app.config["SQLALCHEMY_DATABASE_URI"])
+db_session = scoped_session(get_sessionmaker(engine))
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """Returns the connection of the request's session to the pool"""
+    db_session.remove()
+
+
+def load_predictions_version():
+    """Returns the (VERSION, UPDATED_AT) stamp written by score_model, or None if there is none yet"""
+    try:
+        stamp = db_session.query(Predictions_Version.VERSION, Predictions_Version.UPDATED_AT).\
+            filter(Predictions_Version.ID == 1).first()
+        return tuple(stamp) if stamp is not None else None
+    finally:
+        db_session.remove()
+
+
+prediction_cache = PredictionCache(load_predictions_version,
+                                   check_interval=app.config["PREDICTION_CACHE_CHECK_SECONDS"],
+                                   max_entries=app.config["PREDICTION_CACHE_MAX_ENTRIES"])
+
+
+def parse_dates(args):
+    """
+    Reads the start and end dates (YYYY-MM-DD) from the query parameters
+    :param args: Query parameters of the request
+    :return: Tuple of the start and end date, None when not given. Raises ValueError for invalid dates
+    """
+    start_date = args.get('start') or None
+    end_date = args.get('end') or None
+    for value in (start_date, end_date):
+        if value is not None:
+            datetime.strptime(value, '%Y-%m-%d')
+    return start_date, end_date
+
+
+def parse_filters(args):
+    """
+    Reads the prediction filters and the page from the query parameters: currency (comma separated), start and end
+    (prediction dates, YYYY-MM-DD), after (CURRENCY:YYYY-MM-DD key of the last prediction of the previous page) and limit
+    :param args: Query parameters of the request
+    :return: Dictionary with the currencies, start_date, end_date, after and limit. Raises ValueError for invalid values
+    """
+    currencies = tuple(curr.strip().upper() for curr in args.get('currency', '').split(',') if curr.strip())
+    start_date, end_date = parse_dates(args)
+
+    after = args.get('after') or None
+    if after is not None:
+        after_currency, _, after_date = after.partition(':')
+        datetime.strptime(after_date, '%Y-%m-%d')
+        after = (after_currency.upper(), after_date)
+
+    limit = args.get('limit', type=int) if 'limit' in args else None
+    if 'limit' in args and (limit is None or not 1 <= limit <= app.config["PREDICTIONS_MAX_PAGE_SIZE"]):
+        raise ValueError("limit must be between 1 and {}".format(app.config["PREDICTIONS_MAX_PAGE_SIZE"]))
+
+    return {'currencies': currencies, 'start_date': start_date, 'end_date': end_date, 'after': after, 'limit': limit}
+
+
+def query_predictions(currencies=None, start_date=None, end_date=None, after=None, limit=None):
+    """
+    Queries a page of the predictions, see load_data.load_predictions
+    :return: Tuple of the predictions and the CURRENCY:YYYY-MM-DD key of the next page, or None on the last page
+    """
+    predictions, next_key = load_predictions(db_session, currencies, start_date, end_date, after, limit)
+    return predictions, "{}:{}".format(*next_key) if next_key is not None else None
+
+
+def load_cross_rates():
+    """
+    Derives the rates of every currency pair from the predictions and, when the rate store is on disk, from the last
+    CROSS_RATE_HISTORY_DAYS days of its history
+    :return: Tuple of the CrossRates of the predictions and of the history, or None for the history without a rate store
+    """
+    predictions, _ = load_predictions(db_session)
+    forecasts = CrossRates.from_records(predictions, 'PRED_DATE', 'PRED_RATE')
+
+    history = None
+    store_location = app.config.get("RATE_STORE")
+    if store_location and path.exists(store_location):
+        store = read_rate_store(store_location)
+        start_date = None
+        if len(store["dates"]):
+            last_date = store["dates"][-1].astype(datetime)
+            start_date = (last_date - timedelta(days=app.config["CROSS_RATE_HISTORY_DAYS"])).isoformat()
+        history = CrossRates.from_store(store, start_date)
+    return forecasts, history
+
+
+def conditional_response(response, etag, last_modified):
+    """Adds the ETag and Last-Modified validators to the response and turns it into a 304 if the client is current"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def snapshot_response(name):
+    """
+    Serves a file of the prediction snapshot written by score_model, in the best encoding that the client accepts. The
+    snapshot is only served when it holds the version of the predictions in the database, which a score run on another
+    host may have replaced, and when its index page has the page size of the app
+    :param name: Name of the file in the manifest of the snapshot, "index" or "predictions"
+    :return: The response, or None if there is no complete, current snapshot
+    """
+    directory = app.config.get("SNAPSHOT_DIR")
+    manifest = read_manifest(directory) if directory else None
+    if manifest is None or name not in manifest['files']:
+        return None
+    if manifest['version'] != prediction_cache.stamp()[0]:
+        return None
+    if name == 'index' and manifest.get('page_size') != app.config["PREDICTIONS_PAGE_SIZE"]:
+        return None
+
+    entry = manifest['files'][name]
+    encoding = next(encoding for encoding in ('br', 'gzip', 'identity') if encoding in entry['encodings'] and
+                    (encoding == 'identity' or encoding in request.accept_encodings))
+    try:
+        with open(path.join(directory, entry['encodings'][encoding]), 'rb') as snapshot_file:
+            response = make_response(snapshot_file.read())
+    except IOError:
+        return None
+
+    response.headers['Content-Type'] = entry['mimetype']
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    updated_at = datetime.strptime(manifest['updated_at'], '%Y-%m-%dT%H:%M:%S')
+    return conditional_response(response, "{}-{}".format(entry['sha256'], encoding), updated_at)
 
 
 @app.route('/')
 def index():
     """Main view that lists the rate predictions.
-    Create view into index page that uses data queried from rates database.
+    Create view into index page that uses data queried from rates database, one page of PREDICTIONS_PAGE_SIZE
+    predictions at a time. Query parameters (all optional): currency (comma separated), start and end (prediction dates,
+    YYYY-MM-DD) and after (the key of the next page link). Without query parameters the page pre-rendered by score_model
+    is served from the snapshot, without querying the database. The pages rendered from the database are cached until
+    score_model stores a new version of the predictions.
     Returns: rendered html template
     """
 
+    if not request.args:
+        response = snapshot_response('index')
+        if response is not None:
+            return response
+
     try:
-        preds = db.session.query(Predictions).limit(100).all()
+        filters = parse_filters(request.args)
+    except ValueError:
+        return make_response(render_template('error.html'), 400)
+    filters['limit'] = filters['limit'] or app.config["PREDICTIONS_PAGE_SIZE"]
+
+    def render_page():
+        predictions, next_key = query_predictions(**filters)
+        next_url = url_for('index', currency=','.join(filters['currencies']) or None, start=filters['start_date'],
+                           end=filters['end_date'], limit=request.args.get('limit'), after=next_key) \
+            if next_key is not None else None
+        return render_template('index.html', predictions=predictions, filters=filters, next_url=next_url)
+
+    try:
+        key = ('index',) + tuple(sorted(filters.items()))
+        page, (version, updated_at) = prediction_cache.get(key, render_page)
         logger.info("Index page accessed")
-        return render_template('index.html', predictions=preds)
+        etag = hashlib.sha1("{}|{}".format(version, key).encode("utf-8")).hexdigest()
+        return conditional_response(make_response(page), etag, updated_at)
     except:
         logger.warning("Not able to display tracks, error page returned")
         return render_template('error.html')
 
+
+@app.route('/api/predictions')
+def api_predictions():
+    """JSON view of the rate predictions.
+    Query parameters (all optional): currency (comma separated), start and end (prediction dates, YYYY-MM-DD), limit
+    (page size) and after (the next key of the previous page).
+    Returns: JSON with the predictions version, the matching predictions and the key of the next page (null on the last
+    page or without a limit). Without query parameters it is served from the snapshot written by score_model
+    """
+
+    if not request.args:
+        response = snapshot_response('predictions')
+        if response is not None:
+            return response
+
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        return make_response(jsonify(error="start and end must be dates in the YYYY-MM-DD format, after a "
+                                           "CURRENCY:YYYY-MM-DD key and limit between 1 and {}"
+                                     .format(app.config["PREDICTIONS_MAX_PAGE_SIZE"])), 400)
+
+    try:
+        key = ('api',) + tuple(sorted(filters.items()))
+        (predictions, next_key), (version, updated_at) = \
+            prediction_cache.get(key, lambda: query_predictions(**filters))
+        etag = hashlib.sha1("{}|{}".format(version, key).encode("utf-8")).hexdigest()
+        response = jsonify(version=version, predictions=predictions, next=next_key)
+        return conditional_response(response, etag, updated_at)
+    except Exception as e:
+        logger.error(e)
+        return make_response(jsonify(error="Not able to access the predictions"), 500)
+
+
+@app.route('/api/pairs/<base>/<quote>')
+def api_pair(base, quote):
+    """JSON view of the rates of any currency pair, e.g. /api/pairs/EUR/INR for the rate of EUR in INR.
+    The pairs are derived from the rates with respect to USD, so no model is fitted per pair. The derived rates are
+    cached until score_model stores a new version of the predictions.
+    Query parameters (all optional): start and end (dates, YYYY-MM-DD)
+    Returns: JSON with the predictions version, the pair, its predictions and its history (null without a rate store)
+    """
+
+    base, quote = base.upper(), quote.upper()
+    unsupported = sorted(set(request.args) - {'start', 'end'})
+    if unsupported:
+        return make_response(jsonify(error="Unsupported query parameters: {}, only start and end are supported"
+                                     .format(", ".join(unsupported))), 400)
+    try:
+        start_date, end_date = parse_dates(request.args)
+    except ValueError:
+        return make_response(jsonify(error="start and end must be dates in the YYYY-MM-DD format"), 400)
+
+    try:
+        (forecasts, history), (version, updated_at) = prediction_cache.get(('cross_rates',), load_cross_rates)
+        if base not in forecasts.index or quote not in forecasts.index:
+            return make_response(jsonify(error="No predictions for the pair {}/{}".format(base, quote)), 404)
+
+        dates, rates = forecasts.pair(base, quote, start_date, end_date)
+        predictions = [{'PRED_DATE': pred_date, 'PRED_RATE': float(rate)} for pred_date, rate in zip(dates, rates)]
+        past = None
+        if history is not None and base in history.index and quote in history.index:
+            dates, rates = history.pair(base, quote, start_date, end_date)
+            past = [{'DATE': rate_date, 'RATE': float(rate)} for rate_date, rate in zip(dates, rates)]
+
+        key = ('pair', base, quote, start_date, end_date)
+        etag = hashlib.sha1("{}|{}".format(version, key).encode("utf-8")).hexdigest()
+        response = jsonify(version=version, base=base, quote=quote, predictions=predictions, history=past)
+        return conditional_response(response, etag, updated_at)
+    except Exception as e:
+        logger.error(e)
+        return make_response(jsonify(error="Not able to access the predictions"), 500)
@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger("xchangeratepred")
+
+
+class PredictionCache(object):
+    """
+    In-process read-through cache for prediction query results.
+
+    Every cached result belongs to a predictions version, the stamp that score_model writes together with the
+    predictions. The stamp is looked up at most once every check_interval seconds; when it has changed, all cached
+    results are dropped and reloaded on their next use.
+    """
+
+    def __init__(self, load_version, check_interval=5, max_entries=256):
+        """
+        :param load_version: Function returning the current (VERSION, UPDATED_AT) stamp, or None if there is none
+        :param check_interval: Minimum number of seconds between two lookups of the version stamp
+        :param max_entries: Maximum number of results kept, the least recently used ones are dropped first
+        """
+        self.load_version = load_version
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._stamp = None
+        self._checked_at = None
+
+    def stamp(self):
+        """
+        :return: The current (VERSION, UPDATED_AT) stamp of the predictions, or (None, None) if there is none
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                stamp = self.load_version() or (None, None)
+                if stamp != self._stamp:
+                    logger.info("Predictions version changed to {}, clearing the prediction cache".format(stamp[0]))
+                    self._results.clear()
+                    self._stamp = stamp
+                self._checked_at = now
+            return self._stamp
+
+    def get(self, key, loader):
+        """
+        :param key: Hashable key of the result
+        :param loader: Function that loads the result on a cache miss
+        :return: Tuple of the result for key and the (VERSION, UPDATED_AT) stamp it was cached under, from which the
+                 validators of the response are to be built
+        """
+        stamp = self.stamp()
+        with self._lock:
+            if key in self._results and self._stamp == stamp:
+                self._results.move_to_end(key)
+                return self._results[key], stamp
+
+        result = loader()
+        with self._lock:
+            # A result loaded while the version changed is returned under the stamp it was requested with, but not kept
+            if self._stamp == stamp:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return result, stamp
+
+    def clear(self):
+        """ Drops all cached results and forces a lookup of the version stamp on the next use """
+        with self._lock:
+            self._results.clear()
+            self._checked_at = None
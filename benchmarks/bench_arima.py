@@ -0,0 +1,86 @@
+"""Benchmark of the ARIMA fits that dominate the train job.
+
+Fits every (currency, order) combination of the model config on the training window of the bundled rate store, once
+through statsmodels' ARIMA with method='css' and once through the NumPy/SciPy fast path of src.fast_arima, and reports
+the time of each and the largest difference between their forecasts.
+
+Run from the project directory:
+
+    `python -m benchmarks.bench_arima`
+"""
+
+import argparse
+import time
+import warnings
+from os import path
+
+import numpy as np
+import yaml
+from statsmodels.tsa.arima_model import ARIMA
+
+import config
+from src import fast_arima
+from src.load_data import read_rate_store, rates_frame
+
+
+def statsmodels_forecast(ts, FORECAST_PERIOD, P, D, Q):
+    """ The statsmodels fit that evaluate_model used for every order """
+    model_fit = ARIMA(ts, order=(P, D, Q)).fit(disp=0, maxiter=2000, method='css')
+    return model_fit.forecast(steps=FORECAST_PERIOD)[0]
+
+
+def fast_forecast(ts, FORECAST_PERIOD, P, D, Q):
+    return fast_arima.fit_forecast(ts, FORECAST_PERIOD, P, D, Q)[0]
+
+
+def run(func, series, orders, FORECAST_PERIOD):
+    """ :return: Tuple of the seconds taken to fit every (series, order) combination, and the forecasts """
+    forecasts = []
+    start = time.perf_counter()
+    for ts in series:
+        for order in orders:
+            try:
+                forecasts.append(func(ts, FORECAST_PERIOD, *order))
+            except (ValueError, np.linalg.LinAlgError):
+                forecasts.append(np.full(FORECAST_PERIOD, np.nan))
+    return time.perf_counter() - start, np.array(forecasts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the statsmodels and fast path ARIMA fits")
+    parser.add_argument("--store", default=path.join(config.PROJECT_HOME, "data/raw/exchange_rates.npz"))
+    parser.add_argument("--currencies", type=int, default=None, help="Only use the first n configured currencies")
+    args = parser.parse_args()
+
+    with open(config.MODEL_CONFIG, "r") as f:
+        train_config = yaml.load(f, Loader=yaml.FullLoader)["train_model"]
+
+    currencies = train_config["CURRENCIES"][:args.currencies]
+    FORECAST_PERIOD = train_config["FORECAST_PERIOD"]
+    models = train_config["ARIMA_models"]
+    orders = list(zip(models['P'], models['D'], models['Q']))
+
+    rates = rates_frame(read_rate_store(args.store), currencies)
+    values = np.asarray(rates[currencies], dtype=float)
+    series = [np.ascontiguousarray(values[:len(values) - FORECAST_PERIOD, j]) for j in range(len(currencies))]
+
+    print("{} currencies x {} orders, {} days".format(len(currencies), len(orders), len(series[0])))
+    fast_time, fast = run(fast_forecast, series, orders, FORECAST_PERIOD)
+    print("{:<30}{:>10.3f} s".format("fast_arima", fast_time))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            sm_time, sm = run(statsmodels_forecast, series, orders, FORECAST_PERIOD)
+        except NotImplementedError:
+            # statsmodels 0.13 and later removed arima_model.ARIMA, there is nothing to compare with
+            print("{:<30}{:>12}".format("statsmodels ARIMA", "unavailable"))
+            return
+
+    print("{:<30}{:>10.3f} s".format("statsmodels ARIMA", sm_time))
+    print("{:<30}{:>10.1f} x".format("speedup", sm_time / fast_time))
+    print("{:<30}{:>12.2e}".format("max relative difference", np.nanmax(np.abs(fast - sm) / np.abs(sm))))
+
+
+if __name__ == '__main__':
+    main()
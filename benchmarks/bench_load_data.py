@@ -0,0 +1,108 @@
+"""Micro-benchmark for turning the exchange rate JSON into the rates matrix used by training and scoring.
+
+Compares the per-currency list comprehensions that train_model and score_model used to run (one pass over the dates
+for every currency, string dates sorted by pandas) with a single pass over the parsed JSON (load_rates), with the
+streaming parser of src.stream_rates (read_rates) and with loading the same window from the .npz rate store, which is
+what training and scoring read. The JSON loaders are only kept here, as baselines for the rate store.
+
+Run from the project directory:
+
+    `python -m benchmarks.bench_load_data`
+"""
+
+import argparse
+import json
+import timeit
+from os import path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import config
+from src.load_data import read_rate_store, rates_frame
+from src.stream_rates import stream_rates
+
+
+def legacy_load(data, currencies):
+    """ The JSON to rates frame code that train_model and score_model each contained """
+    dates_list = list(data['rates'].keys())
+    inputs = {'DATE': dates_list}
+    for curr in currencies:
+        inputs[curr] = [data['rates'][date][curr] for date in dates_list]
+    rates = pd.DataFrame(data=inputs)
+    return rates.sort_values(by=['DATE'], ascending=True).reset_index(drop=True)
+
+
+def read_json(file_location):
+    with open(file_location, "r") as f:
+        return json.load(f)
+
+
+def load_rates(records, currencies=None):
+    """
+    Builds the date sorted rates matrix from the parsed JSON, walking the dates once
+    :param records: JSON in the {"rates": {date: {currency: rate}}} layout of the API
+    :param currencies: Currencies to be loaded. Defaults to all currencies found, with NaN for the missing dates
+    :return: Dataframe of float rates with a currency column each, indexed by the parsed dates in ascending order
+    """
+    day_rates = list(records['rates'].values())
+    if currencies is None:
+        currencies = sorted(set().union(*day_rates))
+        values = [[day.get(curr, np.nan) for curr in currencies] for day in day_rates]
+    else:
+        values = [[day[curr] for curr in currencies] for day in day_rates]
+
+    dates = np.array(list(records['rates'].keys()), dtype='datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    values = np.array(values, dtype=float).reshape(len(dates), len(currencies))[order]
+    return pd.DataFrame(data=values, index=pd.DatetimeIndex(dates[order], name='DATE'), columns=list(currencies))
+
+
+def read_rates(file_location, currencies=None, chunk_size=65536):
+    """ Streams the JSON file block by block through src.stream_rates, see load_rates for the result """
+    with open(file_location, 'rb') as input_file:
+        return stream_rates(iter(lambda: input_file.read(chunk_size), b''), currencies)
+
+
+def time_it(func, repeat, number):
+    """ Best time per call in milliseconds over repeat rounds of number calls """
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading of the exchange rate JSON")
+    parser.add_argument("--json", default=path.join(config.PROJECT_HOME, "data/raw/exchange_rates_dl.json"))
+    parser.add_argument("--store", default=path.join(config.PROJECT_HOME, "data/raw/exchange_rates.npz"))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(config.MODEL_CONFIG, "r") as f:
+        currencies = yaml.load(f, Loader=yaml.FullLoader)["train_model"]["CURRENCIES"]
+
+    data = read_json(args.json)
+
+    # Both paths must produce the same rates before their timings mean anything
+    legacy = legacy_load(data, currencies)
+    rates = load_rates(data, currencies)
+    assert np.array_equal(legacy[currencies].values, rates.values)
+    assert read_rates(args.json, currencies).equals(rates)
+
+    results = [
+        ("json.load", lambda: read_json(args.json)),
+        ("legacy list comprehensions", lambda: legacy_load(data, currencies)),
+        ("load_rates, configured currencies", lambda: load_rates(data, currencies)),
+        ("load_rates, all currencies", lambda: load_rates(data)),
+        ("json.load + load_rates", lambda: load_rates(read_json(args.json), currencies)),
+        ("read_rates (streamed)", lambda: read_rates(args.json, currencies)),
+        ("npz rate store + rates_frame", lambda: rates_frame(read_rate_store(args.store), currencies)),
+    ]
+
+    print("{} dates x {} currencies".format(len(data['rates']), len(currencies)))
+    for name, func in results:
+        print("{:<40}{:>10.3f} ms".format(name, time_it(func, args.repeat, args.number)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Benchmark suite for the train/score pipeline.
+
+Runs offline, on the bundled data/raw/exchange_rates_dl.json and a throwaway SQLite database, and times:
+
+- json_load: reading the JSON and building the rates matrix, with json.load and with the streaming parser, the
+  baselines for the .npz rate store that training and scoring read
+- evaluate_model: the configured ARIMA grid (and backtest folds) over the configured currencies
+- generate_predictions: forecasting the best model of every currency, by refitting it and from its stored state
+- create_ARIMA_Params / create_Predictions: the database writes
+- evaluate_model on synthetic random walks scaled up to N currencies and M years (--scale NxM)
+
+The model cache is not used, so every run fits every model. The results are saved as JSON in benchmarks/results, and
+compared with the previous results file (or the one given with --compare).
+
+Run from the project directory:
+
+    `python -m benchmarks.run_benchmarks`
+    `python -m benchmarks.run_benchmarks --quick`
+"""
+
+import argparse
+import glob
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from os import path, makedirs
+
+import numpy as np
+import pandas as pd
+import scipy
+import yaml
+
+import config
+from benchmarks.bench_load_data import read_json, load_rates, read_rates
+from src.create_dataset import Base, create_ARIMA_Params, create_Predictions
+from src.evaluate_model import evaluate_model
+from src.helpers.helpers import get_engine
+from src.score_model import generate_predictions
+from src.train_model import find_best_model, add_model_states
+
+RESULTS_DIR = path.join(config.PROJECT_HOME, "benchmarks/results")
+
+
+def timed(func, repeat):
+    """
+    :return: Tuple of the result of the last call and the list of seconds taken by each of the repeat calls
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def summary(times, **info):
+    return dict(info, best=min(times), median=float(np.median(times)), runs=len(times))
+
+
+def synthetic_rates(rates, n_currencies, n_years, seed=0):
+    """
+    Random walks with the volatilities of the real currencies, recycled up to n_currencies, over n_years of business
+    days
+    :param rates: Real rates frame, with a DATE column and a column per currency
+    :return: Rates frame in the same layout, with currencies named C000, C001, ...
+    """
+    rng = np.random.RandomState(seed)
+    values = rates.drop(columns='DATE').values
+    log_returns = np.diff(np.log(values), axis=0)
+    columns = np.arange(n_currencies) % values.shape[1]
+
+    dates = pd.bdate_range(end="2019-05-30", periods=int(n_years * 261))
+    steps = rng.normal(0, log_returns.std(axis=0)[columns], size=(len(dates), n_currencies))
+    synthetic = values[-1, columns] * np.exp(np.cumsum(steps, axis=0))
+
+    frame = pd.DataFrame(synthetic, columns=["C{:03d}".format(i) for i in range(n_currencies)])
+    frame.insert(0, 'DATE', dates.strftime("%Y-%m-%d"))
+    return frame
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=config.PROJECT_HOME,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'scipy': scipy.__version__, 'machine': platform.machine(),
+            'processor': platform.processor()}
+
+
+def run_suite(args, train_config, score_config):
+    results = {}
+    currencies = train_config['CURRENCIES'][:args.currencies]
+    FORECAST_PERIOD = train_config['FORECAST_PERIOD']
+    settings = {'FORECAST_PERIOD': FORECAST_PERIOD, 'ARIMA_models': train_config['ARIMA_models'],
+                'N_WORKERS': args.workers, 'BACKTEST_FOLDS': train_config.get('BACKTEST_FOLDS', 1)}
+
+    # JSON loading
+    rates, times = timed(lambda: load_rates(read_json(args.json), currencies), args.repeat)
+    rates = rates.reset_index()
+    rates['DATE'] = rates['DATE'].dt.strftime("%Y-%m-%d")
+    results['json_load'] = summary(times, dates=len(rates), currencies=len(currencies))
+    print_result('json_load', results['json_load'])
+    _, times = timed(lambda: read_rates(args.json, currencies), args.repeat)
+    results['json_stream_load'] = summary(times, dates=len(rates), currencies=len(currencies))
+    print_result('json_stream_load', results['json_stream_load'])
+
+    # Training over the configured grid
+    n_orders = len(settings['ARIMA_models']['P'])
+    models, times = timed(lambda: evaluate_model(rates, CURRENCIES=currencies, **settings), args.repeat)
+    results['evaluate_model'] = summary(times, currencies=len(currencies), orders=n_orders, workers=args.workers,
+                                        folds=settings['BACKTEST_FOLDS'])
+    print_result('evaluate_model', results['evaluate_model'])
+
+    # Scoring the best model of every currency
+    best_models = find_best_model(models)
+    predictions, times = timed(lambda: generate_predictions(rates, best_models, score_config['FORECAST_PERIOD']),
+                               args.repeat)
+    results['generate_predictions'] = summary(times, currencies=len(currencies))
+    print_result('generate_predictions', results['generate_predictions'])
+
+    # Scoring from the filter states fitted at training time, with the last FORECAST_PERIOD days as new observations
+    best_models, times = timed(lambda: add_model_states(rates[:-FORECAST_PERIOD], find_best_model(models),
+                                                        args.workers), args.repeat)
+    results['add_model_states'] = summary(times, currencies=len(currencies))
+    print_result('add_model_states', results['add_model_states'])
+    _, times = timed(lambda: generate_predictions(rates, best_models, score_config['FORECAST_PERIOD']), args.repeat)
+    results['generate_predictions_from_state'] = summary(times, currencies=len(currencies))
+    print_result('generate_predictions_from_state', results['generate_predictions_from_state'])
+
+    # Database writes into a throwaway SQLite database
+    with tempfile.TemporaryDirectory() as directory:
+        engine = get_engine("sqlite:///{}".format(path.join(directory, "benchmark.db")))
+        Base.metadata.create_all(engine)
+        _, times = timed(lambda: create_ARIMA_Params(engine, best_models), args.repeat)
+        results['create_ARIMA_Params'] = summary(times, rows=len(best_models))
+        print_result('create_ARIMA_Params', results['create_ARIMA_Params'])
+        _, times = timed(lambda: create_Predictions(engine, predictions), args.repeat)
+        results['create_Predictions'] = summary(times, rows=len(predictions))
+        print_result('create_Predictions', results['create_Predictions'])
+        engine.dispose()
+
+    # Synthetic scale-ups
+    for scale in args.scale:
+        n_currencies, n_years = [float(x) for x in scale.lower().split("x")]
+        synthetic = synthetic_rates(rates, int(n_currencies), n_years)
+        _, times = timed(lambda: evaluate_model(synthetic, **settings), args.repeat)
+        name = "evaluate_model_{}".format(scale)
+        results[name] = summary(times, currencies=int(n_currencies), dates=len(synthetic), orders=n_orders,
+                                workers=args.workers, folds=settings['BACKTEST_FOLDS'])
+        print_result(name, results[name])
+
+    return results
+
+
+def print_result(name, result, previous=None):
+    line = "{:<32}{:>10.4f} s best{:>10.4f} s median".format(name, result['best'], result['median'])
+    if previous is not None:
+        line += "{:>10.2f} x previous".format(result['best'] / previous['best'])
+    print(line)
+
+
+def latest_results():
+    files = sorted(glob.glob(path.join(RESULTS_DIR, "*.json")))
+    return files[-1] if files else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the train/score pipeline on the bundled dataset")
+    parser.add_argument("--json", default=path.join(config.PROJECT_HOME, "data/raw/exchange_rates_dl.json"))
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="N_WORKERS used for evaluate_model")
+    parser.add_argument("--currencies", type=int, default=None, help="Only use the first n configured currencies")
+    parser.add_argument("--scale", nargs="*", default=["62x2", "31x4"],
+                        help="Synthetic scale-ups as <currencies>x<years>")
+    parser.add_argument("--quick", action="store_true", help="One run, 4 currencies and no scale-ups")
+    parser.add_argument("--compare", default=None, help="Results file to compare with. Defaults to the latest one")
+    parser.add_argument("--no-save", action="store_true", help="Do not save the results")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat, args.currencies, args.scale = 1, 4, []
+
+    # The pipeline logs every fit and write, which would drown the results
+    logging.basicConfig(level=logging.WARNING)
+
+    with open(config.MODEL_CONFIG, "r") as f:
+        model_config = yaml.load(f, Loader=yaml.FullLoader)
+
+    compare = args.compare or latest_results()
+    results = {'started_at': datetime.now().isoformat(), 'environment': environment(),
+               'settings': {'repeat': args.repeat, 'workers': args.workers, 'currencies': args.currencies,
+                            'scale': args.scale},
+               'benchmarks': run_suite(args, model_config['train_model'], model_config['score_model'])}
+
+    if compare is not None:
+        with open(compare, "r") as f:
+            previous = json.load(f)
+        print("\nCompared with {} (commit {})".format(path.basename(compare), previous['environment']['commit']))
+        for name, result in results['benchmarks'].items():
+            print_result(name, result, previous['benchmarks'].get(name))
+
+    if not args.no_save:
+        makedirs(RESULTS_DIR, exist_ok=True)
+        location = path.join(RESULTS_DIR, "{}.json".format(datetime.now().strftime("%Y%m%dT%H%M%S")))
+        with open(location, "w") as f:
+            json.dump(results, f, indent=2)
+        print("\nResults saved to {}".format(location))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,26 @@ PROJECT_HOME = path.dirname(path.abspath(__file__))
 DBCONFIG = path.join(PROJECT_HOME, 'config/dbconfig.yml')
 MODEL_CONFIG = path.join(PROJECT_HOME, 'config/model_config.yml')
 
+# Every run.py subcommand writes a JSON run report (stage timings, ARIMA fit durations, peak memory) to this directory
+RUN_REPORT_DIR = path.join(PROJECT_HOME, 'data/run_reports')
+
+# Scoring writes the pre-rendered index page and JSON of the predictions to this directory, which the app serves
+SNAPSHOT_DIR = path.join(PROJECT_HOME, 'data/snapshot')
+
+# Number of predictions per page of the index view, both of the snapshot and of the app (config/flask_config.py)
+PREDICTIONS_PAGE_SIZE = 100
+
 
 # The SQLALCHEMY_DATABASE_URI parameter is considered ONLY if DBCONFIG is set as None. Else it is ignored.
 DB_PATH = path.join(PROJECT_HOME, 'data/XchangeRatePredictor.db')
-SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(DB_PATH)
\ No newline at end of file
+SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(DB_PATH)
+
+# Connection pool settings for every engine created through src.helpers.get_engine. pool_size and max_overflow are not
+# used for sqlite. pool_pre_ping checks connections before use and pool_recycle (seconds) replaces connections before
+# RDS times them out.
+DB_POOL = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_recycle': 3600,
+    'pool_pre_ping': True
+}
@@ -1,14 +1,18 @@
 import os
 from os import path
 
+import config
+
 conn_type = "mysql+pymysql"
 user = os.environ.get("MYSQL_USER")
 password = os.environ.get("MYSQL_PASSWORD")
 host = os.environ.get("MYSQL_HOST")
 port = os.environ.get("MYSQL_PORT")
 DATABASE_NAME = 'msia423'
-# Use the following SQLALCHEMY_DATABASE_URI for RDS
-SQLALCHEMY_DATABASE_URI = "{}://{}:{}@{}:{}/{}".format(conn_type, user, password, host, port, DATABASE_NAME)
+# Use the following SQLALCHEMY_DATABASE_URI for RDS. The SQLALCHEMY_DATABASE_URI environment variable, when set, takes
+# precedence, e.g. to point the app at a sqlite database
+SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI") or \
+    "{}://{}:{}@{}:{}/{}".format(conn_type, user, password, host, port, DATABASE_NAME)
 
 
 PROJECT_HOME = path.dirname(path.dirname(path.abspath(__file__)))
@@ -16,12 +20,28 @@ DB_PATH = path.join(PROJECT_HOME, 'data/XchangeRatePredictor.db')
 # Use the following SQLALCHEMY_DATABASE_URI for sqlite
 #SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(DB_PATH)
 
-SQLALCHEMY_TRACK_MODIFICATIONS = True
-
 # Flask config
 HOST = "0.0.0.0"
 PORT = 3000
 APP_NAME = "xchangeratepred"
 
 DEBUG = True
+
+# The predictions version stamp is looked up at most once per PREDICTION_CACHE_CHECK_SECONDS
+PREDICTION_CACHE_CHECK_SECONDS = 5
+PREDICTION_CACHE_MAX_ENTRIES = 256
+
+# Number of predictions per page of the index view, and the largest page that can be requested with limit. The page
+# size is defined in config.py, which the snapshot page is rendered with as well
+PREDICTIONS_PAGE_SIZE = config.PREDICTIONS_PAGE_SIZE
+PREDICTIONS_MAX_PAGE_SIZE = 1000
+
+# Snapshot of the predictions written by score_model (SNAPSHOT_DIR in config.py). The unfiltered index page and JSON
+# are served from it without a database query. Set to None to always query the database
+SNAPSHOT_DIR = path.join(PROJECT_HOME, 'data/snapshot')
+
+# Rate store (RAW_DATA_LOCATION in config/model_config.yml) that the history of the cross-rate pairs is derived from,
+# over the last CROSS_RATE_HISTORY_DAYS days. Set to None to serve the forecasts of the pairs only
+RATE_STORE = path.join(PROJECT_HOME, 'data/raw/exchange_rates.npz')
+CROSS_RATE_HISTORY_DAYS = 365
 LOGGING_CONFIG = "config/logging/local.conf"
\ No newline at end of file
@@ -12,47 +12,69 @@ To create a database for Exchange Rates:
 To acquire the exchange rate data:
 
     `python run.py acquire`
+
+To acquire the data, train the models and score the predictions in one process:
+
+    `python run.py pipeline`
+
+Every command writes a JSON run report with the time taken by each stage, the duration of each ARIMA fit and the peak
+memory to config.RUN_REPORT_DIR. To also profile a command with cProfile:
+
+    `python run.py --profile train`
 """
 
 import argparse
+import importlib
 
-import logging.config
-logging.config.fileConfig("config/logging/local.conf")
-logger = logging.getLogger("xchangeratepred")
+# Subcommand: (module, function, description), with None for the functions of this module. The module of a subcommand
+# is only imported when it is run, so that short subcommands such as create_db do not load pandas, statsmodels, boto3
+# or Flask
+COMMANDS = {
+    "acquire": ("src.acquire_data", "acquire_rates", "Acquire exchange rate data"),
+    "create_db": ("src.create_dataset", "create_db", "Create rates database"),
+    "train": ("src.train_model", "train_model", "Train ARIMA models"),
+    "score": ("src.score_model", "score_model", "Score Predictions"),
+    "pipeline": ("src.pipeline", "run_pipeline", "Acquire, train and score in one process"),
+    "app": (None, "run_app", "Run Flask app"),
+}
 
-from src.create_dataset import create_db
-from src.acquire_data import acquire_rates
-from src.train_model import train_model
-from src.score_model import score_model
-from app.app import app
 
 def run_app(args):
+    from app.app import app
     app.run(debug=app.config["DEBUG"], port=app.config["PORT"], host=app.config["HOST"])
 
 
-if __name__ == '__main__':
+def load_command(command):
+    """
+    :param command: Name of the subcommand
+    :return: The function that runs the subcommand, from its module
+    """
+    module, function, _ = COMMANDS[command]
+    if module is None:
+        return globals()[function]
+    return getattr(importlib.import_module(module), function)
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Run components of the model source code")
-    subparsers = parser.add_subparsers()
+    parser.add_argument("--profile", action="store_true", help="Profile the command with cProfile")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
 
-    # Sub-parser for acquiring exchange rate data
-    sb_acquire = subparsers.add_parser("acquire", description="Acquire exchange rate data")
-    sb_acquire.set_defaults(func=acquire_rates)
+    for command, (_, _, description) in COMMANDS.items():
+        subparsers.add_parser(command, description=description)
 
-    # Sub-parser for creating a database
-    sb_create = subparsers.add_parser("create_db", description="Create rates database")
-    sb_create.set_defaults(func=create_db)
+    return parser.parse_args(argv)
 
-    # Sub-parser for training the model
-    sb_train = subparsers.add_parser("train", description="Train ARIMA models")
-    sb_train.set_defaults(func=train_model)
 
-    # Sub-parser for scoring the model
-    sb_score = subparsers.add_parser("score", description="Score Predictions")
-    sb_score.set_defaults(func=score_model)
+if __name__ == '__main__':
+    args = parse_args()
 
-    # Sub-parser for running flask app
-    sb_run = subparsers.add_parser("app", description="Run Flask app")
-    sb_run.set_defaults(func=run_app)
+    # Logging is configured once the arguments are valid. Loggers created by modules imported before are kept enabled
+    import logging.config
+    logging.config.fileConfig("config/logging/local.conf", disable_existing_loggers=False)
+    logger = logging.getLogger("xchangeratepred")
 
-    args = parser.parse_args()
-    args.func(args)
+    from src.helpers import instrumentation
+    args.func = load_command(args.command)
+    instrumentation.run(args.func, args, args.command, profile=args.profile)
@@ -1,19 +1,21 @@
 import sys
-import json
-import requests
-import boto3
+import numpy as np
 import yaml
 import config
-import botocore
 from os import path
-from src.helpers.helpers import invoke_api
+from datetime import date, datetime, timedelta
+from src.helpers.helpers import fetch_all
+from src.load_data import read_rate_store
+from src.stream_rates import parse_rates
+from src.helpers import instrumentation
+from src.helpers.s3_transfer import upload_file
 
 import logging.config
 logger = logging.getLogger(__name__)
 
 
 def acquire_rates(args):
-    """Calls API to get exchange rate data and dumps the JSON in S3 bucket
+    """Brings the local rate store up to date through the API and dumps it in S3 bucket
     """
     try:
         with open(config.MODEL_CONFIG, "r") as f:
@@ -22,34 +24,195 @@ def acquire_rates(args):
         logger.error(e)
         sys.exit(1)
 
-    # Construct the API URL from the configs set in the yaml
+    # Without an END_DATE the rates are acquired up to today
     load_config = model_config["acquire_rates"]
     base_url = load_config["BASE_URL"]
     start_date = load_config["START_DATE"]
-    end_date = load_config["END_DATE"]
-    api_url = "{base_url}?start_at={start_date}&end_at={end_date}&base=USD"
-    api_url = api_url.format(base_url=base_url, start_date=start_date,
-                                         end_date=end_date)
-    logger.debug(api_url)
-
-    result = invoke_api(api_url)
+    end_date = load_config["END_DATE"] or datetime.now().date()
 
-    # Store the JSON locally first
+    # Only the dates missing from the local store are fetched from the API
     file_location = path.join(config.PROJECT_HOME, load_config["RAW_DATA_LOCATION"])
     logger.debug(file_location)
-    write_records(result, file_location)
+    update_rate_store(file_location, base_url, start_date, end_date, load_config.get("API"))
 
     # Now dump it to S3 bucket
     bucket_name = load_config["S3_LOCATION"]
     file_name = load_config["S3_FILE_NAME"]
-    write_to_S3(file_location, bucket_name, file_name)
+    write_to_S3(file_location, bucket_name, file_name, load_config.get("S3_TRANSFER"))
+
+
+def build_api_url(base_url, start_date, end_date):
+    """
+    :param base_url: The history endpoint of the exchange rates API
+    :param start_date: First date of the range
+    :param end_date: Last date of the range
+    :return: API URL for the USD based rates between start_date and end_date
+    """
+    api_url = "{base_url}?start_at={start_date}&end_at={end_date}&base=USD"
+    return api_url.format(base_url=base_url, start_date=start_date, end_date=end_date)
+
+
+def to_date(value):
+    """ Converts a date, datetime, numpy datetime64 or 'YYYY-MM-DD' string (as found in the yaml config, the API JSON and
+    the rate store) to a date """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def date_chunks(start_date, end_date, chunk_days):
+    """
+    Splits a range of dates into consecutive chunks
+    :param start_date: First date of the range
+    :param end_date: Last date of the range
+    :param chunk_days: Maximum number of days per chunk
+    :return: List of (first date, last date) of every chunk, in order
+    """
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def fetch_rates(base_url, start_date, end_date, CHUNK_DAYS=90, MAX_CONCURRENCY=4, TIMEOUT=30, RETRIES=3, BACKOFF=0.5,
+                **kwargs):
+    """
+    Calls the API for the rates between start_date and end_date. Long ranges are split into chunks of CHUNK_DAYS days
+    that are fetched concurrently. Every response is parsed as it is streamed in, straight into a rates array allocated
+    for its chunk.
+    :param start_date: First date of the range (date)
+    :param end_date: Last date of the range (date)
+    :param CHUNK_DAYS: Maximum number of days per API call
+    :param MAX_CONCURRENCY: Maximum number of API calls in flight
+    :param TIMEOUT: Seconds to wait for the connection and for every read
+    :param RETRIES: Number of retries of a failed API call
+    :param BACKOFF: Seconds before the first retry, doubled for every next one
+    :param kwargs: yaml config
+    :return: List with a dataframe of the rates of every currency in the response of each chunk, indexed by date, in
+             date order
+    """
+    import requests
+    chunks = date_chunks(start_date, end_date, CHUNK_DAYS)
+    ranges = {build_api_url(base_url, chunk_start, chunk_end): (chunk_start, chunk_end)
+              for chunk_start, chunk_end in chunks}
+
+    def parse(api_url, body):
+        return parse_rates(body, None, *ranges[api_url])
+
+    try:
+        with instrumentation.stage("api_call", calls=len(ranges), start_date=start_date, end_date=end_date):
+            return fetch_all(list(ranges), parse, MAX_CONCURRENCY, TIMEOUT, RETRIES, BACKOFF)
+    except requests.exceptions.RequestException as e:
+        logger.error("Unable to call the API: {}".format(e))
+        sys.exit(1)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+
+
+def rates_to_store(rates):
+    """
+    Converts rates to the columnar layout of the rate store
+    :param rates: Dataframe of rates with a currency column each, indexed by date
+    :return: Dictionary with the sorted dates (datetime64), the sorted currencies and the (dates x currencies) rates
+    """
+    return {"dates": rates.index.values.astype("datetime64[D]"),
+            "currencies": np.array(rates.columns, dtype=str),
+            "rates": rates.values}
 
 
-def write_records(records, file_location):
-    """Persist API response set to file.
+def merge_stores(store, new):
+    """
+    Merges new rates into the rate store. Rates in new take precedence for dates present in both.
+    :return: Rate store covering the dates and currencies of both
+    """
+    dates = np.union1d(store["dates"], new["dates"])
+    currencies = np.union1d(store["currencies"], new["currencies"]).astype(str)
+
+    rates = np.full((len(dates), len(currencies)), np.nan)
+    for part in (store, new):
+        rows = np.searchsorted(dates, part["dates"])
+        cols = np.searchsorted(currencies, part["currencies"])
+        rates[np.ix_(rows, cols)] = part["rates"]
+
+    merged = dict(store)
+    merged.update({"dates": dates, "currencies": currencies, "rates": rates})
+    return merged
+
+
+def update_rate_store(file_location, base_url, start_date, end_date, API=None):
+    """
+    Brings the local rate store up to date for the start_date..end_date window. The store records the range of dates
+    it has ingested (start_at/end_at), so the API is only called for the dates that it does not cover yet and the new
+    rates are merged in.
+    :param file_location: Location of the rate store
+    :param base_url: The history endpoint of the exchange rates API
+    :param start_date: First date that the store needs to cover
+    :param end_date: Last date that the store needs to cover
+    :param API: Optional settings of the API calls (CHUNK_DAYS, MAX_CONCURRENCY, TIMEOUT, RETRIES, BACKOFF)
+    :return: The rate store, which may cover more dates than the requested window
+    """
+    start_date = to_date(start_date)
+    end_date = to_date(end_date)
+
+    if path.exists(file_location):
+        store = read_rate_store(file_location)
+    else:
+        store = {"dates": np.array([], dtype="datetime64[D]"),
+                 "currencies": np.array([], dtype=str),
+                 "rates": np.empty((0, 0))}
+
+    missing = []
+    store_end = None
+    if "start_at" not in store or "end_at" not in store:
+        missing.append((start_date, end_date))
+    else:
+        store_start = to_date(store["start_at"])
+        store_end = to_date(store["end_at"])
+        if start_date < store_start:
+            missing.append((start_date, store_start - timedelta(days=1)))
+        if end_date > store_end:
+            missing.append((store_end + timedelta(days=1), end_date))
+        start_date = min(start_date, store_start)
+
+    if not missing:
+        logger.info("Rate store is already up to date")
+        return store
+
+    for missing_start, missing_end in missing:
+        n_dates = 0
+        for rates in fetch_rates(base_url, missing_start, missing_end, **(API or {})):
+            store = merge_stores(store, rates_to_store(rates))
+            n_dates += len(rates)
+        logger.info("Fetched rates for {} dates between {} and {}".format(n_dates, missing_start, missing_end))
+
+    # The store only covers the dates up to the last one the API returned, so that the dates without published rates
+    # yet (e.g. today, before the rates are out) are fetched again by the next run
+    if len(store["dates"]):
+        end_date = min(end_date, to_date(store["dates"].max()))
+        if store_end is not None:
+            end_date = max(end_date, store_end)
+    else:
+        end_date = store_end
+
+    if end_date is not None:
+        store["start_at"] = np.datetime64(start_date, "D")
+        store["end_at"] = np.datetime64(end_date, "D")
+    write_rate_store(store, file_location)
+
+    return store
+
+
+def write_rate_store(store, file_location):
+    """Persist the rate store to file as uncompressed NumPy arrays (.npz).
 
     Args:
-        records: JSON containing exchange rate data.
+        store: Rate store with the dates, currencies and rates arrays and the start_at/end_at range it covers.
         file_location: Location to write file to.
 
     Returns:
@@ -59,28 +222,34 @@ def write_records(records, file_location):
         if not file_location:
             raise FileNotFoundError
 
-        num_records = len(records)
-        logger.debug("Writing {} records to {}".format(num_records, file_location))
+        logger.debug("Writing {} dates of rates to {}".format(len(store["dates"]), file_location))
 
-        with open(file_location, "w+") as output_file:
-            json.dump(records, output_file, indent=2)
+        # Written through a file handle, so that numpy does not append .npz to the configured name
+        with instrumentation.stage("rate_store_write", location=file_location):
+            with open(file_location, "wb") as output_file:
+                np.savez(output_file, **store)
 
     except FileNotFoundError:
         logger.error("Please provide a valid file location to persist data.")
         sys.exit(1)
 
 
-def write_to_S3(file_location, bucket_name, file_name):
+def write_to_S3(file_location, bucket_name, file_name, S3_TRANSFER=None):
     """
-    :param file_location: The local file location from where the JSON will be retrieved
-    :param bucket_name: The S3 bucket where the retrieved JSON will be stored
-    :param file_name: The file name within the S3 bucket in which the retrieved JSON will be stored
+    :param file_location: The local file location from where the rate store will be retrieved
+    :param bucket_name: The S3 bucket where the rate store will be stored
+    :param file_name: The file name within the S3 bucket in which the rate store will be stored
+    :param S3_TRANSFER: Optional transfer settings (COMPRESS, MULTIPART_THRESHOLD_MB, MULTIPART_CHUNKSIZE_MB,
+                        MAX_CONCURRENCY)
     :return: None
     """
+    import botocore
     try:
-        s3 = boto3.resource('s3')
-        s3.Object(bucket_name, file_name).put(Body=open(file_location, 'rb'))
-        logger.info("JSON uploaded to S3 bucket")
+        if upload_file(file_location, bucket_name, file_name, **(S3_TRANSFER or {})):
+            logger.info("Rate store uploaded to S3 bucket")
     except botocore.exceptions.NoCredentialsError as e:
         logger.error("Invalid S3 credentials")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    except botocore.exceptions.ClientError as e:
+        logger.error(e)
+        sys.exit(1)
@@ -0,0 +1,55 @@
+import numpy as np
+from src.state_space import BatchARIMAStateSpace
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def rolling_origin(ts, order, params, FORECAST_PERIOD, N_FOLDS):
+    """
+    Rolling-origin backtest of a fitted ARIMA model.
+
+    The model is fitted once, on the data before the first forecast origin. The origin then walks forward
+    FORECAST_PERIOD days per fold, the last fold being the last FORECAST_PERIOD days of the series. At each fold the
+    model forecasts the next FORECAST_PERIOD days, and the observations of the fold are appended to the filtered state
+    with Kalman filter updates instead of refitting.
+    :param ts: Time series
+    :param order: (P, D, Q) order of the model
+    :param params: Parameters of the model fitted on ts[:len(ts) - N_FOLDS * FORECAST_PERIOD]
+    :param FORECAST_PERIOD: Number of days forecast at each fold
+    :param N_FOLDS: Number of folds
+    :return: Array with the MAPE of each fold
+    """
+    values = np.asarray(ts, dtype=float).reshape(-1, 1)
+    return rolling_origin_batch(values, [order], [params], FORECAST_PERIOD, N_FOLDS)[0]
+
+
+def rolling_origin_batch(values, orders, params, FORECAST_PERIOD, N_FOLDS):
+    """
+    Rolling-origin backtest of many fitted ARIMA models at once, see rolling_origin. The Kalman filters of all the
+    models are run together by BatchARIMAStateSpace, so every fold is one batched forecast and one batched update
+    :param values: (days x models) array with the time series of every model. A series may be repeated for several
+                   models, e.g. one currency with different orders
+    :param orders: List with the (P, D, Q) order of every model
+    :param params: List with the parameters of every model, fitted on its series before the first fold
+    :param FORECAST_PERIOD: Number of days forecast at each fold
+    :param N_FOLDS: Number of folds
+    :return: (models x N_FOLDS) array with the MAPE of each fold of every model
+    """
+    values = np.asarray(values, dtype=float)
+    first_origin = len(values) - N_FOLDS * FORECAST_PERIOD
+    if first_origin <= max([sum(order) for order in orders] + [0]):
+        raise ValueError("Series of {} days is too short for {} folds of {} days".format(len(values), N_FOLDS,
+                                                                                      FORECAST_PERIOD))
+
+    models = BatchARIMAStateSpace(params, orders).update(values[:first_origin])
+
+    MAPE = np.empty((len(orders), N_FOLDS))
+    for fold in range(N_FOLDS):
+        origin = first_origin + fold * FORECAST_PERIOD
+        actuals = values[origin:origin + FORECAST_PERIOD]
+        predictions = models.forecast(FORECAST_PERIOD)
+        MAPE[:, fold] = np.abs(predictions - actuals.T).sum(axis=1) * 100 / actuals.sum(axis=0)
+        models.update(actuals)
+
+    return MAPE
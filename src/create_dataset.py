@@ -2,12 +2,17 @@ import config
 import logging.config
 import yaml
 import sys
+import uuid
+from datetime import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, MetaData
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Index, LargeBinary, MetaData
+from sqlalchemy import and_, bindparam, select
+from sqlalchemy.dialects import mysql, postgresql
 from sqlalchemy.orm import sessionmaker
 
 from src.helpers.helpers import create_connection, get_session, get_engine
+from src.helpers import instrumentation
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +20,9 @@ Base = declarative_base()
 
 class ARIMA_Params(Base):
     """
-    Create data model for the database for capturing parameters for best ARIMA models for each currency pair
+    Create data model for the database for capturing parameters for best ARIMA models for each currency pair. STATE
+    holds the fitted model and its Kalman filter state after STATE_END_DATE (ARIMAStateSpace.to_bytes), so that scoring
+    only appends the newer observations instead of refitting.
     """
 
     __tablename__ = 'ARIMA_Params'
@@ -25,24 +32,64 @@ class ARIMA_Params(Base):
     D = Column(Integer, unique=False, nullable=False)
     Q = Column(Integer, unique=False, nullable=False)
     MAPE = Column(Float, unique=False, nullable=False)
+    STATE = Column(LargeBinary, unique=False, nullable=True)
+    STATE_END_DATE = Column(Date, unique=False, nullable=True)
 
     def __repr__(self):
         return '<ARIMA Params %r>' % self.CURRENCY
 
 
+class ARIMA_Backtest(Base):
+    """
+    Create data model for the database for capturing the MAPE of each fold of the rolling-origin backtest of the best
+    ARIMA model of each currency. The MAPE in ARIMA_Params is the average of these.
+    """
+
+    __tablename__ = 'ARIMA_Backtest'
+
+    CURRENCY = Column(String(10), primary_key=True)
+    FOLD = Column(Integer, primary_key=True, autoincrement=False)
+    P = Column(Integer, unique=False, nullable=False)
+    D = Column(Integer, unique=False, nullable=False)
+    Q = Column(Integer, unique=False, nullable=False)
+    MAPE = Column(Float, unique=False, nullable=False)
+
+    def __repr__(self):
+        return '<ARIMA Backtest %r, %r>' % (self.CURRENCY, self.FOLD)
+
+
 class Predictions(Base):
     """
-        Create data model for the database for capturing predictions
-        """
+    Create data model for the database for capturing predictions. The (CURRENCY, PRED_DATE) primary key serves the
+    pages of one or more currencies and the latest prediction date per currency from the index alone. The secondary
+    (PRED_DATE, CURRENCY) index serves date range filters over all currencies.
+    """
 
     __tablename__ = 'Predictions'
+    __table_args__ = (Index('ix_Predictions_PRED_DATE_CURRENCY', 'PRED_DATE', 'CURRENCY'),)
 
     CURRENCY = Column(String(10), primary_key=True)
-    PRED_DATE = Column(String(20), primary_key=True)
+    PRED_DATE = Column(Date, primary_key=True)
     PRED_RATE = Column(Float, unique=False, nullable=False)
 
     def __repr__(self):
-        return '<Predictions %r, %r>' % self.CURRENCY, self.PRED_DATE
+        return '<Predictions %r, %r>' % (self.CURRENCY, self.PRED_DATE)
+
+
+class Predictions_Version(Base):
+    """
+    Create data model for the database for capturing the version stamp of the predictions. The single row is replaced
+    every time the predictions are stored, so readers can tell when their cached predictions are out of date.
+    """
+
+    __tablename__ = 'Predictions_Version'
+
+    ID = Column(Integer, primary_key=True, autoincrement=False)
+    VERSION = Column(String(40), unique=False, nullable=False)
+    UPDATED_AT = Column(DateTime, unique=False, nullable=False)
+
+    def __repr__(self):
+        return '<Predictions Version %r>' % self.VERSION
 
 
 def create_db(args):
@@ -59,48 +106,125 @@ def create_db(args):
         sys.exit(1)
 
 
+def _upsert_statement(conn, table, key_columns):
+    """
+    Builds the dialect specific insert-or-update statement for table
+    :param conn: DB connection
+    :param table: SQLAlchemy table
+    :param key_columns: Names of the primary key columns
+    :return: Statement to be executed with a list of records, or None if the dialect has no upsert
+    """
+    update_columns = [column.name for column in table.columns if column.name not in key_columns]
+
+    if conn.dialect.name == "mysql":
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update({name: stmt.inserted[name] for name in update_columns})
+    elif conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(table)
+        return stmt.on_conflict_do_update(index_elements=key_columns,
+                                          set_={name: stmt.excluded[name] for name in update_columns})
+    elif conn.dialect.name == "sqlite":
+        return table.insert().prefix_with("OR REPLACE")
+
+    return None
+
+
+def upsert_records(conn, model, records, chunk_size=1000):
+    """
+    Replaces the contents of the table of model with records. The rows are upserted in chunks (executemany) and the
+    rows that are not in records anymore are deleted afterwards. Run inside a transaction (engine.begin()), readers see
+    either the old or the new rows but never an empty table.
+    :param conn: DB connection
+    :param model: Data model class of the table
+    :param records: List of dictionaries with a value for every column of the table
+    :param chunk_size: Number of rows sent per executemany call
+    :return: None
+    """
+    table = model.__table__
+    key_columns = [column.name for column in table.primary_key.columns]
+    new_keys = set(tuple(record[name] for name in key_columns) for record in records)
+
+    stmt = _upsert_statement(conn, table, key_columns)
+    key_match = and_(*[table.c[name] == bindparam("key_" + name) for name in key_columns])
+
+    old_keys = set(tuple(row) for row in conn.execute(select([table.c[name] for name in key_columns])))
+
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        if stmt is None:
+            # No upsert for this dialect: replace the existing rows of the chunk inside the transaction
+            existing = [{"key_" + name: record[name] for name in key_columns} for record in chunk
+                        if tuple(record[name] for name in key_columns) in old_keys]
+            if existing:
+                conn.execute(table.delete().where(key_match), existing)
+            conn.execute(table.insert(), chunk)
+        else:
+            conn.execute(stmt, chunk)
+
+    stale_keys = [dict(zip(["key_" + name for name in key_columns], key)) for key in old_keys - new_keys]
+    if stale_keys:
+        conn.execute(table.delete().where(key_match), stale_keys)
+
+    logger.debug("{} rows upserted and {} stale rows deleted in {}".format(len(records), len(stale_keys),
+                                                                          table.name))
+
+
 def create_ARIMA_Params(engine, df):
     """
     Stores ARIMA_Params in the database
     :param engine: DB engine
-    :param df: Dataframe containing ARIMA parameters
+    :param df: Dataframe containing ARIMA parameters, optionally with the STATE and its STATE_END_DATE ('YYYY-MM-DD')
     :return: None
     """
 
     try:
-        session = get_session(engine)
-        old_ARIMA_Params = session.query(ARIMA_Params.CURRENCY, ARIMA_Params.P, ARIMA_Params.D, ARIMA_Params.Q)
-        old_ARIMA_Params.delete()
-
-        session.bulk_insert_mappings(ARIMA_Params, df.to_dict(orient="records"))
-        session.commit()
+        records = df.to_dict(orient="records")
+        for record in records:
+            if record.get('STATE_END_DATE') is not None:
+                record['STATE_END_DATE'] = datetime.strptime(str(record['STATE_END_DATE'])[:10], "%Y-%m-%d").date()
+        with instrumentation.stage("db_write", table="ARIMA_Params", rows=len(df)), engine.begin() as conn:
+            upsert_records(conn, ARIMA_Params, records)
     except Exception as e:
         logger.error(e)
         sys.exit(1)
-    finally:
-        session.close()
-        return
 
 
-def create_Predictions(engine, df):
+def create_ARIMA_Backtest(engine, df):
     """
-    Stores Predictions in the database
+    Stores ARIMA_Backtest in the database
     :param engine: DB engine
-    :param df: Dataframe containing ARIMA parameters
+    :param df: Dataframe containing the CURRENCY, FOLD, P, D, Q and MAPE of every fold of the best models
     :return: None
     """
 
     try:
-        session = get_session(engine)
-        old_Predictions = session.query(Predictions.CURRENCY, Predictions.PRED_DATE, Predictions.PRED_RATE)
-        old_Predictions.delete()
+        records = df.to_dict(orient="records")
+        with instrumentation.stage("db_write", table="ARIMA_Backtest", rows=len(df)), engine.begin() as conn:
+            upsert_records(conn, ARIMA_Backtest, records)
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+
+
+def create_Predictions(engine, df):
+    """
+    Stores Predictions in the database, together with a new version stamp in the same transaction
+    :param engine: DB engine
+    :param df: Dataframe containing the CURRENCY, PRED_DATE ('YYYY-MM-DD') and PRED_RATE of every prediction
+    :return: The version stamp stored with the predictions (ID, VERSION and UPDATED_AT)
+    """
 
-        session.bulk_insert_mappings(Predictions, df.to_dict(orient="records"))
-        session.commit()
+    try:
+        records = df.to_dict(orient="records")
+        for record in records:
+            record['PRED_DATE'] = datetime.strptime(str(record['PRED_DATE'])[:10], "%Y-%m-%d").date()
+        version = {'ID': 1, 'VERSION': uuid.uuid4().hex, 'UPDATED_AT': datetime.utcnow().replace(microsecond=0)}
+        with instrumentation.stage("db_write", table="Predictions", rows=len(df)), engine.begin() as conn:
+            upsert_records(conn, Predictions, records)
+            upsert_records(conn, Predictions_Version, [version])
         logger.info("Predictions stored in the database")
     except Exception as e:
         logger.error(e)
         sys.exit(1)
-    finally:
-        session.close()
-        return
\ No newline at end of file
+
+    return version
@@ -0,0 +1,88 @@
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Every rate is fetched and forecast with respect to this currency
+BASE_CURRENCY = "USD"
+
+
+def cross_rate_matrix(rates):
+    """
+    Triangulates the rates of every currency pair from rates with respect to a common base currency
+    :param rates: (... x currencies) array of rates, in units of each currency per unit of the base currency
+    :return: (... x currencies x currencies) array whose [..., i, j] element is the rate of the pair i/j, in units of
+             currency j per unit of currency i
+    """
+    rates = np.asarray(rates, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return rates[..., None, :] / rates[..., :, None]
+
+
+class CrossRates(object):
+    """
+    Rates of every currency pair, derived from the rates with respect to BASE_CURRENCY by one vectorized division.
+
+    Only the series against the base currency are fetched and forecast; the rate of any other pair is the ratio of two
+    of them, so N forecast series give the forecasts of all N x N pairs. The whole (dates x currencies x currencies)
+    matrix is computed once, and a pair is then a slice of it.
+    """
+
+    def __init__(self, dates, currencies, rates):
+        """
+        :param dates: Sorted dates ('YYYY-MM-DD') of the rates
+        :param currencies: Currencies of the columns of rates
+        :param rates: (dates x currencies) array of rates with respect to BASE_CURRENCY. Missing rates are NaN
+        """
+        rates = np.asarray(rates, dtype=float).reshape(len(dates), len(currencies))
+        currencies = list(currencies)
+        if BASE_CURRENCY not in currencies:
+            currencies.append(BASE_CURRENCY)
+            rates = np.hstack((rates, np.ones((len(dates), 1))))
+
+        self.dates = np.asarray(dates, dtype=str)
+        self.currencies = currencies
+        self.index = {curr: i for i, curr in enumerate(currencies)}
+        self.matrix = cross_rate_matrix(rates)
+
+    @classmethod
+    def from_records(cls, records, date_column, rate_column):
+        """
+        :param records: List of dictionaries, or Dataframe, with the CURRENCY, date and rate of each rate
+        :param date_column: Name of the date column ('YYYY-MM-DD')
+        :param rate_column: Name of the rate column
+        :return: CrossRates of the records
+        """
+        import pandas as pd
+        records = pd.DataFrame(records, columns=['CURRENCY', date_column, rate_column])
+        rates = records.pivot_table(index=date_column, columns='CURRENCY', values=rate_column, aggfunc='last')
+        return cls([str(x)[:10] for x in rates.index], list(rates.columns), rates.values)
+
+    @classmethod
+    def from_store(cls, store, start_date=None, end_date=None):
+        """
+        :param store: Rate store with the dates, currencies and rates arrays
+        :param start_date: Optional first date ('YYYY-MM-DD')
+        :param end_date: Optional last date ('YYYY-MM-DD')
+        :return: CrossRates of the rate store
+        """
+        dates = store["dates"]
+        first = 0 if start_date is None else np.searchsorted(dates, np.datetime64(start_date, "D"), side="left")
+        last = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(end_date, "D"), side="right")
+        return cls(np.datetime_as_string(dates[first:last], unit="D"), [str(x) for x in store["currencies"]],
+                   store["rates"][first:last])
+
+    def pair(self, base, quote, start_date=None, end_date=None):
+        """
+        :param base: Base currency of the pair
+        :param quote: Quote currency of the pair
+        :param start_date: Optional first date to be returned ('YYYY-MM-DD')
+        :param end_date: Optional last date to be returned ('YYYY-MM-DD')
+        :return: Tuple of the dates and the rates (units of quote per unit of base) of the pair, without the dates on
+                 which either currency has no rate. Raises KeyError for an unknown currency
+        """
+        first = 0 if start_date is None else np.searchsorted(self.dates, start_date, side="left")
+        last = len(self.dates) if end_date is None else np.searchsorted(self.dates, end_date, side="right")
+        rates = self.matrix[first:last, self.index[base], self.index[quote]]
+        available = np.isfinite(rates)
+        return self.dates[first:last][available], rates[available]
@@ -1,65 +1,432 @@
-from statsmodels.tsa.arima_model import ARIMA
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
 import pandas as pd
 import sys
+import time
+from src.helpers.model_cache import ModelCache
+from src.backtest import rolling_origin, rolling_origin_batch
+from src.state_space import ARIMAStateSpace
+from src import fast_arima
+from src.helpers import instrumentation
 
 
 import logging.config
 logger = logging.getLogger(__name__)
 
 
+def fit_forecast(ts, FORECAST_PERIOD, P, D, Q, start_params=None):
+    """
+    Fits ARIMA for the p,d,q parameters on the time series and generates predictions for the forecast period. Orders up
+    to fast_arima.MAX_ORDER are fitted by the NumPy/SciPy CSS estimator of src.fast_arima, larger ones by statsmodels
+    :param start_params: Optional start values for the optimizer, e.g. the parameters of an earlier fit
+    :return: Tuple of the predictions and the fitted parameters
+    """
+    if fast_arima.supports_order(P, D, Q):
+        if start_params is not None:
+            try:
+                return fast_arima.fit_forecast(ts, FORECAST_PERIOD, P, D, Q, start_params, maxiter=2000)
+            except Exception as e:
+                logger.debug("Warm start failed, refitting from scratch: {}".format(e))
+        return fast_arima.fit_forecast(ts, FORECAST_PERIOD, P, D, Q, maxiter=2000)
+
+    # statsmodels is only loaded for the orders that the fast path does not support
+    from statsmodels.tsa.arima_model import ARIMA
+    model = ARIMA(ts, order=(P, D, Q))
+    if start_params is not None:
+        try:
+            model_fit = model.fit(start_params=start_params, disp=0, maxiter=2000, method='css')
+            return model_fit.forecast(steps=FORECAST_PERIOD)[0], model_fit.params
+        except Exception as e:
+            logger.debug("Warm start failed, refitting from scratch: {}".format(e))
+
+    model_fit = model.fit(disp=0, maxiter=2000, method='css')
+    return model_fit.forecast(steps=FORECAST_PERIOD)[0], model_fit.params
+
+
+def fit_params(ts, P, D, Q, start_params=None):
+    """
+    Fits ARIMA for the p,d,q parameters on the time series, by the fast path where it supports the order
+    :param start_params: Optional start values for the optimizer, e.g. the parameters of an earlier fit
+    :return: Tuple of the fitted parameters and the variance of the innovations (sigma2)
+    """
+    if fast_arima.supports_order(P, D, Q):
+        try:
+            params, resid = fast_arima.css_fit(ts, P, D, Q, start_params, maxiter=2000)
+        except Exception as e:
+            if start_params is None:
+                raise
+            logger.debug("Warm start failed, refitting from scratch: {}".format(e))
+            params, resid = fast_arima.css_fit(ts, P, D, Q, maxiter=2000)
+        return params, np.dot(resid, resid) / len(resid)
+
+    from statsmodels.tsa.arima_model import ARIMA
+    model = ARIMA(ts, order=(P, D, Q))
+    if start_params is not None:
+        try:
+            model_fit = model.fit(start_params=start_params, disp=0, maxiter=2000, method='css')
+            return model_fit.params, model_fit.sigma2
+        except Exception as e:
+            logger.debug("Warm start failed, refitting from scratch: {}".format(e))
+
+    model_fit = model.fit(disp=0, maxiter=2000, method='css')
+    return model_fit.params, model_fit.sigma2
+
+
+def _state_task(task):
+    """ Fits the model of a (ts, P, D, Q, start_params) task on the whole series and returns its fitted parameters and
+    the serialized filter state at the end of the series """
+    ts, P, D, Q, start_params = task
+    try:
+        params, sigma2 = fit_params(ts, P, D, Q, start_params)
+        return params, ARIMAStateSpace(params, (P, D, Q), sigma2).update(ts).to_bytes()
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+
+
+def fit_states(rates, best_models, N_WORKERS=1, cache=None):
+    """
+    Fits the best model of every currency on its whole series, for scoring without refitting
+    :param rates: Exchange rate data, with a DATE column and a rate column per currency
+    :param best_models: Dataframe with the CURRENCY, P, D and Q of the best model of every currency
+    :param N_WORKERS: Number of worker processes used to fit the ARIMA models
+    :param cache: Optional ModelCache used to warm-start the fits
+    :return: List with the serialized filter state (ARIMAStateSpace.to_bytes) of every model, after the last date of
+             rates, in the order of best_models
+    """
+    keys = []
+    tasks = []
+    for row in best_models.itertuples():
+        order = (int(row.P), int(row.D), int(row.Q))
+        ts = np.ascontiguousarray(rates[row.CURRENCY], dtype=float)
+        start_params = cache.get_start_params(row.CURRENCY, order, ts) if cache else None
+        keys.append((row.CURRENCY, order))
+        tasks.append((ts,) + order + (start_params,))
+
+    with instrumentation.stage("arima_state_fits", fits=len(tasks), workers=N_WORKERS):
+        results = map_tasks(_state_task, tasks, N_WORKERS, keys)
+
+    return [state for _, state in results]
+
+
 def ARIMAForecasting(ts, FORECAST_PERIOD, P, D, Q):
     """ Runs ARIMA for the p,d,q parameters on the time series and generates predictions for the forecast period """
 
     try:
-        model = ARIMA(ts, order=(P, D, Q))
-        model_fit = model.fit(disp=0, maxiter=2000, method='css')
-        prediction = model_fit.forecast(steps=FORECAST_PERIOD)[0]
+        prediction, _ = fit_forecast(ts, FORECAST_PERIOD, P, D, Q)
         return prediction
     except Exception as e:
         logger.error(e)
         sys.exit(1)
 
 
-def evaluate_model(rates, FORECAST_PERIOD, ARIMA_models, **kwargs):
+def _forecast_task(task):
+    """ Runs fit_forecast for a (ts, FORECAST_PERIOD, P, D, Q, start_params) task. Kept at module level so that it can
+    be pickled and sent to the worker processes """
+    try:
+        return fit_forecast(*task)
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+
+
+def _timed_task(func_task):
+    """ Runs a (func, task) pair and returns the result with the seconds it took, so that the fit durations of the
+    worker processes are reported back to the parent """
+    func, task = func_task
+    start = time.perf_counter()
+    result = func(task)
+    return result, time.perf_counter() - start
+
+
+def map_tasks(func, tasks, N_WORKERS=1, labels=None):
+    """
+    Runs func on every task, either serially or spread over a pool of worker processes
+    :param func: Module level function, so that it can be pickled and sent to the worker processes
+    :param tasks: List of arguments for func
+    :param N_WORKERS: Number of worker processes. With 1 (or fewer) the tasks are run serially in this process
+    :param labels: Optional (currency, order) of every task, under which the duration of each task is recorded in the
+                   run report
+    :return: List of results, in the same order as the tasks
+    """
+    func_tasks = [(func, task) for task in tasks]
+    if N_WORKERS is None or N_WORKERS <= 1 or len(tasks) <= 1:
+        timed = [_timed_task(func_task) for func_task in func_tasks]
+    else:
+        logger.debug("Running {} ARIMA fits over {} worker processes".format(len(tasks), N_WORKERS))
+        # Executor.map yields the results in submission order, so the output does not depend on which worker finishes
+        # first. A SystemExit raised in a worker is re-raised here when its result is collected.
+        chunksize = max(1, len(tasks) // (N_WORKERS * 4))
+        with ProcessPoolExecutor(max_workers=N_WORKERS) as executor:
+            timed = list(executor.map(_timed_task, func_tasks, chunksize=chunksize))
+
+    if labels is not None:
+        for (currency, order), (_, seconds) in zip(labels, timed):
+            instrumentation.record_fit(currency, order, seconds)
+    return [result for result, _ in timed]
+
+
+def run_forecasts(tasks, N_WORKERS=1, cache=None):
+    """
+    Fits an ARIMA model and generates predictions for every task, either serially or spread over a pool of worker
+    processes
+    :param tasks: List of (currency, ts, FORECAST_PERIOD, P, D, Q) tuples
+    :param N_WORKERS: Number of worker processes. With 1 (or fewer) the tasks are run serially in this process
+    :param cache: Optional ModelCache. Cached forecasts are reused and new fits are warm-started and added to it
+    :return: List of predictions, in the same order as the tasks
+    """
+    predictions = [None] * len(tasks)
+
+    # Only the tasks that miss the cache are fitted
+    pending = []
+    for i, (currency, ts, FORECAST_PERIOD, P, D, Q) in enumerate(tasks):
+        start_params = None
+        if cache is not None:
+            predictions[i] = cache.get_forecast(currency, (P, D, Q), ts, FORECAST_PERIOD)
+            if predictions[i] is not None:
+                continue
+            start_params = cache.get_start_params(currency, (P, D, Q), ts)
+        pending.append((i, (ts, FORECAST_PERIOD, P, D, Q, start_params)))
+
+    if cache is not None:
+        logger.info("{} of {} ARIMA models found in the model cache".format(len(tasks) - len(pending), len(tasks)))
+
+    labels = [(tasks[i][0], tasks[i][3:6]) for i, _ in pending]
+    with instrumentation.stage("arima_fits", fits=len(pending), workers=N_WORKERS):
+        results = map_tasks(_forecast_task, [task for _, task in pending], N_WORKERS, labels)
+
+    for (i, _), (prediction, params) in zip(pending, results):
+        predictions[i] = prediction
+        if cache is not None:
+            currency, ts, FORECAST_PERIOD, P, D, Q = tasks[i]
+            cache.put(currency, (P, D, Q), ts, prediction, params)
+
+    if cache is not None and pending:
+        cache.save()
+
+    return predictions
+
+
+def _backtest_task(task):
+    """ Fits the model of a (ts, FORECAST_PERIOD, P, D, Q, N_FOLDS, start_params) task on the data before the first fold
+    and returns the fitted parameters """
+    ts, FORECAST_PERIOD, P, D, Q, N_FOLDS, start_params = task
+    try:
+        _, params = fit_forecast(ts[:len(ts) - N_FOLDS * FORECAST_PERIOD], FORECAST_PERIOD, P, D, Q, start_params)
+        return params
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+
+
+def backtest_models(rates, FORECAST_PERIOD, ARIMA_models, N_FOLDS, CURRENCIES=None, N_WORKERS=1, cache=None):
+    """
+    Rolling-origin backtest of different ARIMA models: each model is fitted once per currency and then evaluated over
+    N_FOLDS consecutive forecast periods ending with the last day of the data. The fits run per model in the workers,
+    the backtests of all the (currency, model) pairs then run together as one batched Kalman filter
+    :param rates: Exchange rate data
+    :param FORECAST_PERIOD: Number of days forecast at each fold
+    :param ARIMA_models: Dictionary with the P, D and Q values of the ARIMA models to be evaluated
+    :param N_FOLDS: Number of folds
+    :param CURRENCIES: Currencies to be evaluated. Defaults to every rate column in the rates data
+    :param N_WORKERS: Number of worker processes used to fit the ARIMA models
+    :param cache: Optional ModelCache used to warm-start the fits
+    :return: Dataframe with the P, D, Q, CURRENCY, FOLD and MAPE of every fold
+    """
+    if CURRENCIES is None:
+        CURRENCIES = [col for col in rates.columns if col != 'DATE']
+    values = np.asarray(rates[CURRENCIES], dtype=float)
+    train_length = len(values) - N_FOLDS * FORECAST_PERIOD
+
+    keys = []
+    columns = []
+    tasks = []
+    for i in range(len(ARIMA_models['P'])):
+        for j in range(len(CURRENCIES)):
+            order = (ARIMA_models['P'][i], ARIMA_models['D'][i], ARIMA_models['Q'][i])
+            ts = np.ascontiguousarray(values[:, j])
+            start_params = cache.get_start_params(CURRENCIES[j], order, ts[:train_length]) if cache else None
+            keys.append((CURRENCIES[j], order))
+            columns.append(j)
+            tasks.append((ts, FORECAST_PERIOD) + order + (N_FOLDS, start_params))
+
+    with instrumentation.stage("arima_backtest_fits", fits=len(tasks), workers=N_WORKERS):
+        results = map_tasks(_backtest_task, tasks, N_WORKERS, keys)
+
+    with instrumentation.stage("arima_backtests", models=len(tasks), folds=N_FOLDS):
+        try:
+            fold_MAPE = rolling_origin_batch(values[:, columns], [order for _, order in keys], results,
+                                             FORECAST_PERIOD, N_FOLDS)
+        except Exception as e:
+            logger.error(e)
+            sys.exit(1)
+
+    if cache is not None:
+        for (currency, order), task, params in zip(keys, tasks, results):
+            cache.put(currency, order, task[0][:train_length], [], params)
+        cache.save()
+
+    folds = pd.DataFrame([{'P': order[0], 'D': order[1], 'Q': order[2], 'CURRENCY': currency, 'FOLD': fold,
+                           'MAPE': MAPE}
+                          for (currency, order), model_MAPE in zip(keys, fold_MAPE)
+                          for fold, MAPE in enumerate(model_MAPE)])
+    return folds
+
+
+def _search_task(task):
+    """ Scores the model of a (ts, FORECAST_PERIOD, P, D, Q, N_FOLDS) task: it is fitted on the data before the last
+    N_FOLDS forecast periods and scored on them, returning the MAPE of each fold. A model that cannot be fitted gets NaN
+    MAPEs instead of stopping the search """
+    ts, FORECAST_PERIOD, P, D, Q, N_FOLDS = task
+    train = ts[:len(ts) - N_FOLDS * FORECAST_PERIOD]
+    try:
+        with np.errstate(all='ignore'):
+            prediction, params = fit_forecast(train, FORECAST_PERIOD, P, D, Q)
+            if N_FOLDS > 1:
+                return rolling_origin(ts, (P, D, Q), params, FORECAST_PERIOD, N_FOLDS)
+            actuals = ts[len(train):]
+            return np.array([np.abs(np.asarray(prediction) - actuals).sum() * 100 / actuals.sum()])
+    except Exception as e:
+        logger.debug("ARIMA({}, {}, {}) could not be fitted: {}".format(P, D, Q, e))
+        return np.full(N_FOLDS, np.nan)
+
+
+def halving_search(rates, FORECAST_PERIOD, SEARCH, CURRENCIES=None, N_WORKERS=1, BACKTEST_FOLDS=1, return_folds=False):
+    """
+    Successive-halving search over a range of ARIMA orders, run separately for every currency. All the candidate orders
+    are first fitted on the most recent MIN_WINDOW days of the training data. Only the best 1 / ETA of them, by MAPE,
+    go on to the next round, which fits them on a window ETA times longer, until the survivors are fitted on the whole
+    training data.
+    :param rates: Exchange rate data
+    :param FORECAST_PERIOD: Number of days for which predictions are to be generated
+    :param SEARCH: Search settings: the [min, max] range of each of P, D and Q, MIN_WINDOW and ETA
+    :param CURRENCIES: Currencies to be evaluated. Defaults to every rate column in the rates data
+    :param N_WORKERS: Number of worker processes used to fit the ARIMA models
+    :param BACKTEST_FOLDS: Number of forecast periods every candidate is scored on, as in evaluate_model
+    :param return_folds: Whether to also return the MAPE of each fold, as in evaluate_model
+    :return: Every candidate order with a MAPE_<CURRENCY> column per currency. The MAPE is the one of the last round
+             the candidate took part in for that currency, and NaN if it was dropped before the last round. With
+             return_folds, a tuple of these and the MAPE of each fold of the candidates of the last round
+    """
+    if CURRENCIES is None:
+        CURRENCIES = [col for col in rates.columns if col != 'DATE']
+    orders = list(product(*[range(SEARCH[x][0], SEARCH[x][1] + 1) for x in ('P', 'D', 'Q')]))
+    N_FOLDS = max(1, BACKTEST_FOLDS)
+    ETA = SEARCH.get('ETA', 3)
+
+    values = np.asarray(rates[CURRENCIES], dtype=float)
+    holdout = N_FOLDS * FORECAST_PERIOD
+    train_length = len(values) - holdout
+
+    # Training window of every round, the last round using all of the training data
+    windows = []
+    window = SEARCH.get('MIN_WINDOW', 60)
+    while window < train_length:
+        windows.append(window)
+        window *= ETA
+    windows.append(train_length)
+
+    MAPE = np.full((len(orders), len(CURRENCIES)), np.nan)
+    survivors = [list(range(len(orders))) for _ in CURRENCIES]
+    for round_number, window in enumerate(windows):
+        keys = [(i, j) for j in range(len(CURRENCIES)) for i in survivors[j]]
+        tasks = [(np.ascontiguousarray(values[len(values) - window - holdout:, j]), FORECAST_PERIOD) + orders[i]
+                 + (N_FOLDS,) for i, j in keys]
+        logger.info("Search round {}: {} fits on the last {} days".format(round_number + 1, len(tasks), window))
+
+        round_MAPE = np.full_like(MAPE, np.nan)
+        with instrumentation.stage("arima_search_round", round=round_number + 1, window=window, fits=len(tasks),
+                                   workers=N_WORKERS):
+            results = map_tasks(_search_task, tasks, N_WORKERS, [(CURRENCIES[j], orders[i]) for i, j in keys])
+        for (i, j), result in zip(keys, results):
+            round_MAPE[i, j] = result.mean()
+
+        if round_number == len(windows) - 1:
+            MAPE = round_MAPE
+            break
+
+        # Keep the best 1 / ETA candidates of every currency, models that could not be fitted sort last
+        for j in range(len(CURRENCIES)):
+            ranked = sorted(survivors[j], key=lambda i: (np.isnan(round_MAPE[i, j]), round_MAPE[i, j]))
+            survivors[j] = sorted(ranked[:max(1, int(np.ceil(len(ranked) / ETA)))])
+
+    models = pd.DataFrame(data={'P': [order[0] for order in orders],
+                                'D': [order[1] for order in orders],
+                                'Q': [order[2] for order in orders]})
+    for j, curr in enumerate(CURRENCIES):
+        models['MAPE_' + curr] = MAPE[:, j]
+    if not return_folds:
+        return models
+
+    folds = None
+    if N_FOLDS > 1:
+        folds = pd.DataFrame([{'P': orders[i][0], 'D': orders[i][1], 'Q': orders[i][2], 'CURRENCY': CURRENCIES[j],
+                               'FOLD': fold, 'MAPE': fold_MAPE}
+                              for (i, j), result in zip(keys, results) for fold, fold_MAPE in enumerate(result)])
+    return models, folds
+
+
+def evaluate_model(rates, FORECAST_PERIOD, ARIMA_models, CURRENCIES=None, N_WORKERS=1, MODEL_CACHE=None,
+                   BACKTEST_FOLDS=1, SEARCH=None, cache=None, return_folds=False, **kwargs):
     """
     Evaluates different ARIMA models and returns corresponding MAPE values
     :param rates: Exchange rate data
     :param FORECAST_PERIOD: Number of days for which predictions are to be generated
+    :param ARIMA_models: Dictionary with the P, D and Q values of the ARIMA models to be evaluated
+    :param CURRENCIES: Currencies to be evaluated. Defaults to every rate column in the rates data
+    :param N_WORKERS: Number of worker processes used to fit the ARIMA models
+    :param MODEL_CACHE: Optional ModelCache settings (LOCATION, MAX_ENTRIES, WARM_START_MAX_DAYS)
+    :param BACKTEST_FOLDS: With more than 1 fold, the MAPE is the average over a rolling-origin backtest of that many
+                           forecast periods instead of the last forecast period only
+    :param SEARCH: Optional search settings. With MODE 'halving' the orders are picked by halving_search over the
+                   configured P, D and Q ranges instead of taken from ARIMA_models
+    :param cache: Optional ModelCache to be used instead of one loaded from the MODEL_CACHE settings
+    :param return_folds: Whether to also return the MAPE of each fold of the backtest
     :param kwargs: yaml config
-    :return: Different ARIMA models with corresponding MAPE values from training
+    :return: Different ARIMA models with a MAPE_<CURRENCY> column per currency from training. With return_folds, a
+             tuple of these and a Dataframe with the P, D, Q, CURRENCY, FOLD and MAPE of every fold, None without a
+             backtest
     """
     try:
+        if SEARCH and SEARCH.get('MODE', 'grid') == 'halving':
+            return halving_search(rates, FORECAST_PERIOD, SEARCH, CURRENCIES, N_WORKERS, BACKTEST_FOLDS, return_folds)
+
         models = pd.DataFrame(data=ARIMA_models)
-        MAPE_INR = []
-        MAPE_EUR = []
-        MAPE_GBP = []
+        if CURRENCIES is None:
+            CURRENCIES = [col for col in rates.columns if col != 'DATE']
+        if cache is None and MODEL_CACHE:
+            cache = ModelCache(**MODEL_CACHE)
+
+        if BACKTEST_FOLDS > 1:
+            folds = backtest_models(rates, FORECAST_PERIOD, ARIMA_models, BACKTEST_FOLDS, CURRENCIES, N_WORKERS, cache)
+            MAPE = folds['MAPE'].values.reshape(len(ARIMA_models['P']), len(CURRENCIES), BACKTEST_FOLDS).mean(axis=2)
+            for j, curr in enumerate(CURRENCIES):
+                models['MAPE_' + curr] = MAPE[:, j]
+            return (models, folds) if return_folds else models
+
+        # (days x currencies) matrix, split into the training window and the last FORECAST_PERIOD days held out
+        values = np.asarray(rates[CURRENCIES], dtype=float)
+        train = values[:len(values) - FORECAST_PERIOD]
+        actuals = values[len(values) - FORECAST_PERIOD:].T
 
+        # One task per (model, currency) combination
+        tasks = []
         for i in range(len(ARIMA_models['P'])):
-            # INR GBP training and predictions
-            predictions_INR = ARIMAForecasting(rates.INR[0:len(rates.INR) - FORECAST_PERIOD], FORECAST_PERIOD,
-                                               ARIMA_models['P'][i], ARIMA_models['D'][i], ARIMA_models['Q'][i])
-            MAPE_INR.append(sum(abs(predictions_INR - rates.INR[len(rates.INR) - FORECAST_PERIOD:len(rates.INR)]))*100 / \
-                                sum(rates.INR[len(rates.INR) - FORECAST_PERIOD:len(rates.INR)]))
-
-            # EUR GBP training and predictions
-            predictions_EUR = ARIMAForecasting(rates.EUR[0:len(rates.EUR) - FORECAST_PERIOD], FORECAST_PERIOD,
-                                               ARIMA_models['P'][i], ARIMA_models['D'][i], ARIMA_models['Q'][i])
-            MAPE_EUR.append(sum(abs(predictions_EUR - rates.EUR[len(rates.EUR) - FORECAST_PERIOD:len(rates.EUR)]))*100 / \
-                            sum(rates.EUR[len(rates.EUR) - FORECAST_PERIOD:len(rates.EUR)]))
-
-            # GBP training and predictions
-            predictions_GBP = ARIMAForecasting(rates.GBP[0:len(rates.GBP) - FORECAST_PERIOD], FORECAST_PERIOD,
-                                               ARIMA_models['P'][i], ARIMA_models['D'][i], ARIMA_models['Q'][i])
-            MAPE_GBP.append(sum(abs(predictions_GBP - rates.GBP[len(rates.GBP) - FORECAST_PERIOD:len(rates.GBP)]))*100 / \
-                            sum(rates.GBP[len(rates.GBP) - FORECAST_PERIOD:len(rates.GBP)]))
-
-        #Append the MAPE values to the different models
-        models['MAPE_INR'] = MAPE_INR
-        models['MAPE_EUR'] = MAPE_EUR
-        models['MAPE_GBP'] = MAPE_GBP
-        return(models)
+            for j in range(len(CURRENCIES)):
+                tasks.append((CURRENCIES[j], np.ascontiguousarray(train[:, j]), FORECAST_PERIOD,
+                              ARIMA_models['P'][i], ARIMA_models['D'][i], ARIMA_models['Q'][i]))
+
+        predictions = np.asarray(run_forecasts(tasks, N_WORKERS, cache), dtype=float)
+        predictions = predictions.reshape(len(ARIMA_models['P']), len(CURRENCIES), FORECAST_PERIOD)
+
+        # (models x currencies) MAPE matrix
+        MAPE = np.abs(predictions - actuals).sum(axis=2) * 100 / actuals.sum(axis=1)
+
+        # Append the MAPE values to the different models
+        for j, curr in enumerate(CURRENCIES):
+            models['MAPE_' + curr] = MAPE[:, j]
+        return (models, None) if return_folds else models
     except Exception as e:
         logger.error(e)
         sys.exit(1)
-
-
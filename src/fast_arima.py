@@ -0,0 +1,236 @@
+import numpy as np
+from scipy import optimize
+from scipy.linalg import solve_toeplitz
+from scipy.signal import lfilter
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Largest (P, D, Q) handled by the fast path, every order of the model config fits in it
+MAX_ORDER = (2, 2, 2)
+
+
+def supports_order(P, D, Q):
+    """ :return: True if the fast path can fit an ARIMA(P, D, Q) model """
+    return 0 <= P <= MAX_ORDER[0] and 0 <= D <= MAX_ORDER[1] and 0 <= Q <= MAX_ORDER[2]
+
+
+def _ar_transparams(params):
+    """ Jones (1980) transformation of unconstrained values to stationary AR coefficients, as in statsmodels """
+    newparams = np.tanh(params / 2)
+    tmp = np.tanh(params / 2)
+    for j in range(1, len(params)):
+        a = newparams[j]
+        for k in range(j):
+            tmp[k] -= a * newparams[j - k - 1]
+        newparams[:j] = tmp[:j]
+    return newparams
+
+
+def _ar_invtransparams(params):
+    """ Inverse of _ar_transparams """
+    params = params.copy()
+    tmp = params.copy()
+    for j in range(len(params) - 1, 0, -1):
+        a = params[j]
+        for k in range(j):
+            tmp[k] = (params[k] + a * params[j - k - 1]) / (1 - a ** 2)
+        params[:j] = tmp[:j]
+    return 2 * np.arctanh(params)
+
+
+def _ma_transparams(params):
+    """ Jones (1980) transformation of unconstrained values to invertible MA coefficients, as in statsmodels """
+    newparams = (1 - np.exp(-params)) / (1 + np.exp(-params))
+    tmp = newparams.copy()
+    for j in range(1, len(params)):
+        b = newparams[j]
+        for k in range(j):
+            tmp[k] += b * newparams[j - k - 1]
+        newparams[:j] = tmp[:j]
+    return newparams
+
+
+def _ma_invtransparams(params):
+    """ Inverse of _ma_transparams """
+    params = params.copy()
+    tmp = params.copy()
+    for j in range(len(params) - 1, 0, -1):
+        b = params[j]
+        for k in range(j):
+            tmp[k] = (params[k] - b * params[j - k - 1]) / (1 - b ** 2)
+        params[:j] = tmp[:j]
+    return -np.log((1 - params) / (1 + params))
+
+
+def _transparams(params, p):
+    return np.r_[params[:1], _ar_transparams(params[1:1 + p]), _ma_transparams(params[1 + p:])]
+
+
+def _invtransparams(params, p):
+    return np.r_[params[:1], _ar_invtransparams(params[1:1 + p]), _ma_invtransparams(params[1 + p:])]
+
+
+def css_errors(z, params, p, q):
+    """
+    Conditional residuals of an ARMA(p, q) model with a constant, computed with the same recursion as statsmodels:
+    the first p observations are conditioned on and the pre-sample errors are zero
+    :param z: Differenced series
+    :param params: [const, ar_1..ar_p, ma_1..ma_q]
+    :return: The len(z) - p residuals
+    """
+    y = z - params[0]
+    b = np.r_[1, -params[1:1 + p]]
+    a = np.r_[1, params[1 + p:1 + p + q]]
+    zi = np.zeros(max(p, q))
+    for i in range(p):
+        zi[i] = -np.dot(b[:i + 1][::-1], y[:i + 1])
+    return lfilter(b, a, y, zi=zi)[0][p:]
+
+
+def _yule_walker(x, order):
+    """ Yule-Walker AR coefficients with the unbiased (n - k) autocovariances of the demeaned series """
+    x = x - x.mean()
+    n = len(x)
+    r = np.array([np.dot(x[:n - k], x[k:]) / (n - k) for k in range(order + 1)])
+    return solve_toeplitz(r[:-1], r[1:])
+
+
+def _lags(x, p):
+    """ (len(x) - p) x p matrix whose k-th column is x lagged by k + 1 """
+    return np.column_stack([x[p - k - 1:len(x) - k - 1] for k in range(p)])
+
+
+def _long_ar_residuals(x, q):
+    """ Residuals of the AR model, picked by BIC, that Hannan-Rissanen regresses the ARMA model on """
+    n = len(x)
+    maxlag = min(int(round(12 * (n / 100.) ** (1 / 4.))), n - 1)
+    best = None
+    for lag in range(1, maxlag + 1):
+        # Every candidate is fitted on the same observations so that their BIC values are comparable
+        X = _lags(x, maxlag)[:, :lag]
+        coefs = np.linalg.lstsq(X, x[maxlag:], rcond=None)[0]
+        sigma2 = np.mean((x[maxlag:] - X.dot(coefs)) ** 2)
+        bic = np.log(sigma2) + lag * np.log(n - maxlag) / (n - maxlag)
+        if best is None or bic < best[0]:
+            best = (bic, lag)
+    lag = best[1]
+    if lag + q >= n:
+        raise ValueError("Proper starting parameters cannot be found for this order with this number of observations")
+    X = _lags(x, lag)
+    return lag, x[lag:] - X.dot(np.linalg.lstsq(X, x[lag:], rcond=None)[0])
+
+
+def start_params(z, p, q):
+    """
+    Hannan-Rissanen start values, following statsmodels' ARMA._fit_start_params_hr
+    :param z: Differenced series
+    :return: [const, ar_1..ar_p, ma_1..ma_q]
+    """
+    params = np.zeros(1 + p + q)
+    params[0] = z.mean()
+    x = z - params[0]
+    if q and p:
+        lag, resid = _long_ar_residuals(x, q)
+        start = max(lag + q, p)
+        X = np.column_stack((_lags(x, p)[start - p:], _lags(resid, q)[start - lag - q:]))
+        params[1:] = np.linalg.lstsq(X, x[start:], rcond=None)[0]
+    elif q:
+        # MA coefficients from the impulse response of a Yule-Walker AR(q) fit
+        impulse = np.zeros(q + 1)
+        impulse[0] = 1
+        params[1:] = lfilter([1], np.r_[1, -_yule_walker(x, q)], impulse)[1:]
+    elif p:
+        params[1:] = _yule_walker(x, p)
+
+    if p and not np.all(np.abs(np.roots(np.r_[1, -params[1:1 + p]])) < 1):
+        raise ValueError("The computed initial AR coefficients are not stationary")
+    if q and not np.all(np.abs(np.roots(np.r_[1, params[1 + p:]])) < 1):
+        raise ValueError("The computed initial MA coefficients are not invertible")
+    return params
+
+
+def css_fit(ts, P, D, Q, start_params_=None, maxiter=2000):
+    """
+    Fits an ARIMA(P, D, Q) model with a constant by conditional sum of squares. The objective, the stationarity and
+    invertibility transformation of the coefficients and the L-BFGS settings are those of statsmodels' ARIMA with
+    method='css', so the fitted parameters agree with it up to the optimizer tolerance.
+    :param ts: Time series
+    :param start_params_: Optional start values, [const, ar_1..ar_p, ma_1..ma_q]
+    :param maxiter: Maximum number of optimizer iterations
+    :return: Tuple of the fitted parameters, [const, ar_1..ar_p, ma_1..ma_q], and the residuals
+    """
+    if not supports_order(P, D, Q):
+        raise ValueError("ARIMA({}, {}, {}) is not supported by the fast path".format(P, D, Q))
+    z = np.diff(np.asarray(ts, dtype=float), D)
+    if len(z) <= P + Q + 1:
+        raise ValueError("Insufficient degrees of freedom to estimate")
+
+    if start_params_ is None:
+        try:
+            start_params_ = start_params(z, P, Q)
+        except ValueError as e:
+            # statsmodels gives up here. Starting from white noise lets the optimizer find the best stationary and
+            # invertible model instead
+            logger.debug("{}, starting from zero ARMA coefficients".format(e))
+            start_params_ = np.r_[z.mean(), np.zeros(P + Q)]
+    x0 = _invtransparams(np.asarray(start_params_, dtype=float), P)
+    if not np.all(np.isfinite(x0)):
+        raise ValueError("Start parameters are not stationary or not invertible")
+
+    nobs = len(z) - P
+
+    def objective(x):
+        errors = css_errors(z, _transparams(x, P), P, Q)
+        ssr = np.dot(errors, errors)
+        # Negative conditional log likelihood per observation
+        return 0.5 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+
+    x, _, _ = optimize.fmin_l_bfgs_b(objective, x0, approx_grad=True, m=12, pgtol=1e-8, factr=1e2, maxiter=maxiter)
+    params = _transparams(x, P)
+    return params, css_errors(z, params, P, Q)
+
+
+def css_forecast(ts, P, D, Q, params, resid, steps):
+    """
+    Out-of-sample forecast of a fitted ARIMA(P, D, Q) model, integrated back to levels
+    :param ts: Time series the model was fitted on
+    :param params: Fitted parameters, [const, ar_1..ar_p, ma_1..ma_q]
+    :param resid: Residuals of the fit
+    :param steps: Number of steps ahead
+    :return: Forecasts of the next steps observations
+    """
+    ts = np.asarray(ts, dtype=float)
+    z = np.diff(ts, D)
+    ar = params[1:1 + P]
+    ma = params[1 + P:1 + P + Q]
+    mu = params[0] * (1 - ar.sum())
+
+    history = list(z[len(z) - P:]) if P else []
+    errors = list(resid[len(resid) - Q:]) if Q else []
+    forecast = np.empty(steps)
+    for h in range(steps):
+        value = mu
+        for k in range(1, P + 1):
+            value += ar[k - 1] * history[-k]
+        # Only the errors up to the forecast origin are known, the later ones are zero
+        for k in range(h + 1, Q + 1):
+            value += ma[k - 1] * errors[h - k]
+        forecast[h] = value
+        history.append(value)
+
+    # Integrate back to levels, each differencing level starting from its last value
+    for j in range(D - 1, -1, -1):
+        forecast = np.diff(ts, j)[-1] + np.cumsum(forecast)
+    return forecast
+
+
+def fit_forecast(ts, FORECAST_PERIOD, P, D, Q, start_params_=None, maxiter=2000):
+    """
+    Fits ARIMA for the p,d,q parameters on the time series by conditional sum of squares and generates predictions for
+    the forecast period
+    :param start_params_: Optional start values for the optimizer, e.g. the parameters of an earlier fit
+    :return: Tuple of the predictions and the fitted parameters
+    """
+    params, resid = css_fit(ts, P, D, Q, start_params_, maxiter)
+    return css_forecast(ts, P, D, Q, params, resid, FORECAST_PERIOD), params
@@ -2,35 +2,49 @@ import os
 import sqlalchemy
 import yaml
 import sys
-import requests
 from sqlalchemy.orm import sessionmaker
 import config
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_engine():
-    '''Wrapper function for calling create_connection with the right inputs to create an engine for an RDS or sqlite database'''
+# Engines and session factories are shared process-wide, so that every caller reuses the same connection pool
+_engines = {}
+_sessionmakers = {}
+
+
+def get_engine(engine_string=None):
+    '''Returns the process-wide engine for the RDS or sqlite database (based on configuration), or for engine_string if
+    it is given. The engine is created through create_connection on first use and reused afterwards.'''
     dbconfig = config.DBCONFIG
+    key = engine_string or dbconfig or config.SQLALCHEMY_DATABASE_URI
+    if key in _engines:
+        return _engines[key]
+
     try:
-        if dbconfig is not None:
+        if engine_string is not None:
+            engine = create_connection(engine_string=engine_string, pool_options=config.DB_POOL)
+            logger.info("Accessing database")
+        elif dbconfig is not None:
             engine = create_connection(dbconfig=config.DBCONFIG,
                                        user_env=os.environ.get("MYSQL_USER"),
-                                       password_env=os.environ.get("MYSQL_PASSWORD"))
+                                       password_env=os.environ.get("MYSQL_PASSWORD"),
+                                       pool_options=config.DB_POOL)
             logger.info("Accessing RDS database")
         else:
-            engine = create_connection(engine_string=config.SQLALCHEMY_DATABASE_URI)
+            engine = create_connection(engine_string=config.SQLALCHEMY_DATABASE_URI, pool_options=config.DB_POOL)
             logger.info("Accessing sqlite database")
     except Exception as e:
         logger.error(e)
         sys.exit(1)
 
+    _engines[key] = engine
     return engine
 
 
 def create_connection(host='127.0.0.1', database="", sqltype="mysql+pymysql", port=3308,
                       user_env="amazonRDS_user", password_env="amazonRDS_pw",
-                      username=None, password=None, dbconfig=None, engine_string=None):
+                      username=None, password=None, dbconfig=None, engine_string=None, pool_options=None):
     """
     Creates engine for an RDS or local sqlite database
     :param host: Host
@@ -43,6 +57,7 @@ def create_connection(host='127.0.0.1', database="", sqltype="mysql+pymysql", po
     :param password: Non RDS password
     :param dbconfig: If passed, RDS connection will be created
     :param engine_string: If a sqlite connection is to be created, SQLALCHEMY_DATABASE_URI should be passed
+    :param pool_options: Optional pool settings (pool_size, max_overflow, pool_recycle, pool_pre_ping)
     :return: The db connection
     """
     if engine_string is None:
@@ -64,7 +79,13 @@ def create_connection(host='127.0.0.1', database="", sqltype="mysql+pymysql", po
         engine_string = engine_string.format(sqltype=sqltype, username=username,
                                              password=password, host=host, port=port, database=database)
 
-    conn = sqlalchemy.create_engine(engine_string)
+    pool_options = dict(pool_options or {})
+    if engine_string.startswith("sqlite"):
+        # sqlite engines do not use a sized connection pool
+        pool_options.pop("pool_size", None)
+        pool_options.pop("max_overflow", None)
+
+    conn = sqlalchemy.create_engine(engine_string, **pool_options)
 
     return conn
 
@@ -81,31 +102,80 @@ def get_session(engine=None, engine_string=None):
     if engine is None and engine_string is None:
         return ValueError("`engine` or `engine_string` must be provided")
     elif engine is None:
-        engine = create_connection(engine_string=engine_string)
-
-    Session = sessionmaker(bind=engine)
-    session = Session()
+        engine = get_engine(engine_string=engine_string)
 
-    return session
+    return get_sessionmaker(engine)()
 
 
-def invoke_api(api_url):
+def get_sessionmaker(engine):
     """
-    Calls the API from the url passed as input and returns the response
-    :param api_url: The api url
-    :return: The API response
+    :param engine: DB engine
+    :return: The session factory bound to engine, created once per engine
     """
-    try:
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            result = response.json()
-        else:
-            logger.error("API returned with status code: " + str(response.status_code))
-            sys.exit(1)
-    except requests.exceptions.RequestException as e:
-        logger.error("Unable to call the API")
-        sys.exit(1)
-    return result
+    if engine not in _sessionmakers:
+        _sessionmakers[engine] = sessionmaker(bind=engine)
+    return _sessionmakers[engine]
+
+
+# requests is imported by the functions that call the API, so that the commands that only use the database do not
+# load it
+
+# Statuses worth another attempt: rate limiting and temporary server or gateway errors
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def _get(session, api_url, timeout, parse):
+    """ One attempt at api_url. The body is handed to parse as an iterator of chunks, as it is streamed in """
+    import requests
+    with session.get(api_url, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError("API returned with status code: " + str(response.status_code),
+                                                response=response)
+        return parse(api_url, response.iter_content(chunk_size=65536))
+
+
+def _fetch(session, api_url, parse, timeout, retries, backoff):
+    """ Fetches api_url in a worker thread, retrying connection errors, timeouts and RETRY_STATUS responses with an
+    exponential backoff """
+    import time
+    import requests
+    for attempt in range(retries + 1):
+        try:
+            return _get(session, api_url, timeout, parse)
+        except requests.exceptions.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            if attempt == retries or (status is not None and status not in RETRY_STATUS):
+                raise
+            delay = backoff * 2 ** attempt
+            logger.warning("{} failed ({}), retrying in {:.1f} seconds".format(api_url, e, delay))
+            time.sleep(delay)
+
+
+def fetch_all(api_urls, parse=None, max_concurrency=4, timeout=30, retries=3, backoff=0.5):
+    """
+    Fetches every url concurrently over one pooled session, on a pool of max_concurrency threads
+    :param api_urls: List of urls
+    :param parse: Function called with the url and an iterator over the chunks (bytes) of its response body, run in the
+                  worker thread that fetched it. Defaults to joining the chunks
+    :param max_concurrency: Maximum number of requests in flight, and size of the connection pool
+    :param timeout: Seconds to wait for the connection and for every read
+    :param retries: Number of retries of a failed request
+    :param backoff: Seconds before the first retry, doubled for every next one
+    :return: List of the parsed responses, in the order of api_urls. Raises the error of the first request, in that
+             order, that still fails after its retries
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+    from requests.adapters import HTTPAdapter
+    parse = parse or (lambda api_url, chunks: b"".join(chunks))
+
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return list(executor.map(lambda api_url: _fetch(session, api_url, parse, timeout, retries, backoff),
+                                     api_urls))
 
 
 def ifin(param, dictionary, alt=None):
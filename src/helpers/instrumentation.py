@@ -0,0 +1,164 @@
+import json
+import time
+import threading
+import cProfile
+import pstats
+from contextlib import contextmanager
+from datetime import datetime
+from os import path, makedirs
+
+import config
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then left out of the report
+    resource = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def peak_memory_mb():
+    """
+    :return: Dictionary with the peak resident memory (MB) of this process and of its finished child processes (e.g.
+             the ARIMA worker pool), or an empty dictionary where it cannot be measured
+    """
+    if resource is None:
+        return {}
+    # ru_maxrss is in kilobytes on Linux
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.}
+
+
+class RunReport(object):
+    """
+    Timings of one run.py subcommand: how long each stage took, how long each ARIMA fit took and the peak memory.
+    Every stage and fit is also logged as a JSON log line when it is recorded.
+    """
+
+    def __init__(self, command):
+        """
+        :param command: Name of the run.py subcommand
+        """
+        self.command = command
+        self.started_at = datetime.utcnow()
+        self.status = 'running'
+        self.seconds = None
+        self.stages = []
+        self.fits = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds, **tags):
+        record = dict(tags, stage=name, seconds=round(seconds, 6), peak_memory_mb=peak_memory_mb())
+        with self._lock:
+            self.stages.append(record)
+        logger.info(json.dumps(dict(record, event='stage'), sort_keys=True, default=str))
+
+    def add_fit(self, currency, order, seconds):
+        record = {'currency': currency, 'order': [int(x) for x in order], 'seconds': round(seconds, 6)}
+        with self._lock:
+            self.fits.append(record)
+        logger.debug(json.dumps(dict(record, event='fit'), sort_keys=True))
+
+    def finish(self, status):
+        self.status = status
+        self.seconds = round(time.perf_counter() - self._start, 6)
+
+    def to_dict(self):
+        # Stage totals, as a stage such as api_call can run more than once
+        totals = {}
+        for record in self.stages:
+            totals[record['stage']] = round(totals.get(record['stage'], 0) + record['seconds'], 6)
+        return {'command': self.command,
+                'started_at': self.started_at.isoformat(),
+                'status': self.status,
+                'seconds': self.seconds,
+                'peak_memory_mb': peak_memory_mb(),
+                'stage_totals': totals,
+                'stages': self.stages,
+                'fits': {'count': len(self.fits),
+                         'seconds': round(sum(fit['seconds'] for fit in self.fits), 6),
+                         'by_fit': self.fits}}
+
+    def write(self, directory):
+        """
+        Writes the report as <command>_<start time>.json in directory
+        :return: Location of the report
+        """
+        makedirs(directory, exist_ok=True)
+        location = path.join(directory, "{}_{}.json".format(self.command, self.started_at.strftime("%Y%m%dT%H%M%S")))
+        with open(location, "w") as output_file:
+            json.dump(self.to_dict(), output_file, indent=2, default=str)
+        return location
+
+
+# Report of the subcommand being run. Without one (e.g. in the tests or the Flask app), stages and fits are only timed
+# and logged
+_report = None
+
+
+def current_report():
+    return _report
+
+
+@contextmanager
+def stage(name, **tags):
+    """
+    Times the enclosed block as a stage of the current run
+    :param name: Name of the stage, e.g. api_call or db_write
+    :param tags: Extra fields for the log line and the report, e.g. the url or the table
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if _report is not None:
+            _report.add_stage(name, seconds, **tags)
+        else:
+            logger.debug(json.dumps(dict(tags, event='stage', stage=name, seconds=round(seconds, 6)),
+                                    sort_keys=True, default=str))
+
+
+def record_fit(currency, order, seconds):
+    """ Records how long the ARIMA fit of currency and order took """
+    if _report is not None:
+        _report.add_fit(currency, order, seconds)
+
+
+def run(func, args, command, profile=False, report_dir=None):
+    """
+    Runs a run.py subcommand with a run report, and optionally under cProfile. The report is written when the command
+    ends, also when it fails or exits.
+    :param func: Subcommand function, called with args
+    :param args: Parsed command line arguments
+    :param command: Name of the subcommand
+    :param profile: When True, the profile is saved next to the report and its top functions are logged
+    :param report_dir: Directory for the reports. Defaults to config.RUN_REPORT_DIR
+    """
+    global _report
+    report_dir = report_dir or config.RUN_REPORT_DIR
+    _report = RunReport(command)
+    profiler = cProfile.Profile() if profile else None
+    status = 'failed'
+    try:
+        if profiler is not None:
+            profiler.runcall(func, args)
+        else:
+            func(args)
+        status = 'succeeded'
+    except SystemExit as e:
+        status = 'succeeded' if not e.code else 'failed'
+        raise
+    finally:
+        _report.finish(status)
+        location = _report.write(report_dir)
+        logger.info("Run report written to {}".format(location))
+        if profiler is not None:
+            profile_location = location[:-len(".json")] + ".prof"
+            profiler.dump_stats(profile_location)
+            logger.info("Profile written to {}, top functions by cumulative time:".format(profile_location))
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+        _report = None
@@ -0,0 +1,125 @@
+import json
+import hashlib
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+import config
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def series_hash(ts):
+    """
+    Hashes the values of a time series
+    :param ts: Time series (list, array or pandas Series)
+    :return: Hex digest identifying the exact values of the series
+    """
+    values = np.ascontiguousarray(ts, dtype=np.float64)
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+class ModelCache(object):
+    """
+    On-disk cache of fitted ARIMA models, keyed by (currency, order, hash of the training window).
+
+    An exact hit returns the stored forecast so the model is not refitted at all. When the training window has only
+    moved forward by a few days since a model was cached, the cached parameters are handed out as start values for the
+    new fit. The cache holds at most MAX_ENTRIES models and evicts the least recently used ones first.
+    """
+
+    def __init__(self, LOCATION, MAX_ENTRIES=1000, WARM_START_MAX_DAYS=10, **kwargs):
+        """
+        :param LOCATION: JSON file in which the cache is persisted (relative paths are taken from the project home)
+        :param MAX_ENTRIES: Maximum number of fitted models kept in the cache
+        :param WARM_START_MAX_DAYS: Maximum number of days a cached window may be behind the new one to warm-start it
+        :param kwargs: yaml config
+        """
+        self.location = path.join(config.PROJECT_HOME, LOCATION)
+        self.max_entries = MAX_ENTRIES
+        self.warm_start_max_days = WARM_START_MAX_DAYS
+        self.entries = OrderedDict()
+        self.load()
+
+    @staticmethod
+    def _key(currency, order, ts_hash):
+        return "{}|{}|{}".format(currency, ",".join(str(int(x)) for x in order), ts_hash)
+
+    def load(self):
+        """ Loads the cache from its file. A missing or unreadable file gives an empty cache """
+        if not path.exists(self.location):
+            return
+        try:
+            with open(self.location, "r") as input_file:
+                entries = json.load(input_file)
+            # Entries are persisted from least to most recently used
+            self.entries = OrderedDict((self._key(entry["currency"], entry["order"], entry["hash"]), entry)
+                                       for entry in entries)
+            logger.debug("Loaded {} fitted models from {}".format(len(self.entries), self.location))
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable model cache {}: {}".format(self.location, e))
+            self.entries = OrderedDict()
+
+    def save(self):
+        """ Persists the cache to its file """
+        with open(self.location, "w+") as output_file:
+            json.dump(list(self.entries.values()), output_file)
+
+    def get_forecast(self, currency, order, ts, steps):
+        """
+        :param currency: Currency of the series
+        :param order: (P, D, Q) order of the ARIMA model
+        :param ts: Training window
+        :param steps: Number of forecast steps required
+        :return: The cached forecast for exactly this training window, or None on a miss
+        """
+        key = self._key(currency, order, series_hash(ts))
+        entry = self.entries.get(key)
+        if entry is None or len(entry["forecast"]) < steps:
+            return None
+
+        self.entries.move_to_end(key)
+        return np.array(entry["forecast"][:steps])
+
+    def get_start_params(self, currency, order, ts):
+        """
+        Finds a cached model for the same currency and order whose training window overlaps the new one, with the new
+        window ending at most WARM_START_MAX_DAYS days later and starting at most that many days later (sliding
+        look-back windows). The overlap is checked on the cached window without its first days (its core).
+        :return: The fitted parameters of that model, or None if there is none
+        """
+        n_obs = len(ts)
+        values = np.ascontiguousarray(ts, dtype=np.float64)
+        for key in reversed(self.entries):
+            entry = self.entries[key]
+            if entry["currency"] != currency or tuple(entry["order"]) != tuple(order):
+                continue
+            core_length = entry["n_obs"] - entry["core_start"]
+            for start in range(0, entry["core_start"] + 1):
+                end = start + core_length
+                if end > n_obs:
+                    break
+                if n_obs - end > self.warm_start_max_days:
+                    continue
+                if series_hash(values[start:end]) == entry["core_hash"]:
+                    self.entries.move_to_end(key)
+                    return np.array(entry["params"])
+        return None
+
+    def put(self, currency, order, ts, forecast, params):
+        """ Adds a fitted model to the cache, evicting the least recently used models beyond MAX_ENTRIES """
+        ts_hash = series_hash(ts)
+        key = self._key(currency, order, ts_hash)
+        core_start = min(self.warm_start_max_days, len(ts) - 1)
+        self.entries[key] = {"currency": currency,
+                             "order": [int(x) for x in order],
+                             "hash": ts_hash,
+                             "n_obs": len(ts),
+                             "core_start": core_start,
+                             "core_hash": series_hash(np.asarray(ts, dtype=np.float64)[core_start:]),
+                             "forecast": [float(x) for x in forecast],
+                             "params": [float(x) for x in params]}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+
+from src.helpers import instrumentation
+
+import logging
+logger = logging.getLogger(__name__)
+
+# boto3 is imported by the functions that transfer files, so that the commands that do not use S3 do not load it
+
+MB = 1024 * 1024
+# Files are compressed and spooled to disk in blocks of this size, so memory use does not grow with the file
+BLOCK_SIZE = MB
+
+
+def file_md5(file_location):
+    """
+    :param file_location: Local file
+    :return: Hex MD5 digest of the file contents, or None if the file does not exist
+    """
+    if not os.path.exists(file_location):
+        return None
+    md5 = hashlib.md5()
+    with open(file_location, "rb") as input_file:
+        for block in iter(lambda: input_file.read(BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def transfer_config(MULTIPART_THRESHOLD_MB=8, MULTIPART_CHUNKSIZE_MB=8, MAX_CONCURRENCY=4, **kwargs):
+    """
+    :param MULTIPART_THRESHOLD_MB: Objects from this size on are transferred in parts
+    :param MULTIPART_CHUNKSIZE_MB: Size of every part
+    :param MAX_CONCURRENCY: Number of parts transferred at the same time
+    :param kwargs: yaml config
+    :return: boto3 TransferConfig
+    """
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD_MB * MB,
+                          multipart_chunksize=MULTIPART_CHUNKSIZE_MB * MB,
+                          max_concurrency=MAX_CONCURRENCY)
+
+
+def head_object(client, bucket_name, file_name):
+    """ :return: The metadata of an S3 object, or None if it does not exist """
+    import botocore
+    try:
+        return client.head_object(Bucket=bucket_name, Key=file_name)
+    except botocore.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def object_md5(head):
+    """
+    MD5 of the uncompressed contents of an S3 object. It is stored in the object metadata at upload. For objects
+    uploaded without it in a single part and uncompressed, the ETag is the MD5 of the object.
+    :param head: Metadata of the object, from head_object
+    :return: Hex MD5 digest, or None if the object does not exist or its MD5 is unknown
+    """
+    if head is None:
+        return None
+    if "md5" in head.get("Metadata", {}):
+        return head["Metadata"]["md5"]
+    etag = head.get("ETag", "").strip('"')
+    if "-" in etag or head.get("ContentEncoding") == "gzip":
+        return None
+    return etag
+
+
+def upload_file(file_location, bucket_name, file_name, COMPRESS=True, **kwargs):
+    """
+    Uploads a file to S3 unless the object there already has the same contents. The file is gzip compressed on the way
+    (spooled through a temporary file) and sent in parts when it is large.
+    :param file_location: Local file
+    :param bucket_name: S3 bucket
+    :param file_name: Key of the object
+    :param COMPRESS: Whether to gzip the object
+    :param kwargs: Transfer settings, see transfer_config
+    :return: True if the file was uploaded, False if the object was already up to date
+    """
+    import boto3
+    client = boto3.client("s3")
+    md5 = file_md5(file_location)
+    if object_md5(head_object(client, bucket_name, file_name)) == md5:
+        logger.info("s3://{}/{} is already up to date, skipping the upload".format(bucket_name, file_name))
+        return False
+
+    extra_args = {"Metadata": {"md5": md5}}
+    with instrumentation.stage("s3_upload", bucket=bucket_name, key=file_name, compressed=COMPRESS), \
+            tempfile.TemporaryFile() as spool, open(file_location, "rb") as input_file:
+        if COMPRESS:
+            with gzip.GzipFile(fileobj=spool, mode="wb") as compressed:
+                shutil.copyfileobj(input_file, compressed, BLOCK_SIZE)
+            spool.seek(0)
+            body = spool
+            extra_args["ContentEncoding"] = "gzip"
+        else:
+            body = input_file
+        client.upload_fileobj(body, bucket_name, file_name, ExtraArgs=extra_args, Config=transfer_config(**kwargs))
+    return True
+
+
+def download_file(bucket_name, file_name, file_location, **kwargs):
+    """
+    Downloads an S3 object to a local file unless the local file already has the same contents. Compressed objects are
+    decompressed, and the file is only replaced once the download is complete.
+    :param bucket_name: S3 bucket
+    :param file_name: Key of the object
+    :param file_location: Local file
+    :param kwargs: Transfer settings, see transfer_config
+    :return: True if the object was downloaded, False if the local file was already up to date
+    """
+    import boto3
+    client = boto3.client("s3")
+    head = head_object(client, bucket_name, file_name)
+    if head is None:
+        raise FileNotFoundError("s3://{}/{} does not exist".format(bucket_name, file_name))
+    md5 = object_md5(head)
+    if md5 is not None and file_md5(file_location) == md5:
+        logger.info("{} is already up to date with s3://{}/{}, skipping the download".format(file_location, bucket_name,
+                                                                                            file_name))
+        return False
+
+    directory = os.path.dirname(os.path.abspath(file_location))
+    with instrumentation.stage("s3_download", bucket=bucket_name, key=file_name), tempfile.TemporaryFile() as spool:
+        client.download_fileobj(bucket_name, file_name, spool, Config=transfer_config(**kwargs))
+        spool.seek(0)
+        body = gzip.GzipFile(fileobj=spool, mode="rb") if head.get("ContentEncoding") == "gzip" else spool
+
+        output_file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        try:
+            with output_file:
+                shutil.copyfileobj(body, output_file, BLOCK_SIZE)
+            os.replace(output_file.name, file_location)
+        except Exception:
+            if os.path.exists(output_file.name):
+                os.remove(output_file.name)
+            raise
+    return True
@@ -1,11 +1,14 @@
-import pandas as pd
+import numpy as np
 import sys
-import json
 import yaml
 import config
-import boto3
 from os import path
+from datetime import datetime, date
+from sqlalchemy import and_, or_
 from src.helpers.helpers import get_engine
+from src.create_dataset import Predictions
+from src.helpers import instrumentation
+from src.helpers.s3_transfer import download_file
 
 import logging.config
 logger = logging.getLogger(__name__)
@@ -14,9 +17,11 @@ logger = logging.getLogger(__name__)
 def load_ARIMA_Params(engine):
     """ Load p,d,q parameters corresponding to the best ARIMA models from the database """
 
+    import pandas as pd
     try:
         query = "SELECT * FROM ARIMA_Params"
-        ARIMA_Params = pd.read_sql(query, con=engine)
+        with instrumentation.stage("db_read", table="ARIMA_Params"):
+            ARIMA_Params = pd.read_sql(query, con=engine)
     except Exception as e:
         logger.error(e)
         sys.exit(1)
@@ -24,26 +29,105 @@ def load_ARIMA_Params(engine):
     return ARIMA_Params;
 
 
-def read_records(file_location):
-    """ Read and load JSON from the local filesystem """
+def _as_date(value):
+    return value if isinstance(value, date) else datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def load_predictions(session, currencies=None, start_date=None, end_date=None, after=None, limit=None):
+    """
+    Queries the predictions in (CURRENCY, PRED_DATE) order, optionally filtered by currency and prediction date. Pages
+    are read by keyset rather than by offset: every page starts right after the key of the last prediction of the
+    previous one, which is a range scan of the primary key however deep the page is.
+    :param session: DB session
+    :param currencies: List of currencies to be returned
+    :param start_date: First prediction date to be returned (date or 'YYYY-MM-DD')
+    :param end_date: Last prediction date to be returned (date or 'YYYY-MM-DD')
+    :param after: Optional (CURRENCY, PRED_DATE) key of the last prediction of the previous page
+    :param limit: Maximum number of predictions to be returned
+    :return: Tuple of the list of dictionaries with the CURRENCY, PRED_DATE ('YYYY-MM-DD') and PRED_RATE of each
+             prediction, and the (CURRENCY, PRED_DATE) key to pass as after for the next page, or None on the last page
+    """
+    query = session.query(Predictions.CURRENCY, Predictions.PRED_DATE, Predictions.PRED_RATE)
+    if currencies:
+        query = query.filter(Predictions.CURRENCY.in_(currencies))
+    if start_date is not None:
+        query = query.filter(Predictions.PRED_DATE >= _as_date(start_date))
+    if end_date is not None:
+        query = query.filter(Predictions.PRED_DATE <= _as_date(end_date))
+    if after is not None:
+        # Spelled out rather than as a row value comparison, which MySQL does not serve from the index
+        after_currency, after_date = after[0], _as_date(after[1])
+        query = query.filter(or_(Predictions.CURRENCY > after_currency,
+                                 and_(Predictions.CURRENCY == after_currency, Predictions.PRED_DATE > after_date)))
+    query = query.order_by(Predictions.CURRENCY, Predictions.PRED_DATE)
+    if limit is not None:
+        # One row more than the page tells whether there is a next page
+        query = query.limit(limit + 1)
+
+    with instrumentation.stage("db_read", table="Predictions"):
+        rows = query.all()
+
+    next_key = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_key = (rows[-1][0], rows[-1][1].isoformat())
+    predictions = [{'CURRENCY': currency, 'PRED_DATE': pred_date.isoformat(), 'PRED_RATE': pred_rate}
+                   for currency, pred_date, pred_rate in rows]
+    return predictions, next_key
+
+
+def read_rate_store(file_location):
+    """ Load the rate store (.npz) from the local filesystem """
     try:
         if not file_location:
             raise FileNotFoundError
 
-        with open(file_location, 'r+') as input_file:
-            try:
-                output_records = json.load(input_file)
-            except json.decoder.JSONDecodeError:
-                logger.error("Could not decode JSON")
-    except FileNotFoundError:
-        logger.error("Source data file not found")
+        with instrumentation.stage("rate_store_read", location=file_location), np.load(file_location) as input_file:
+            store = {key: input_file[key] for key in input_file.files}
+    except (FileNotFoundError, OSError):
+        logger.error("Rate store not found")
+        sys.exit(1)
+
+    return store
+
+
+def rates_frame(store, currencies, start_date=None, end_date=None):
+    """
+    Takes the rates of the given currencies out of the rate store
+    :param store: Rate store with the dates, currencies and rates arrays
+    :param currencies: Currencies to be returned
+    :param start_date: Optional first date of the window ('YYYY-MM-DD')
+    :param end_date: Optional last date of the window ('YYYY-MM-DD')
+    :return: Dataframe with a DATE column ('YYYY-MM-DD', ascending) and a rate column per currency
+    """
+    import pandas as pd
+    try:
+        dates = store["dates"]
+        first = 0 if start_date is None else np.searchsorted(dates, np.datetime64(start_date, "D"), side="left")
+        last = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(end_date, "D"), side="right")
+
+        missing = [curr for curr in currencies if curr not in store["currencies"]]
+        if missing:
+            raise KeyError("Currencies not present in the rate store: {}".format(", ".join(missing)))
+
+        cols = [list(store["currencies"]).index(curr) for curr in currencies]
+        values = store["rates"][first:last, cols]
+        incomplete = [curr for curr, has_nan in zip(currencies, np.isnan(values).any(axis=0)) if has_nan]
+        if incomplete:
+            raise ValueError("Rates missing for some dates for: {}".format(", ".join(incomplete)))
+
+        rates = pd.DataFrame(data=values, columns=list(currencies))
+        rates.insert(0, 'DATE', np.datetime_as_string(dates[first:last], unit="D"))
+    except Exception as e:
+        logger.error(e)
         sys.exit(1)
 
-    return output_records
+    return rates
 
 
 def load_raw_source(local_results_file):
-    """ Fetch the source data stored in S3 bucket and dump it in the local_results_file """
+    """ Fetch the source data stored in S3 bucket and dump it in the local_results_file, unless the local file is
+    already the same as the S3 object """
     try:
         with open(config.MODEL_CONFIG, "r") as f:
             model_config = yaml.load(f, Loader=yaml.FullLoader)
@@ -53,8 +137,7 @@ def load_raw_source(local_results_file):
         bucket_name = load_config["S3_LOCATION"]
         file_name = load_config["S3_FILE_NAME"]
 
-        s3 = boto3.resource("s3")
-        s3.meta.client.download_file(bucket_name, file_name, local_results_file)
+        download_file(bucket_name, file_name, local_results_file, **(load_config.get("S3_TRANSFER") or {}))
 
     except Exception as e:
         logger.error(e)
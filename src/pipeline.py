@@ -0,0 +1,81 @@
+import sys
+import yaml
+import config
+from os import path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from src.acquire_data import update_rate_store, write_to_S3, to_date
+from src.load_data import rates_frame
+from src.train_model import find_best_model, add_model_states, store_best_models
+from src.evaluate_model import evaluate_model
+from src.score_model import generate_predictions, look_back_window, store_predictions
+from src.helpers.helpers import get_engine
+from src.helpers.model_cache import ModelCache
+from src.helpers import instrumentation
+
+import logging.config
+logger = logging.getLogger(__name__)
+
+
+def run_pipeline(args):
+    """
+    Runs acquire, train and score in one process. The rate store and the best models are handed from stage to stage in
+    memory instead of through S3 and the database, and the model cache is loaded once. The artifacts (rate store in S3,
+    ARIMA parameters and predictions in the database, snapshot of the app) are persisted on background threads while
+    the next stage runs:
+    1. Bring the local rate store up to date for both the acquire range and the look back window of scoring
+    2. Evaluate the ARIMA models on the rate store, find the best model for each currency and fit its filter state
+    3. Generate the predictions from the filter states of the best models, updated with the look back window
+    4. Wait for the artifacts to be persisted
+    """
+    try:
+        with open(config.MODEL_CONFIG, "r") as f:
+            model_config = yaml.load(f, Loader=yaml.FullLoader)
+
+        acquire_config = model_config["acquire_rates"]
+        train_config = model_config["train_model"]
+        score_config = model_config["score_model"]
+
+        score_start, score_end = look_back_window(score_config["NUM_LOOK_BACK_YRS"])
+        start_date = min(to_date(acquire_config["START_DATE"]), to_date(score_start))
+        end_date = max(to_date(acquire_config["END_DATE"] or datetime.now().date()), to_date(score_end))
+        file_location = path.join(config.PROJECT_HOME, acquire_config["RAW_DATA_LOCATION"])
+
+        cache_settings = train_config.get("MODEL_CACHE") or score_config.get("MODEL_CACHE")
+        cache = ModelCache(**cache_settings) if cache_settings else None
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+
+    engine = get_engine()
+
+    # One thread for S3 and one for the database, so that the database writes stay in order and never wait for S3
+    with ThreadPoolExecutor(max_workers=1) as uploads, ThreadPoolExecutor(max_workers=1) as db_writes:
+        persisted = []
+
+        # 1. Bring the rate store up to date and dump it to the S3 bucket
+        store = update_rate_store(file_location, acquire_config["BASE_URL"], start_date, end_date,
+                                  acquire_config.get("API"))
+        persisted.append(uploads.submit(write_to_S3, file_location, acquire_config["S3_LOCATION"],
+                                        acquire_config["S3_FILE_NAME"], acquire_config.get("S3_TRANSFER")))
+
+        # 2. Evaluate the ARIMA models and store the best ones
+        rates = rates_frame(store, train_config['CURRENCIES'])
+        with instrumentation.stage("evaluate_models", currencies=len(train_config['CURRENCIES'])):
+            models, folds = evaluate_model(rates, cache=cache, return_folds=True, **train_config)
+        best_models = add_model_states(rates, find_best_model(models), train_config.get('N_WORKERS', 1), cache)
+        persisted.append(db_writes.submit(store_best_models, best_models, folds))
+
+        # 3. Generate and store the predictions
+        rates = rates_frame(store, score_config['CURRENCIES'], score_start, score_end)
+        ARIMA_params = best_models[best_models['CURRENCY'].isin(score_config['CURRENCIES'])]
+        with instrumentation.stage("generate_predictions", currencies=len(ARIMA_params)):
+            predictions_df = generate_predictions(rates, ARIMA_params, cache=cache, **score_config)
+        persisted.append(db_writes.submit(store_predictions, engine, predictions_df))
+
+        # 4. Wait for the artifacts. A failed write exits the same way as in the separate commands
+        with instrumentation.stage("persist_wait", artifacts=len(persisted)):
+            for future in persisted:
+                future.result()
+
+    logger.info("Pipeline finished")
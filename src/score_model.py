@@ -1,65 +1,155 @@
 import sys
 import yaml
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
-from src.evaluate_model import ARIMAForecasting
-from src.load_data import load_ARIMA_Params
-from src.helpers.helpers import invoke_api, get_engine
+from src.evaluate_model import run_forecasts
+from src.load_data import load_ARIMA_Params, rates_frame
+from src.helpers.helpers import get_engine
+from src.acquire_data import update_rate_store
 from src.create_dataset import create_Predictions
+from src.helpers.model_cache import ModelCache
+from src.state_space import ARIMAStateSpace, BatchARIMAStateSpace
+from src.snapshot import publish_snapshot
+from src.helpers import instrumentation
 import config
+from os import path
 
 import logging.config
 logger = logging.getLogger(__name__)
 
 
-def date_by_adding_business_days(from_date, add_days):
+def forecast_calendar(from_date, periods, holidays=None):
+    """
+    Builds the dates of a forecast in one call
+    :param from_date: Date after which the forecast starts (date, datetime or 'YYYY-MM-DD')
+    :param periods: Number of business days in the forecast
+    :param holidays: Optional list of dates that are not business days, on top of saturdays and sundays
+    :return: The next periods business days after from_date, as a numpy datetime64[D] array
+    """
+    calendar = np.busdaycalendar(weekmask='1111100',
+                                 holidays=np.array(holidays if holidays else [], dtype='datetime64[D]'))
+    # Rolling backward first makes a non business from_date count from the business day before it, so that the first
+    # forecast date is the first business day after from_date
+    return np.busday_offset(np.datetime64(from_date, 'D'), np.arange(1, periods + 1), roll='backward',
+                            busdaycal=calendar)
+
+
+def date_by_adding_business_days(from_date, add_days, holidays=None):
     """
     :param from_date: Date from which the next business date is to be found
     :param add_days: Number of business days that need to be added to from_date
+    :param holidays: Optional list of dates that are not business days, on top of saturdays and sundays
     :return: The next business day after adding add_days to from_date (sat and sun are considered holidays)
     """
-    business_days_to_add = add_days
-    current_date = from_date
     try:
-        while business_days_to_add > 0:
-            current_date += timedelta(days=1)
-            weekday = current_date.weekday()
-            if weekday >= 5: # sunday = 6
-                continue
-            business_days_to_add -= 1
-    except TypeError:
+        if add_days <= 0:
+            return from_date
+        next_date = forecast_calendar(from_date, add_days, holidays)[-1]
+        return from_date + timedelta(days=int((next_date - np.datetime64(from_date, 'D')).astype(int)))
+    except (TypeError, ValueError):
         logger.error("Non date type input received")
         sys.exit(1)
 
-    return current_date
 
+def load_state(state, state_end_date, order, dates):
+    """
+    Loads the filter state stored by train_model
+    :param state: Serialized filter state (ARIMAStateSpace.to_bytes), or None
+    :param state_end_date: Date of the last observation included in the state
+    :param order: (P, D, Q) order of the model
+    :param dates: Sorted dates ('YYYY-MM-DD') of the rates data
+    :return: Tuple of the model and the position of state_end_date in dates, or None if the state cannot be used: there
+             is none, it is for another order, or the observations that followed it are not all in the rates data
+    """
+    if not isinstance(state, (bytes, bytearray, memoryview)):
+        return None
+    end = str(state_end_date)[:10]
+    position = np.searchsorted(dates, end)
+    if position == len(dates) or dates[position] != end:
+        return None
 
-def generate_predictions(rates, ARIMA_params, FORECAST_PERIOD, **kwargs):
+    model = ARIMAStateSpace.from_bytes(bytes(state))
+    if tuple(model.order) != tuple(int(x) for x in order):
+        return None
+    return model, position
+
+
+def state_forecasts(states, values, FORECAST_PERIOD):
     """
-    Generate predictions from the rates data and ARIMA parameters for the forecast period
-    :param rates: The rates time series for INR, GBP and EUR
-    :param ARIMA_params: The ARIMA parameters to be used for INR, GBP and EUR respectively
+    Forecasts from stored filter states, after appending the observations that followed them. The states that end on
+    the same date are stacked and run as one batched Kalman filter
+    :param states: List of (model, position) tuples from load_state
+    :param values: (days x models) array with the rates of the currency of every state
     :param FORECAST_PERIOD: Number of days for which the predictions are to be made
-    :return:
+    :return: (models x FORECAST_PERIOD) array of predictions
     """
+    predictions = np.empty((len(states), FORECAST_PERIOD))
+    positions = np.array([position for _, position in states], dtype=int)
+    for position in np.unique(positions):
+        batch = np.flatnonzero(positions == position)
+        models = BatchARIMAStateSpace.from_models([states[i][0] for i in batch])
+        predictions[batch] = models.update(values[position + 1:, batch]).forecast(FORECAST_PERIOD)
+    return predictions
+
 
-    predictions_df = pd.DataFrame(columns=['CURRENCY', 'PRED_DATE', 'PRED_RATE'])
-    currencies = ['EUR', 'GBP', 'INR']
+def generate_predictions(rates, ARIMA_params, FORECAST_PERIOD, MODEL_CACHE=None, HOLIDAYS=None, cache=None, **kwargs):
+    """
+    Generate predictions from the rates data and ARIMA parameters for the forecast period. The models with a stored
+    filter state forecast from it without refitting, the others are fitted on the rates data
+    :param rates: The rates time series for every currency
+    :param ARIMA_params: The ARIMA parameters to be used for each currency, optionally with the STATE and STATE_END_DATE
+                         stored by train_model
+    :param FORECAST_PERIOD: Number of days for which the predictions are to be made
+    :param MODEL_CACHE: Optional ModelCache settings (LOCATION, MAX_ENTRIES, WARM_START_MAX_DAYS)
+    :param HOLIDAYS: Optional list of dates, on top of weekends, for which no predictions are made
+    :param cache: Optional ModelCache to be used instead of one loaded from the MODEL_CACHE settings
+    :return: Dataframe with the CURRENCY, PRED_DATE and PRED_RATE of every prediction
+    """
 
     try:
-        now = datetime.strptime(rates['DATE'].iloc[-1], '%Y-%m-%d')
-
-        for curr in currencies:
-            predictions = ARIMAForecasting(rates[curr], FORECAST_PERIOD,
-                                           ARIMA_params.loc[ARIMA_params['CURRENCY'] == curr, 'P'].values[0],
-                                           ARIMA_params.loc[ARIMA_params['CURRENCY'] == curr, 'D'].values[0],
-                                           ARIMA_params.loc[ARIMA_params['CURRENCY'] == curr, 'Q'].values[0])
-
-            for i in range(FORECAST_PERIOD):
-                next_dt = date_by_adding_business_days(now, (i+1))
-                next_dt = next_dt.strftime("%Y-%m-%d")
-                predictions_df = predictions_df.\
-                    append({'CURRENCY': curr, 'PRED_DATE': next_dt, 'PRED_RATE': predictions[i]}, ignore_index=True)
+        currencies = sorted(ARIMA_params['CURRENCY'])
+        params = ARIMA_params.set_index('CURRENCY')
+        dates = np.asarray(rates['DATE'], dtype=str)
+
+        all_predictions = [None] * len(currencies)
+        stored = []
+        states = []
+        refit = []
+        tasks = []
+        with instrumentation.stage("state_forecasts", currencies=len(currencies)):
+            for i, curr in enumerate(currencies):
+                row = params.loc[curr]
+                order = (int(row['P']), int(row['D']), int(row['Q']))
+                state = load_state(row.get('STATE'), row.get('STATE_END_DATE'), order, dates)
+                if state is None:
+                    refit.append(i)
+                    tasks.append((curr, rates[curr], FORECAST_PERIOD) + order)
+                else:
+                    stored.append(i)
+                    states.append(state)
+            if states:
+                values = np.asarray(rates[[currencies[i] for i in stored]], dtype=float)
+                for i, predictions in zip(stored, state_forecasts(states, values, FORECAST_PERIOD)):
+                    all_predictions[i] = predictions
+
+        # The models without a usable state are fitted
+        if tasks:
+            logger.info("{} of {} models have no usable stored state and are refitted".format(len(tasks),
+                                                                                            len(currencies)))
+            if cache is None and MODEL_CACHE:
+                cache = ModelCache(**MODEL_CACHE)
+            for i, predictions in zip(refit, run_forecasts(tasks, cache=cache)):
+                all_predictions[i] = predictions
+
+        # The forecast dates are the same for every currency, so the frame is built once from whole columns
+        pred_dates = np.datetime_as_string(forecast_calendar(rates['DATE'].iloc[-1], FORECAST_PERIOD, HOLIDAYS))
+        predictions_df = pd.DataFrame(data={
+            'CURRENCY': np.repeat(np.array(currencies, dtype=object), FORECAST_PERIOD),
+            'PRED_DATE': np.tile(pred_dates.astype(object), len(currencies)),
+            'PRED_RATE': np.concatenate([np.asarray(predictions, dtype=float)[:FORECAST_PERIOD]
+                                         for predictions in all_predictions]) if currencies else []
+        })
     except Exception as e:
         logger.error(e)
         sys.exit(1)
@@ -67,43 +157,50 @@ def generate_predictions(rates, ARIMA_params, FORECAST_PERIOD, **kwargs):
     return predictions_df
 
 
+def store_predictions(engine, predictions_df):
+    """
+    Stores the predictions in the database and publishes them as the static snapshot served by the app
+    :param engine: DB engine
+    :param predictions_df: Dataframe with the CURRENCY, PRED_DATE and PRED_RATE of every prediction
+    :return: None
+    """
+    version = create_Predictions(engine, predictions_df)
+    publish_snapshot(predictions_df, version)
+
+
+def look_back_window(NUM_LOOK_BACK_YRS, now=None):
+    """
+    :param NUM_LOOK_BACK_YRS: Number of years of rates that the predictions are made from
+    :param now: Optional datetime at which the window ends. Defaults to now
+    :return: Tuple of the first and last date ('YYYY-MM-DD') of the look back window
+    """
+    now = now or datetime.now()
+    start_date = now - timedelta(days=NUM_LOOK_BACK_YRS * 365)
+    return start_date.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+
+
 def score_model(args):
     """
     Orchestrates the following functions:
-    1. Construct the API URL from the configs set in the yaml
-    2. Invoke the api and get latest exchange rates
+    1. Bring the local rate store up to date with the latest exchange rates
+    2. Take the look back window from the rate store
     3. Load ARIMA parameters for best models
     4. Generate predictions
-    5. Store predictions in the database
+    5. Store predictions in the database and write the snapshot served by the app
     """
     try:
         with open(config.MODEL_CONFIG, "r") as f:
             model_config = yaml.load(f, Loader=yaml.FullLoader)
 
         load_config = model_config["score_model"]
-        now = datetime.now()
-        end_date = now.strftime("%Y-%m-%d")
-        start_date = now - timedelta(days = load_config["NUM_LOOK_BACK_YRS"] * 365)
-        start_date = start_date.strftime("%Y-%m-%d")
-
-        # Construct the API URL from the configs set in the yaml
-        base_url = load_config["BASE_URL"]
-        api_url = "{base_url}?start_at={start_date}&end_at={end_date}&base=USD"
-        api_url = api_url.format(base_url=base_url, start_date=start_date,
-                                 end_date=end_date)
-
-        # Invoke the api and get latest exchange rates
-        data = invoke_api(api_url)
-
-        dates_list = list(data['rates'].keys())
-        inputs = {
-            'DATE': [date for date in dates_list],
-            'EUR': [data['rates'][date]['EUR'] for date in dates_list],
-            'INR': [data['rates'][date]['INR'] for date in dates_list],
-            'GBP': [data['rates'][date]['GBP'] for date in dates_list]
-        }
-        rates = pd.DataFrame(data=inputs)
-        rates = rates.sort_values(by=['DATE'], ascending=True).reset_index(drop=True)
+        start_date, end_date = look_back_window(load_config["NUM_LOOK_BACK_YRS"])
+
+        # Bring the rate store up to date, calling the api only for the dates it does not have yet
+        file_location = path.join(config.PROJECT_HOME, load_config["RAW_DATA_LOCATION"])
+        store = update_rate_store(file_location, load_config["BASE_URL"], start_date, end_date, load_config.get("API"))
+
+        # Take the look back window from the store
+        rates = rates_frame(store, load_config['CURRENCIES'], start_date, end_date)
 
     except Exception as e:
         logger.error(e)
@@ -114,8 +211,9 @@ def score_model(args):
     ARIMA_params = load_ARIMA_Params(engine);
 
     # Generate predictions
-    predictions_df = generate_predictions(rates, ARIMA_params, **load_config)
+    with instrumentation.stage("generate_predictions", currencies=len(ARIMA_params)):
+        predictions_df = generate_predictions(rates, ARIMA_params, **load_config)
 
-    # Store predictions in the database
-    create_Predictions(engine, predictions_df)
-    return
+    # Store predictions in the database and publish the snapshot of the app
+    store_predictions(engine, predictions_df)
+    return
\ No newline at end of file
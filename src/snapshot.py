@@ -0,0 +1,156 @@
+import io
+import os
+import sys
+import gzip
+import json
+import hashlib
+import tempfile
+from os import path
+from datetime import datetime
+from urllib.parse import urlencode
+
+import config
+from src.helpers import instrumentation
+
+try:
+    import brotli
+except ImportError:
+    # Optional, the snapshot is then only gzip compressed
+    brotli = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The manifest is written last, so a snapshot without one is incomplete and is not served
+MANIFEST = "manifest.json"
+TEMPLATES = path.join(config.PROJECT_HOME, "app/templates")
+
+
+def _url_for(endpoint, **values):
+    # The snapshot only links to the index page, at the root of the app, with the query parameters that are set
+    query = urlencode([(name, value) for name, value in values.items() if value is not None])
+    return "/?" + query if query else "/"
+
+
+def render_index(predictions, next_url=None):
+    """
+    Renders the index page of the Flask app for predictions, outside of a request
+    :param predictions: List of dictionaries with the CURRENCY, PRED_DATE and PRED_RATE of each prediction on the page
+    :param next_url: Optional link to the next page
+    :return: The page (str)
+    """
+    import jinja2
+    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES), autoescape=True)
+    environment.globals["url_for"] = _url_for
+    filters = {'currencies': (), 'start_date': None, 'end_date': None}
+    return environment.get_template("index.html").render(predictions=predictions, filters=filters, next_url=next_url)
+
+
+def _gzip(data):
+    # A fixed mtime keeps the compressed bytes the same for the same content
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode="wb", mtime=0) as compressed:
+        compressed.write(data)
+    return output.getvalue()
+
+
+def _write(directory, file_name, data):
+    """ Writes data to a temporary file in directory and moves it into place, so readers never see a partial file """
+    output_file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+    try:
+        with output_file:
+            output_file.write(data)
+        os.replace(output_file.name, path.join(directory, file_name))
+    except Exception:
+        if path.exists(output_file.name):
+            os.remove(output_file.name)
+        raise
+
+
+def encodings(file_name, data):
+    """
+    :return: Dictionary of the file name of every encoding of data ("identity", "gzip" and, with brotli, "br") and the
+             encoded bytes
+    """
+    encoded = {"identity": (file_name, data), "gzip": (file_name + ".gz", _gzip(data))}
+    if brotli is not None:
+        encoded["br"] = (file_name + ".br", brotli.compress(data))
+    return encoded
+
+
+def write_snapshot(predictions_df, version=None, directory=None, page_size=None):
+    """
+    Writes the predictions as a pre-rendered index page and a JSON document in the layout of /api/predictions, each
+    plain and compressed, with a manifest holding the SHA-256 content hash of both. The Flask app serves the snapshot
+    instead of querying the database.
+    :param predictions_df: Dataframe with the CURRENCY, PRED_DATE and PRED_RATE of every prediction
+    :param version: Version stamp of the predictions (VERSION and UPDATED_AT), as stored by create_Predictions
+    :param directory: Directory of the snapshot. Defaults to config.SNAPSHOT_DIR
+    :param page_size: Number of predictions on the index page, which links to the next page of the app like the page
+                      rendered from the database. Defaults to config.PREDICTIONS_PAGE_SIZE
+    :return: The manifest
+    """
+    directory = directory or config.SNAPSHOT_DIR
+    page_size = page_size or config.PREDICTIONS_PAGE_SIZE
+    version = version or {}
+    predictions = [{'CURRENCY': row.CURRENCY, 'PRED_DATE': str(row.PRED_DATE)[:10], 'PRED_RATE': float(row.PRED_RATE)}
+                   for row in predictions_df.sort_values(['CURRENCY', 'PRED_DATE']).itertuples()]
+
+    page = predictions[:page_size]
+    next_url = _url_for('index', after="{}:{}".format(page[-1]['CURRENCY'], page[-1]['PRED_DATE'])) \
+        if len(predictions) > page_size else None
+    documents = {
+        "index": ("index.html", "text/html; charset=utf-8", render_index(page, next_url).encode("utf-8")),
+        "predictions": ("predictions.json", "application/json",
+                        json.dumps({'version': version.get('VERSION'), 'predictions': predictions, 'next': None},
+                                   sort_keys=True).encode("utf-8"))
+    }
+    updated_at = version.get('UPDATED_AT') or datetime.utcnow().replace(microsecond=0)
+    manifest = {'version': version.get('VERSION'), 'updated_at': updated_at.isoformat(), 'page_size': page_size,
+                'files': {}}
+
+    with instrumentation.stage("snapshot_write", predictions=len(predictions)):
+        os.makedirs(directory, exist_ok=True)
+        # An incomplete snapshot is taken out of service before its files are replaced
+        if path.exists(path.join(directory, MANIFEST)):
+            os.remove(path.join(directory, MANIFEST))
+
+        for name, (file_name, mimetype, data) in documents.items():
+            files = {}
+            for encoding, (encoded_name, encoded) in encodings(file_name, data).items():
+                _write(directory, encoded_name, encoded)
+                files[encoding] = encoded_name
+            manifest['files'][name] = {'mimetype': mimetype, 'sha256': hashlib.sha256(data).hexdigest(),
+                                       'encodings': files}
+
+        _write(directory, MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    logger.info("Prediction snapshot written to {}".format(directory))
+    return manifest
+
+
+def publish_snapshot(predictions_df, version=None, directory=None):
+    """
+    Writes the snapshot, see write_snapshot. When it cannot be written, the manifest of the previous snapshot is removed,
+    so that the app falls back to the database rather than serve outdated predictions
+    """
+    directory = directory or config.SNAPSHOT_DIR
+    try:
+        return write_snapshot(predictions_df, version, directory)
+    except Exception as e:
+        logger.error("Could not write the prediction snapshot: {}".format(e))
+        if path.exists(path.join(directory, MANIFEST)):
+            os.remove(path.join(directory, MANIFEST))
+        sys.exit(1)
+
+
+def read_manifest(directory):
+    """
+    :param directory: Directory of the snapshot
+    :return: The manifest of the snapshot, or None if there is no complete snapshot
+    """
+    try:
+        with open(path.join(directory, MANIFEST), "r") as input_file:
+            return json.load(input_file)
+    except (IOError, ValueError):
+        return None
@@ -0,0 +1,251 @@
+import io
+import numpy as np
+from scipy.linalg import solve_discrete_lyapunov
+from scipy.special import comb
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ARIMAStateSpace(object):
+    """
+    Kalman filter for an ARIMA(p, d, q) model with fixed (already fitted) parameters.
+
+    The parameters follow the statsmodels ARIMA layout, [const, ar_1..ar_p, ma_1..ma_q], where const is the mean of the
+    d times differenced series. The differenced, demeaned series is put in state space form (Harvey's representation
+    with a state of size max(p, q + 1)) so that new observations can be appended with one filter step each, and
+    forecasts are integrated back to levels from the last d observations.
+    """
+
+    def __init__(self, params, order, sigma2=1.0):
+        """
+        :param params: Fitted parameters, [const, ar_1..ar_p, ma_1..ma_q]
+        :param order: (P, D, Q) order of the model
+        :param sigma2: Variance of the innovations. It scales the state covariance only, not the point forecasts
+        """
+        p, d, q = [int(x) for x in order]
+        params = np.asarray(params, dtype=float)
+        self.order = (p, d, q)
+        self.const = params[0]
+        self.ar = params[1:1 + p]
+        self.ma = params[1 + p:1 + p + q]
+        self.sigma2 = float(sigma2)
+
+        r = max(p, q + 1)
+        self.T = np.zeros((r, r))
+        self.T[:p, 0] = self.ar
+        self.T[:-1, 1:] = np.eye(r - 1)
+        R = np.zeros(r)
+        R[0] = 1
+        R[1:q + 1] = self.ma
+        self.RQR = self.sigma2 * np.outer(R, R)
+
+        # Predicted state a(t+1|t) and its covariance, starting from the unconditional distribution when the AR part is
+        # stationary and from a large (approximately diffuse) variance otherwise
+        self.a = np.zeros(r)
+        if p == 0 or np.all(np.abs(np.linalg.eigvals(self.T)) < 1):
+            self.P = solve_discrete_lyapunov(self.T, self.RQR)
+        else:
+            self.P = np.eye(r) * 1e6
+
+        # Last d observed levels, needed to difference new observations and to integrate the forecasts
+        self.tail = np.array([])
+        self.nobs = 0
+
+    def to_bytes(self):
+        """
+        :return: The model and its filtered state (parameters, sigma2, predicted state and covariance, last d
+                 observations) as the bytes of an uncompressed .npz
+        """
+        output = io.BytesIO()
+        np.savez(output, order=np.array(self.order), params=np.r_[self.const, self.ar, self.ma], sigma2=self.sigma2,
+                 a=self.a, P=self.P, tail=self.tail, nobs=self.nobs)
+        return output.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: Bytes written by to_bytes
+        :return: The model with its filtered state, ready for update and forecast
+        """
+        with np.load(io.BytesIO(data)) as arrays:
+            model = cls(arrays['params'], arrays['order'], float(arrays['sigma2']))
+            model.a = arrays['a']
+            model.P = arrays['P']
+            model.tail = arrays['tail']
+            model.nobs = int(arrays['nobs'])
+        return model
+
+    def update(self, ts):
+        """
+        Appends new observations (levels) to the filtered state
+        :param ts: New observations, following the ones seen so far
+        :return: self
+        """
+        p, d, q = self.order
+        weights = np.array([(-1) ** k * comb(d, k) for k in range(d + 1)])
+        for y in np.asarray(ts, dtype=float):
+            if len(self.tail) == d:
+                # d-th difference of the new observation, demeaned
+                z = np.dot(weights, np.r_[y, self.tail[::-1]]) - self.const
+                self._filter_step(z)
+            self.tail = np.r_[self.tail, y][-d:] if d > 0 else self.tail
+            self.nobs += 1
+        return self
+
+    def _filter_step(self, z):
+        F = self.P[0, 0]
+        if F <= 0:
+            # No uncertainty left about the observation, the state just moves forward
+            self.a = self.T.dot(self.a)
+            self.P = self.T.dot(self.P).dot(self.T.T) + self.RQR
+            return
+        v = z - self.a[0]
+        K = self.T.dot(self.P[:, 0]) / F
+        self.a = self.T.dot(self.a) + K * v
+        self.P = self.T.dot(self.P).dot(self.T.T) + self.RQR - np.outer(K, K) * F
+
+    def forecast(self, steps):
+        """
+        :param steps: Number of steps ahead
+        :return: Forecasts of the levels for the next steps observations
+        """
+        p, d, q = self.order
+        z = np.empty(steps)
+        a = self.a
+        for h in range(steps):
+            z[h] = a[0]
+            a = self.T.dot(a)
+        forecast = z + self.const
+
+        # Integrate back to levels: each differencing level starts from its last value, computed from the tail
+        for j in range(d - 1, -1, -1):
+            weights = np.array([(-1) ** k * comb(j, k) for k in range(j + 1)])
+            last = np.dot(weights, self.tail[::-1][:j + 1])
+            forecast = last + np.cumsum(forecast)
+        return forecast
+
+
+class BatchARIMAStateSpace(object):
+    """
+    Kalman filters of many ARIMA models with fixed parameters, run together.
+
+    Every model (a currency and an order) has the state space form of ARIMAStateSpace. The models are stacked along the
+    first axis of the arrays, and the states of the smaller models are padded with zeros up to the largest state size
+    (max(p, q + 1) over the models), so that one filter step or one forecast step is a few array operations for all of
+    them. The padded part of a state has zero transition and noise, so it stays zero and leaves the results unchanged.
+    """
+
+    def __init__(self, params, orders, sigma2=None):
+        """
+        :param params: List with the fitted parameters of every model, [const, ar_1..ar_p, ma_1..ma_q]
+        :param orders: List with the (P, D, Q) order of every model
+        :param sigma2: Optional list with the variance of the innovations of every model. Defaults to 1
+        """
+        self.orders = np.array([[int(x) for x in order] for order in orders], dtype=int).reshape(-1, 3)
+        n = len(self.orders)
+        p, d, q = self.orders.T
+        r = int(max(np.max(np.maximum(p, q + 1)), 1)) if n else 1
+        sigma2 = np.ones(n) if sigma2 is None else np.asarray(sigma2, dtype=float)
+
+        self.const = np.zeros(n)
+        self.T = np.zeros((n, r, r))
+        R = np.zeros((n, r))
+        for i, (params_i, (p_i, _, q_i)) in enumerate(zip(params, self.orders)):
+            params_i = np.asarray(params_i, dtype=float)
+            r_i = max(p_i, q_i + 1)
+            self.const[i] = params_i[0]
+            self.T[i, :p_i, 0] = params_i[1:1 + p_i]
+            self.T[i, :r_i - 1, 1:r_i] = np.eye(r_i - 1)
+            R[i, 0] = 1
+            R[i, 1:q_i + 1] = params_i[1 + p_i:1 + p_i + q_i]
+        self.RQR = sigma2[:, None, None] * R[:, :, None] * R[:, None, :]
+
+        # Unconditional state covariance of the stationary models, from (I - T x T) vec(P) = vec(RQR) solved for all
+        # models at once, and a large (approximately diffuse) variance for the others
+        stationary = np.all(np.abs(np.linalg.eigvals(self.T)) < 1, axis=1) if n else np.array([], dtype=bool)
+        T = np.where(stationary[:, None, None], self.T, 0)
+        kron = np.einsum('nij,nkl->nikjl', T, T).reshape(n, r * r, r * r)
+        self.P = np.linalg.solve(np.eye(r * r) - kron, self.RQR.reshape(n, r * r, 1)).reshape(n, r, r)
+        diffuse = np.zeros((n, r, r))
+        for i in np.flatnonzero(~stationary):
+            r_i = max(p[i], q[i] + 1)
+            diffuse[i, :r_i, :r_i] = np.eye(r_i) * 1e6
+        self.P = np.where(stationary[:, None, None], self.P, diffuse)
+        self.a = np.zeros((n, r))
+
+        # Last max(d) observed levels of every model, the most recent last, and the differencing weights padded to them
+        self.d = d
+        self.tail = np.zeros((n, int(d.max()) if n else 0))
+        self.weights = np.zeros((n, self.tail.shape[1] + 1))
+        for i, d_i in enumerate(d):
+            self.weights[i, :d_i + 1] = [(-1) ** k * comb(d_i, k) for k in range(d_i + 1)]
+        self.nobs = np.zeros(n, dtype=int)
+
+    @classmethod
+    def from_models(cls, models):
+        """
+        Stacks the filtered states of single models
+        :param models: List of ARIMAStateSpace
+        :return: BatchARIMAStateSpace with the same states
+        """
+        batch = cls([np.r_[model.const, model.ar, model.ma] for model in models], [model.order for model in models],
+                     [model.sigma2 for model in models])
+        for i, model in enumerate(models):
+            r_i = len(model.a)
+            batch.a[i, :r_i] = model.a
+            batch.P[i] = 0
+            batch.P[i, :r_i, :r_i] = model.P
+            if len(model.tail):
+                batch.tail[i, batch.tail.shape[1] - len(model.tail):] = model.tail
+            batch.nobs[i] = model.nobs
+        return batch
+
+    def update(self, values):
+        """
+        Appends new observations (levels) to the filtered states of all models
+        :param values: (observations x models) array of new observations, following the ones seen so far
+        :return: self
+        """
+        values = np.asarray(values, dtype=float).reshape(-1, len(self.orders))
+        for y in values:
+            # A model filters once it has seen d observations, the first ones only fill its tail
+            ready = self.nobs >= self.d
+            z = self.weights[:, 0] * y + np.einsum('nk,nk->n', self.weights[:, 1:], self.tail[:, ::-1]) - self.const
+            self._filter_step(z, ready)
+            if self.tail.shape[1]:
+                self.tail = np.concatenate((self.tail[:, 1:], y[:, None]), axis=1)
+            self.nobs += 1
+        return self
+
+    def _filter_step(self, z, ready):
+        F = self.P[:, 0, 0]
+        observed = ready & (F > 0)
+        v = np.where(observed, z - self.a[:, 0], 0)
+        K = np.einsum('nij,nj->ni', self.T, self.P[:, :, 0]) / np.where(observed, F, 1)[:, None]
+        K = np.where(observed[:, None], K, 0)
+        a = np.einsum('nij,nj->ni', self.T, self.a) + K * v[:, None]
+        P = np.einsum('nij,njk,nlk->nil', self.T, self.P, self.T) + self.RQR - \
+            K[:, :, None] * K[:, None, :] * F[:, None, None]
+        # Models without d observations yet keep their initial state
+        self.a = np.where(ready[:, None], a, self.a)
+        self.P = np.where(ready[:, None, None], P, self.P)
+
+    def forecast(self, steps):
+        """
+        :param steps: Number of steps ahead
+        :return: (models x steps) array of the forecasts of the levels for the next steps observations
+        """
+        z = np.empty((len(self.orders), steps))
+        a = self.a
+        for h in range(steps):
+            z[:, h] = a[:, 0]
+            a = np.einsum('nij,nj->ni', self.T, a)
+        forecast = z + self.const[:, None]
+
+        # Integrate back to levels, for every differencing level of the models that have it
+        for j in range(self.tail.shape[1] - 1, -1, -1):
+            weights = np.array([(-1) ** k * comb(j, k) for k in range(j + 1)])
+            last = self.tail[:, ::-1][:, :j + 1].dot(weights)
+            forecast = np.where((self.d > j)[:, None], last[:, None] + np.cumsum(forecast, axis=1), forecast)
+        return forecast
@@ -0,0 +1,203 @@
+import re
+import sys
+import codecs
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# One JSON token: a string, a number, a literal or a structural character, after optional whitespace
+_TOKEN = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|([{}\[\]:,])|(true|false|null))')
+_WHITESPACE = re.compile(r'\s*')
+# A whole "currency": rate member of a date object, up to the comma or closing brace after it
+_MEMBER = re.compile(r'\s*"([^"\\]*)"\s*:\s*(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(?:,|(?=\s*}))')
+
+
+class RatesParser(object):
+    """
+    Incremental parser for exchange rate JSON in the {"rates": {date: {currency: rate}}} layout of the API.
+
+    The JSON is fed in chunks of any size, and the rates are written into a (dates x currencies) array as they are
+    parsed, so the nested dictionaries of the whole document are never built. Only the rates of the requested
+    currencies are kept. When the range of dates is known up front the array is allocated once, with a row per calendar
+    day, otherwise it grows by doubling.
+    """
+
+    def __init__(self, currencies=None, start_date=None, end_date=None):
+        """
+        :param currencies: Currencies to be kept. Defaults to every currency found, with NaN for the dates on which a
+                           currency is missing
+        :param start_date: Optional first date of the response ('YYYY-MM-DD')
+        :param end_date: Optional last date of the response ('YYYY-MM-DD')
+        """
+        self.fixed_currencies = currencies is not None
+        self.columns = {curr: j for j, curr in enumerate(currencies or [])}
+
+        if start_date is not None and end_date is not None:
+            self.start = np.datetime64(str(start_date)[:10], 'D')
+            n_rows = int((np.datetime64(str(end_date)[:10], 'D') - self.start).astype(int)) + 1
+        else:
+            self.start = None
+            n_rows = 256
+        self.values = np.full((max(n_rows, 0), max(len(self.columns), 1 if not self.fixed_currencies else 0)), np.nan)
+        self.filled = np.zeros(len(self.values), dtype=bool)
+        self.dates = np.empty(len(self.values), dtype='datetime64[D]')
+        self.n_dates = 0
+
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._containers = []
+        self._keys = []
+        self._expect_key = False
+        self._row = None
+
+    def feed(self, chunk):
+        """ Parses the next chunk of the JSON (str or bytes). A token cut by the end of the chunk is kept for later """
+        if isinstance(chunk, bytes):
+            # A multi-byte character cut by the end of the chunk is completed by the next one
+            chunk = self._decoder.decode(chunk)
+        self._buffer += chunk
+        self._buffer = self._buffer[self._parse(self._buffer, final=False):]
+
+    def close(self):
+        """
+        Parses what is left of the JSON
+        :return: Tuple of the sorted dates (datetime64[D]), the currencies and the (dates x currencies) rates
+        """
+        end = self._parse(self._buffer, final=True)
+        if self._buffer[end:].strip() or self._containers:
+            raise ValueError("Incomplete or invalid JSON at: {!r}".format(self._buffer[end:end + 40]))
+        self._buffer = ''
+
+        currencies = sorted(self.columns, key=self.columns.get)
+        values = self.values[:, :len(currencies)]
+        if self.start is not None:
+            rows = np.flatnonzero(self.filled)
+            dates = self.start + rows
+        else:
+            rows = np.argsort(self.dates[:self.n_dates], kind='stable')
+            dates = self.dates[rows]
+        return dates, currencies, values[rows]
+
+    def _parse(self, text, final):
+        """ Consumes the complete tokens of text and returns the position up to which it was consumed """
+        pos = 0
+        length = len(text)
+        while True:
+            if self._row is not None and self._expect_key and len(self._containers) == 3:
+                # Fast path for the currency: rate members, which make up nearly all of the document
+                match = _MEMBER.match(text, pos)
+                if match is not None:
+                    self._keys[2] = match.group(1)
+                    self._value(match.group(2))
+                    pos = match.end()
+                    continue
+            match = _TOKEN.match(text, pos)
+            if match is None:
+                return _WHITESPACE.match(text, pos).end() if final else pos
+            # A number at the end of the chunk may continue in the next one, e.g. '1' of '1.25' or '1.2' of '1.2e-3'
+            if match.group(2) is not None and not final and (match.end() == length or text[match.end()] in '.eE+-'):
+                return pos
+            pos = match.end()
+            string, number, char, literal = match.groups()
+            if char is not None:
+                self._structure(char)
+            elif string is not None:
+                if self._expect_key:
+                    self._keys[-1] = string
+                    self._expect_key = False
+            else:
+                self._value(number)
+
+    def _structure(self, char):
+        if char == '{':
+            depth = len(self._containers)
+            self._containers.append('{')
+            self._keys.append(None)
+            self._expect_key = True
+            if depth == 2 and self._containers[0] == '{' and self._keys[0] == 'rates':
+                self._row = self._date_row(self._keys[1])
+        elif char == '[':
+            self._containers.append('[')
+            self._keys.append(None)
+        elif char in '}]':
+            self._containers.pop()
+            self._keys.pop()
+            if len(self._containers) < 3:
+                self._row = None
+            self._expect_key = False
+        elif char == ',':
+            self._expect_key = bool(self._containers) and self._containers[-1] == '{'
+
+    def _value(self, number):
+        # Only the numbers at {"rates": {date: {currency: rate}}} are kept
+        if self._row is None or number is None or len(self._containers) != 3:
+            return
+        curr = self._keys[2]
+        j = self.columns.get(curr)
+        if j is None:
+            if self.fixed_currencies:
+                return
+            j = self.columns[curr] = len(self.columns)
+            if j >= self.values.shape[1]:
+                self.values = np.hstack((self.values, np.full((len(self.values), self.values.shape[1]), np.nan)))
+        self.values[self._row, j] = float(number)
+
+    def _date_row(self, key):
+        date = np.datetime64(key, 'D')
+        if self.start is not None:
+            row = int((date - self.start).astype(int))
+            if not 0 <= row < len(self.values):
+                raise ValueError("Date {} is outside of the requested range".format(key))
+            self.filled[row] = True
+            return row
+
+        row = self.n_dates
+        if row >= len(self.values):
+            self.values = np.vstack((self.values, np.full(self.values.shape, np.nan)))
+            self.dates = np.concatenate((self.dates, np.empty(len(self.dates), dtype='datetime64[D]')))
+        self.dates[row] = date
+        self.n_dates += 1
+        return row
+
+
+def parse_rates(chunks, currencies=None, start_date=None, end_date=None):
+    """
+    Builds the date sorted rates matrix from exchange rate JSON that arrives in chunks. Raises ValueError for invalid
+    JSON or missing currencies, see stream_rates for the parameters
+    """
+    import pandas as pd
+    parser = RatesParser(currencies, start_date, end_date)
+    for chunk in chunks:
+        parser.feed(chunk)
+    dates, found, values = parser.close()
+
+    if currencies is not None:
+        missing = [curr for j, curr in enumerate(found) if np.isnan(values[:, j]).any()]
+        if missing:
+            raise ValueError("Currency {} is missing for one or more dates in the input JSON".format(missing[0]))
+    else:
+        # Columns in sorted order rather than in the order they were found
+        order = np.argsort(found, kind='stable')
+        found, values = [found[j] for j in order], values[:, order]
+
+    return pd.DataFrame(data=values, index=pd.DatetimeIndex(dates, name='DATE'), columns=list(found))
+
+
+def stream_rates(chunks, currencies=None, start_date=None, end_date=None):
+    """
+    Builds the date sorted rates matrix from exchange rate JSON that arrives in chunks, e.g. from a streamed API
+    response or a file read block by block
+    :param chunks: Iterable of str or bytes chunks of the JSON
+    :param currencies: Currencies to be loaded. Every one of them must be present for every date. Defaults to all
+                       currencies found in the JSON, with NaN for dates on which a currency is missing
+    :param start_date: Optional first date of the JSON, used with end_date to allocate the rates array up front
+    :param end_date: Optional last date of the JSON
+    :return: Dataframe of float rates with a currency column each, indexed by the parsed dates in ascending order
+    """
+    try:
+        return parse_rates(chunks, currencies, start_date, end_date)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
@@ -1,15 +1,15 @@
 import sys
-import json
-import requests
-import boto3
 import yaml
 import config
+import numpy as np
 import pandas as pd
 from os import path
-from src.load_data import load_raw_source, read_records
-from src.create_dataset import create_ARIMA_Params
-from src.evaluate_model import evaluate_model
+from src.load_data import load_raw_source, read_rate_store, rates_frame
+from src.create_dataset import create_ARIMA_Params, create_ARIMA_Backtest
+from src.evaluate_model import evaluate_model, fit_states
+from src.helpers.model_cache import ModelCache
 from src.helpers.helpers import get_engine
+from src.helpers import instrumentation
 
 import logging.config
 logger = logging.getLogger(__name__)
@@ -18,30 +18,25 @@ logger = logging.getLogger(__name__)
 
 def find_best_model(models):
     """
-    Determine the best model from the MAPE values for INR, GBP and EUR
-    :param models: Dataframe containing ARIMA model parameters with corresponding MAPE values
-    :return: Dataframe with the best INR, GBP and EUR models
+    Determine the best model for every currency from the MAPE values
+    :param models: Dataframe containing ARIMA model parameters with a MAPE_<CURRENCY> column per currency
+    :return: Dataframe with the best model for every currency
     """
 
-    best_models = pd.DataFrame(columns=['CURRENCY', 'P', 'D', 'Q'])
-
     try:
-        # Find the best model for INR, GBP and EUR
-        best_INR_model = models.loc[models['MAPE_INR'].idxmin()]
-        best_models = best_models.\
-            append({'CURRENCY': 'INR', 'P': best_INR_model.P, 'D': best_INR_model.D, 'Q': best_INR_model.Q,
-                    'MAPE': best_INR_model.MAPE_INR}, ignore_index=True)
-
-        best_GBP_model = models.loc[models['MAPE_GBP'].idxmin()]
-        best_models = best_models. \
-            append({'CURRENCY': 'GBP', 'P': best_GBP_model.P, 'D': best_GBP_model.D, 'Q': best_GBP_model.Q,
-                    'MAPE': best_GBP_model.MAPE_GBP}, ignore_index=True)
-
-        best_EUR_model = models.loc[models['MAPE_EUR'].idxmin()]
-        best_models = best_models. \
-            append({'CURRENCY': 'EUR', 'P': best_EUR_model.P, 'D': best_EUR_model.D, 'Q': best_EUR_model.Q,
-                   'MAPE': best_EUR_model.MAPE_EUR}, ignore_index=True)
-
+        mape_columns = [col for col in models.columns if col.startswith('MAPE_')]
+        currencies = [col[len('MAPE_'):] for col in mape_columns]
+
+        # One argmin per currency over the (models x currencies) MAPE matrix. Models that could not be scored (NaN)
+        # are skipped, the same way idxmin does.
+        MAPE = models[mape_columns].values.astype(float)
+        best = np.nanargmin(MAPE, axis=0)
+
+        best_models = pd.DataFrame({'CURRENCY': currencies,
+                                    'P': models['P'].values[best],
+                                    'D': models['D'].values[best],
+                                    'Q': models['Q'].values[best],
+                                    'MAPE': MAPE[best, np.arange(len(currencies))]})
         best_models = best_models.sort_values(by=['CURRENCY'], ascending=True).reset_index(drop=True)
     except Exception as e:
         logger.error(e)
@@ -50,14 +45,49 @@ def find_best_model(models):
     return best_models
 
 
-def store_best_models(df):
+def add_model_states(rates, best_models, N_WORKERS=1, cache=None):
+    """
+    Fits the best model of every currency on the whole rates data and adds its serialized filter state, so that scoring
+    forecasts from it without refitting
+    :param rates: Exchange rate data, with a DATE column ('YYYY-MM-DD') and a rate column per currency
+    :param best_models: Dataframe with the best model for every currency
+    :param N_WORKERS: Number of worker processes used to fit the ARIMA models
+    :param cache: Optional ModelCache used to warm-start the fits
+    :return: best_models with the STATE and its STATE_END_DATE, the last date of rates
+    """
+    try:
+        best_models = best_models.copy()
+        best_models['STATE'] = fit_states(rates, best_models, N_WORKERS, cache)
+        best_models['STATE_END_DATE'] = rates['DATE'].iloc[-1]
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+
+    return best_models
+
+
+def best_model_folds(folds, best_models):
+    """
+    Picks the backtest folds of the best model of every currency
+    :param folds: Dataframe with the P, D, Q, CURRENCY, FOLD and MAPE of every fold of every model, from evaluate_model
+    :param best_models: Dataframe with the best model for every currency
+    :return: Dataframe with the CURRENCY, FOLD, P, D, Q and MAPE of every fold of the best models
+    """
+    return best_models[['CURRENCY', 'P', 'D', 'Q']].merge(folds, on=['CURRENCY', 'P', 'D', 'Q'])[
+        ['CURRENCY', 'FOLD', 'P', 'D', 'Q', 'MAPE']].sort_values(by=['CURRENCY', 'FOLD']).reset_index(drop=True)
+
+
+def store_best_models(df, folds=None):
     """
     Stores the ARIMA parameters passed in the input df in the database
     :param df: ARIMA parameters corresponding to the best models
+    :param folds: Optional MAPE of every backtest fold from evaluate_model, the folds of the best models are stored too
     :return: None
     """
     engine = get_engine()
     create_ARIMA_Params(engine, df)
+    if folds is not None:
+        create_ARIMA_Backtest(engine, best_model_folds(folds, df))
     logger.info("ARIMA Model parameters loaded in the db")
 
 
@@ -65,9 +95,9 @@ def train_model(args):
     """
     Orchestrates the following steps:
     1. Fetch the source data from S3 bucket
-    2. Evaluate the MAPE values for various ARIMA models for INR, GBP and EUR
-    3. Find the best models with the lowest MAPE value for INR, GBP and EUR respectively
-    4. Insert the p,d,q values for the best ARIMA models
+    2. Evaluate the MAPE values for various ARIMA models for the configured currencies
+    3. Find the best models with the lowest MAPE value for each currency and fit them on the whole data
+    4. Insert the p,d,q values, the fitted states and the backtest folds for the best ARIMA models
     """
 
     try:
@@ -82,30 +112,19 @@ def train_model(args):
 
     # 1. Fetch the source data from S3 bucket
     load_raw_source(local_results_file)
-    data = read_records(local_results_file)
-
-    try:
-        dates_list = list(data['rates'].keys())
-        inputs = {
-                'DATE': [date for date in dates_list],
-                'EUR': [data['rates'][date]['EUR'] for date in dates_list],
-                'INR': [data['rates'][date]['INR'] for date in dates_list],
-                'GBP': [data['rates'][date]['GBP'] for date in dates_list]
-                }
-    except KeyError:
-        logger.error("One or more required fields are not present in the input JSON")
-        sys.exit(1)
-
-    rates = pd.DataFrame(data=inputs)
-    rates = rates.sort_values(by=['DATE'], ascending=True).reset_index(drop=True)
+    store = read_rate_store(local_results_file)
+    rates = rates_frame(store, load_config['CURRENCIES'])
 
-    # 2. Evaluate the MAPE values for various ARIMA models for INR, GBP and EUR
-    models = evaluate_model(rates, **load_config)
+    # 2. Evaluate the MAPE values for various ARIMA models for the configured currencies
+    cache = ModelCache(**load_config['MODEL_CACHE']) if load_config.get('MODEL_CACHE') else None
+    with instrumentation.stage("evaluate_models", currencies=len(load_config['CURRENCIES'])):
+        models, folds = evaluate_model(rates, cache=cache, return_folds=True, **load_config)
 
-    # 3. Find the best models with the lowest MAPE value for INR, GBP and EUR respectively
+    # 3. Find the best models with the lowest MAPE value for each currency and fit them on the whole data
     best_models = find_best_model(models)
+    best_models = add_model_states(rates, best_models, load_config.get('N_WORKERS', 1), cache)
 
-    # 4. Insert the p,d,q values for the best ARIMA models
-    store_best_models(best_models)
+    # 4. Insert the p,d,q values, the fitted states and the backtest folds for the best ARIMA models
+    store_best_models(best_models, folds)
 
     return
\ No newline at end of file
@@ -1,11 +1,31 @@
 from src.helpers import helpers
-from src.train_model import find_best_model
+from src.train_model import find_best_model, store_best_models
 from src.evaluate_model import evaluate_model, ARIMAForecasting
-from src.score_model import date_by_adding_business_days, generate_predictions
+from src.score_model import date_by_adding_business_days, generate_predictions, forecast_calendar
+from src.helpers.model_cache import ModelCache
+from src import acquire_data, load_data
+from src import create_dataset
+import sqlalchemy
+import requests
+from app.cache import PredictionCache
+from src.state_space import ARIMAStateSpace, BatchARIMAStateSpace
+from src.backtest import rolling_origin, rolling_origin_batch
+from src import fast_arima
+from src.helpers import instrumentation
+from src.stream_rates import stream_rates
+from src.evaluate_model import map_tasks
+import config
+import json
+import numpy as np
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
 from datetime import datetime
 import pytest
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 
 def test_date_by_adding_business_days_1():
@@ -222,4 +242,795 @@ def test_generate_predictions_2():
     with pytest.raises(SystemExit) as pytest_wrapped_e:
         actual_result = generate_predictions(rates, ARIMA_params, forecast_period)
 
-    assert pytest_wrapped_e.type == SystemExit
\ No newline at end of file
+    assert pytest_wrapped_e.type == SystemExit
+
+def test_evaluate_model_3():
+    # Test that fitting the models over a process pool gives exactly the same output as the serial path
+    inputs = {
+        'DATE': ['2019-05-01', '2019-05-02', '2019-05-03', '2019-05-06', '2019-05-07', '2019-05-08',
+                 '2019-05-09', '2019-05-10', '2019-05-13', '2019-05-14', '2019-05-15', '2019-05-16'],
+        'EUR': [0.88, 0.88, 0.90, 0.89, 0.91, 0.91, 0.92, 0.91, 0.91, 0.90, 0.91, 0.89],
+        'GBP': [0.78, 0.81, 0.8, 0.79, 0.795, 0.798, 0.785, 0.777, 0.782, 0.788, 0.804, 0.79],
+        'INR': [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22],
+    }
+    rates = pd.DataFrame(data=inputs)
+
+    ARIMA_models = {
+        'P': [1, 0, 0, 2, 0],
+        'D': [1, 1, 1, 1, 1],
+        'Q': [0, 0, 1, 0, 2]
+    }
+    forecast_period = 3
+
+    serial_result = evaluate_model(rates, forecast_period, ARIMA_models, N_WORKERS=1)
+    parallel_result = evaluate_model(rates, forecast_period, ARIMA_models, N_WORKERS=2)
+
+    assert_frame_equal(serial_result, parallel_result, check_exact=True)
+
+
+def test_find_best_model_3():
+    # Test that any number of currencies is handled and that models which could not be scored are skipped
+    inputs = {
+        'P': [1, 0, 0, 2],
+        'D': [1, 1, 1, 1],
+        'Q': [0, 0, 1, 0],
+        'MAPE_JPY': [0.51, 0.42, float('nan'), 0.63],
+        'MAPE_CAD': [float('nan'), 0.93, 0.87, 0.91],
+        'MAPE_AUD': [0.22, 0.35, 0.18, float('nan')],
+        'MAPE_CHF': [0.74, 0.64, 0.66, 0.69]
+    }
+    models = pd.DataFrame(data=inputs)
+    actual_result = find_best_model(models)
+
+    expected = {
+        'CURRENCY': ['AUD', 'CAD', 'CHF', 'JPY'],
+        'P': [0, 0, 0, 0],
+        'D': [1, 1, 1, 1],
+        'Q': [1, 1, 0, 0],
+        'MAPE': [0.18, 0.87, 0.64, 0.42]
+    }
+    expected_output = pd.DataFrame(data=expected)
+
+    assert_frame_equal(expected_output, actual_result, check_dtype=False)
+
+
+def test_model_cache_1(tmp_path):
+    # Test that a fitted model is found again for the same window, also after reloading the cache from disk
+    cache_file = str(tmp_path / "model_cache.json")
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    forecast = [69.29750101, 69.30063652, 69.21203591]
+    cache = ModelCache(LOCATION=cache_file)
+    assert cache.get_forecast('INR', (2, 1, 0), inputs, 3) is None
+
+    cache.put('INR', (2, 1, 0), inputs, forecast, [0.01, -0.2, 0.1])
+    cache.save()
+
+    cache = ModelCache(LOCATION=cache_file)
+    assert list(cache.get_forecast('INR', (2, 1, 0), inputs, 3)) == forecast
+    assert list(cache.get_forecast('INR', (2, 1, 0), inputs, 2)) == forecast[:2]
+
+    # Different order, currency, window or a longer forecast are all misses
+    assert cache.get_forecast('INR', (1, 1, 0), inputs, 3) is None
+    assert cache.get_forecast('EUR', (2, 1, 0), inputs, 3) is None
+    assert cache.get_forecast('INR', (2, 1, 0), inputs[1:], 3) is None
+    assert cache.get_forecast('INR', (2, 1, 0), inputs, 7) is None
+
+
+def test_model_cache_2(tmp_path):
+    # Test warm start values for grown and sliding windows, and least recently used eviction
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    cache = ModelCache(LOCATION=str(tmp_path / "model_cache.json"), MAX_ENTRIES=2, WARM_START_MAX_DAYS=3)
+    cache.put('INR', (2, 1, 0), inputs[:8], [69.4], [0.01, -0.2, 0.1])
+
+    # Window grown by 3 days, and the same window slid forward by 2 days
+    assert list(cache.get_start_params('INR', (2, 1, 0), inputs[:11])) == [0.01, -0.2, 0.1]
+    assert list(cache.get_start_params('INR', (2, 1, 0), inputs[2:10])) == [0.01, -0.2, 0.1]
+    # Window grown by more than WARM_START_MAX_DAYS
+    assert cache.get_start_params('INR', (2, 1, 0), inputs) is None
+
+    cache.put('EUR', (2, 1, 0), inputs[:8], [69.4], [0.02])
+    cache.get_forecast('INR', (2, 1, 0), inputs[:8], 1)
+    cache.put('GBP', (2, 1, 0), inputs[:8], [69.4], [0.03])
+    assert cache.get_forecast('EUR', (2, 1, 0), inputs[:8], 1) is None
+    assert cache.get_forecast('INR', (2, 1, 0), inputs[:8], 1) is not None
+
+
+def fake_fetch_all(api_rates, requested=None, chunk_size=None):
+    """
+    Stand-in for helpers.fetch_all that answers every API url from api_rates instead of over the network
+    :param api_rates: Dictionary of the rates of every date ('YYYY-MM-DD') that the API has
+    :param requested: Optional list that every requested url is appended to
+    :param chunk_size: Optional size of the blocks the response body is handed to parse in, the whole body by default
+    :return: Function with the arguments of fetch_all
+    """
+    def fetch_all(api_urls, parse, *args):
+        results = []
+        for api_url in api_urls:
+            if requested is not None:
+                requested.append(api_url)
+            start = api_url.split('start_at=')[1][:10]
+            end = api_url.split('end_at=')[1][:10]
+            body = json.dumps({'base': 'USD', 'rates': {dt: api_rates[dt] for dt in api_rates if start <= dt <= end}})
+            size = chunk_size or len(body)
+            results.append(parse(api_url, [body[i:i + size].encode() for i in range(0, len(body), size)]))
+        return results
+
+    return fetch_all
+
+
+def test_update_rate_store_1(monkeypatch, tmp_path):
+    # Test that the API is only called for the dates that are missing from the rate store
+    api_rates = {'2019-06-03': {'EUR': 0.89}, '2019-06-04': {'EUR': 0.88}, '2019-06-05': {'EUR': 0.89},
+                 '2019-06-06': {'EUR': 0.88}, '2019-06-07': {'EUR': 0.88}}
+    requested = []
+    monkeypatch.setattr(acquire_data, 'fetch_all', fake_fetch_all(api_rates, requested, chunk_size=5))
+    store_file = str(tmp_path / 'rates.npz')
+
+    store = acquire_data.update_rate_store(store_file, 'http://api', '2019-06-03', '2019-06-05')
+    assert list(np.datetime_as_string(store['dates'])) == ['2019-06-03', '2019-06-04', '2019-06-05']
+    assert requested == ['http://api?start_at=2019-06-03&end_at=2019-06-05&base=USD']
+
+    # The store covers the window already
+    store = acquire_data.update_rate_store(store_file, 'http://api', '2019-06-04', '2019-06-05')
+    assert len(requested) == 1
+
+    # Only the two new days are fetched and merged in
+    store = acquire_data.update_rate_store(store_file, 'http://api', '2019-06-03', '2019-06-07')
+    assert requested[1:] == ['http://api?start_at=2019-06-06&end_at=2019-06-07&base=USD']
+    assert list(np.datetime_as_string(store['dates'])) == sorted(api_rates)
+    assert (str(store['start_at']), str(store['end_at'])) == ('2019-06-03', '2019-06-07')
+    assert list(store['rates'][:, 0]) == [0.89, 0.88, 0.89, 0.88, 0.88]
+
+
+def test_update_rate_store_2(monkeypatch, tmp_path):
+    # Test that a date the API has no rates for yet is not marked as ingested, and is fetched by the next run
+    api_rates = {'2019-06-03': {'EUR': 0.89}, '2019-06-04': {'EUR': 0.88}}
+    requested = []
+    monkeypatch.setattr(acquire_data, 'fetch_all', fake_fetch_all(api_rates, requested))
+    store_file = str(tmp_path / 'rates.npz')
+
+    # The rates of 2019-06-05 are not published yet
+    store = acquire_data.update_rate_store(store_file, 'http://api', '2019-06-03', '2019-06-05')
+    assert str(store['end_at']) == '2019-06-04'
+
+    # They are by the next run, which fetches them
+    api_rates['2019-06-05'] = {'EUR': 0.89}
+    store = acquire_data.update_rate_store(store_file, 'http://api', '2019-06-03', '2019-06-05')
+    assert requested[1:] == ['http://api?start_at=2019-06-05&end_at=2019-06-05&base=USD']
+    assert list(np.datetime_as_string(store['dates'])) == ['2019-06-03', '2019-06-04', '2019-06-05']
+    assert str(store['end_at']) == '2019-06-05'
+
+    # A run that gets nothing back keeps the range the store had
+    store = acquire_data.update_rate_store(store_file, 'http://api', '2019-06-03', '2019-06-06')
+    assert str(store['end_at']) == '2019-06-05'
+
+def test_rates_frame_1():
+    # Test that a window of the rate store is returned for the requested currencies
+    store = {
+        'dates': np.array(['2019-06-03', '2019-06-04', '2019-06-05', '2019-06-06'], dtype='datetime64[D]'),
+        'currencies': np.array(['EUR', 'GBP', 'ISK']),
+        'rates': np.array([[0.89, 0.79, 124.1], [0.88, 0.78, np.nan], [0.89, 0.79, 123.9], [0.88, 0.78, 123.2]])
+    }
+    actual_result = load_data.rates_frame(store, ['GBP', 'EUR'], '2019-06-04', '2019-06-05')
+
+    expected = {
+        'DATE': ['2019-06-04', '2019-06-05'],
+        'GBP': [0.78, 0.79],
+        'EUR': [0.88, 0.89]
+    }
+    expected_output = pd.DataFrame(data=expected)
+
+    assert_frame_equal(expected_output, actual_result)
+
+
+def test_rates_frame_2():
+    # Test that currencies missing from the store, or with gaps in the window, are rejected
+    store = {
+        'dates': np.array(['2019-06-03', '2019-06-04', '2019-06-05', '2019-06-06'], dtype='datetime64[D]'),
+        'currencies': np.array(['EUR', 'GBP', 'ISK']),
+        'rates': np.array([[0.89, 0.79, 124.1], [0.88, 0.78, np.nan], [0.89, 0.79, 123.9], [0.88, 0.78, 123.2]])
+    }
+
+    with pytest.raises(SystemExit):
+        load_data.rates_frame(store, ['EUR', 'INR'])
+
+    with pytest.raises(SystemExit):
+        load_data.rates_frame(store, ['EUR', 'ISK'])
+
+
+def test_create_Predictions_1():
+    # Test that storing predictions replaces the old ones: updated rows, new rows and no stale rows left
+    engine = sqlalchemy.create_engine('sqlite://')
+    create_dataset.Base.metadata.create_all(engine)
+
+    old_predictions = pd.DataFrame(data={
+        'CURRENCY': ['EUR', 'EUR', 'GBP', 'GBP'],
+        'PRED_DATE': ['2019-06-07', '2019-06-10', '2019-06-07', '2019-06-10'],
+        'PRED_RATE': [0.90, 0.88, 0.79, 0.80]
+    })
+    create_dataset.create_Predictions(engine, old_predictions)
+
+    new_predictions = pd.DataFrame(data={
+        'CURRENCY': ['EUR', 'EUR', 'INR', 'INR'],
+        'PRED_DATE': ['2019-06-10', '2019-06-11', '2019-06-10', '2019-06-11'],
+        'PRED_RATE': [0.89, 0.87, 69.30, 69.21]
+    })
+    create_dataset.create_Predictions(engine, new_predictions)
+
+    actual_result = pd.read_sql("SELECT * FROM Predictions ORDER BY CURRENCY, PRED_DATE", con=engine)
+    assert_frame_equal(new_predictions, actual_result)
+
+
+def test_load_predictions_1():
+    # Test that the pages of the filtered predictions follow each other by key, in (CURRENCY, PRED_DATE) order
+    engine = sqlalchemy.create_engine('sqlite://')
+    create_dataset.Base.metadata.create_all(engine)
+    predictions = pd.DataFrame(data={
+        'CURRENCY': ['EUR'] * 3 + ['GBP'] * 3 + ['INR'] * 3,
+        'PRED_DATE': ['2019-06-07', '2019-06-10', '2019-06-11'] * 3,
+        'PRED_RATE': [0.90, 0.88, 0.87, 0.79, 0.80, 0.81, 69.3, 69.2, 69.1]
+    })
+    create_dataset.create_Predictions(engine, predictions)
+    session = helpers.get_session(engine)
+
+    pages, after = [], None
+    while True:
+        page, after = load_data.load_predictions(session, ['EUR', 'INR'], start_date='2019-06-10', after=after, limit=3)
+        pages.append([(row['CURRENCY'], row['PRED_DATE']) for row in page])
+        if after is None:
+            break
+    assert pages == [[('EUR', '2019-06-10'), ('EUR', '2019-06-11'), ('INR', '2019-06-10')], [('INR', '2019-06-11')]]
+
+    page, after = load_data.load_predictions(session, end_date='2019-06-07')
+    assert [row['PRED_RATE'] for row in page] == [0.90, 0.79, 69.3]
+    assert after is None
+    session.close()
+
+
+def test_create_ARIMA_Params_1(monkeypatch):
+    # Test that the ARIMA parameters are written in chunks, also without an upsert for the dialect
+    engine = sqlalchemy.create_engine('sqlite://')
+    create_dataset.Base.metadata.create_all(engine)
+    create_dataset.create_ARIMA_Params(engine, pd.DataFrame(data={
+        'CURRENCY': ['EUR', 'GBP'], 'P': [1, 0], 'D': [1, 1], 'Q': [0, 2], 'MAPE': [0.65, 0.71]
+    }))
+
+    params = pd.DataFrame(data={
+        'CURRENCY': ['EUR', 'GBP', 'INR'], 'P': [2, 0, 2], 'D': [1, 1, 1], 'Q': [0, 2, 0],
+        'MAPE': [0.620243, 0.701285, 0.245564]
+    })
+    monkeypatch.setattr(create_dataset, '_upsert_statement', lambda conn, table, key_columns: None)
+    with engine.begin() as conn:
+        create_dataset.upsert_records(conn, create_dataset.ARIMA_Params, params.to_dict(orient="records"), chunk_size=2)
+
+    actual_result = pd.read_sql("SELECT CURRENCY, P, D, Q, MAPE FROM ARIMA_Params ORDER BY CURRENCY", con=engine)
+    assert_frame_equal(params, actual_result)
+
+
+def test_get_engine_1(tmp_path):
+    # Test that one engine, with the configured pool settings, and one session factory are shared per database
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'test.db')
+    engine = helpers.get_engine(engine_string=engine_string)
+
+    assert helpers.get_engine(engine_string=engine_string) is engine
+    assert engine.pool._pre_ping
+    assert helpers.get_session(engine).bind is engine
+    assert helpers.get_sessionmaker(engine) is helpers.get_sessionmaker(engine)
+
+
+def test_prediction_cache_1():
+    # Test that results are loaded once per predictions version
+    versions = [('v1', datetime(2019, 6, 7))]
+    loads = []
+
+    def loader():
+        loads.append(versions[-1][0])
+        return ['predictions for ' + versions[-1][0]]
+
+    cache = PredictionCache(lambda: versions[-1], check_interval=0)
+    assert cache.get(('index',), loader) == (['predictions for v1'], versions[0])
+    assert cache.get(('index',), loader) == (['predictions for v1'], versions[0])
+    assert loads == ['v1']
+
+    # score_model stored new predictions
+    versions.append(('v2', datetime(2019, 6, 8)))
+    assert cache.stamp() == ('v2', datetime(2019, 6, 8))
+    assert cache.get(('index',), loader) == (['predictions for v2'], versions[1])
+    assert loads == ['v1', 'v2']
+
+    # A result loaded while the version changes keeps the stamp it was requested with, and is not cached
+    def changing_loader():
+        versions.append(('v3', datetime(2019, 6, 9)))
+        cache.stamp()
+        return ['predictions for v2']
+
+    assert cache.get(('api',), changing_loader) == (['predictions for v2'], versions[1])
+    assert ('api',) not in cache._results
+
+
+def test_prediction_cache_2():
+    # Test that the version stamp is not looked up again within the check interval, and that entries are bounded
+    lookups = []
+
+    def load_version():
+        lookups.append(1)
+        return None
+
+    cache = PredictionCache(load_version, check_interval=3600, max_entries=2)
+    for key in ['a', 'b', 'c', 'a']:
+        cache.get(key, lambda: key.upper())
+
+    assert len(lookups) == 1
+    assert cache.stamp() == (None, None)
+    assert list(cache._results) == ['c', 'a']
+
+
+def test_forecast_calendar_1():
+    # Test that all forecast dates are built at once, skipping weekends and holidays, also from a Saturday
+    actual_result = list(np.datetime_as_string(forecast_calendar('2019-06-06', 5, holidays=['2019-06-10'])))
+    expected_output = ['2019-06-07', '2019-06-11', '2019-06-12', '2019-06-13', '2019-06-14']
+    assert actual_result == expected_output
+
+    actual_result = list(np.datetime_as_string(forecast_calendar(datetime(2019, 6, 8), 2)))
+    assert actual_result == ['2019-06-10', '2019-06-11']
+
+    # The same holiday calendar applies to date_by_adding_business_days
+    actual_result = date_by_adding_business_days(datetime(2019, 6, 6), 2, holidays=['2019-06-10'])
+    assert actual_result == datetime(2019, 6, 11)
+
+
+def test_ARIMAStateSpace_1():
+    # Test the forecasts of an ARIMA(1, 1, 0) model against the closed form, also when observations are appended later
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    params = [0.01, 0.5]
+
+    model = ARIMAStateSpace(params, (1, 1, 0)).update(inputs)
+    steps = np.arange(1, 6)
+    expected_output = 69.22 + np.cumsum(0.01 + 0.5 ** steps * (69.22 - 69.44 - 0.01))
+    assert np.allclose(model.forecast(5), expected_output)
+
+    appended = ARIMAStateSpace(params, (1, 1, 0)).update(inputs[:7]).update(inputs[7:])
+    assert np.allclose(appended.forecast(5), model.forecast(5))
+
+
+def test_rolling_origin_1():
+    # Test the MAPE of each fold for a random walk model, which forecasts the last observed value
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    actual_result = rolling_origin(inputs, (0, 1, 0), [0.0], 3, 2)
+
+    expected_output = [(0.21 + 0.30 + 0.53) * 100 / (69.32 + 69.41 + 69.64),
+                       (0.19 + 0.20 + 0.42) * 100 / (69.83 + 69.44 + 69.22)]
+    assert np.allclose(actual_result, expected_output)
+
+
+def test_BatchARIMAStateSpace_1():
+    # Test that the batched filter of models with different orders forecasts the same as the filter of each model
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    orders = [(0, 1, 0), (1, 1, 0), (2, 0, 1), (0, 2, 1)]
+    params = [[0.0], [0.01, 0.5], [69.5, 0.6, 0.2, 0.3], [0.0, -0.4]]
+
+    batch = BatchARIMAStateSpace(params, orders).update(np.tile(np.array(inputs)[:, None], (1, 4)))
+    expected_output = [ARIMAStateSpace(params[i], orders[i]).update(inputs).forecast(5) for i in range(4)]
+    assert np.allclose(batch.forecast(5), expected_output)
+
+    # Stacking models that were filtered separately gives the same batch
+    models = [ARIMAStateSpace(params[i], orders[i]).update(inputs[:7]) for i in range(4)]
+    stacked = BatchARIMAStateSpace.from_models(models).update(np.tile(np.array(inputs[7:])[:, None], (1, 4)))
+    assert np.allclose(stacked.forecast(5), expected_output)
+
+    # The batched backtest gives the MAPE of each model
+    expected_MAPE = [rolling_origin(inputs, orders[i], params[i], 3, 2) for i in range(4)]
+    assert np.allclose(rolling_origin_batch(np.tile(np.array(inputs)[:, None], (1, 4)), orders, params, 3, 2),
+                       expected_MAPE)
+
+
+def test_fast_arima_1():
+    # Test that the CSS fit of an AR model is the least squares fit, and that its forecast follows the AR recursion
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    params, resid = fast_arima.css_fit(inputs, 1, 1, 0)
+
+    z = np.diff(inputs)
+    X = np.column_stack((np.ones(len(z) - 1), z[:-1]))
+    coefs = np.linalg.lstsq(X, z[1:], rcond=None)[0]
+    assert np.allclose([coefs[0] / (1 - coefs[1]), coefs[1]], params, atol=1e-5)
+
+    forecast = fast_arima.css_forecast(inputs, 1, 1, 0, params, resid, 2)
+    step_1 = coefs[0] + coefs[1] * z[-1]
+    step_2 = coefs[0] + coefs[1] * step_1
+    assert np.allclose(forecast, [69.22 + step_1, 69.22 + step_1 + step_2], atol=1e-5)
+
+
+def test_fast_arima_2():
+    # Test that a model whose Hannan-Rissanen start values are not stationary is fitted from zero ARMA coefficients
+    # instead of aborting, to a stationary model that fits better than white noise
+    inputs = [69.27, 69.30, 69.98, 69.56, 69.24, 69.11, 69.32, 69.41, 69.64, 69.83, 69.44, 69.22]
+    with pytest.raises(ValueError, match="not stationary"):
+        fast_arima.start_params(np.array(inputs), 2, 2)
+
+    with np.errstate(all='ignore'):
+        params, resid = fast_arima.css_fit(inputs, 2, 0, 2)
+    assert np.all(np.isfinite(params)) and np.all(np.isfinite(resid))
+    assert np.all(np.abs(np.roots(np.r_[1, -params[1:3]])) < 1)
+    white_noise = np.array(inputs[2:]) - np.mean(inputs)
+    assert np.dot(resid, resid) < np.dot(white_noise, white_noise)
+
+
+def test_evaluate_model_4():
+    # Test that the halving search scores every candidate order and only keeps the MAPE of the last round's survivors
+    rng = np.random.RandomState(0)
+    rates = pd.DataFrame(data={'DATE': pd.date_range('2019-01-01', periods=40).strftime('%Y-%m-%d'),
+                               'EUR': 0.9 + np.cumsum(rng.normal(0, 0.005, 40)),
+                               'INR': 69 + np.cumsum(rng.normal(0, 0.3, 40))})
+    search = {'MODE': 'halving', 'P': [0, 1], 'D': [1, 1], 'Q': [0, 1], 'MIN_WINDOW': 10, 'ETA': 2}
+
+    actual_result = evaluate_model(rates, 3, None, SEARCH=search)
+
+    assert list(actual_result['P']) == [0, 0, 1, 1]
+    assert list(actual_result['Q']) == [0, 1, 0, 1]
+    # 4 candidates are fitted on 10 days, 2 on 20 and the last one on all 37 training days
+    assert list(actual_result[['MAPE_EUR', 'MAPE_INR']].notnull().sum()) == [1, 1]
+    assert list(find_best_model(actual_result)['MAPE'].notnull()) == [True, True]
+
+
+
+def test_evaluate_model_5(monkeypatch):
+    # Test that the MAPE of each backtest fold is returned, averages to the MAPE of the model, and that the folds of the
+    # best models are stored
+    rng = np.random.RandomState(0)
+    rates = pd.DataFrame(data={'DATE': pd.date_range('2019-01-01', periods=40).strftime('%Y-%m-%d'),
+                               'EUR': 0.9 + np.cumsum(rng.normal(0, 0.005, 40)),
+                               'INR': 69 + np.cumsum(rng.normal(0, 0.3, 40))})
+    ARIMA_models = {'P': [1, 0], 'D': [1, 1], 'Q': [0, 1]}
+
+    models, folds = evaluate_model(rates, 3, ARIMA_models, BACKTEST_FOLDS=3, return_folds=True)
+    assert_frame_equal(models, evaluate_model(rates, 3, ARIMA_models, BACKTEST_FOLDS=3))
+    assert list(folds.columns) == ['P', 'D', 'Q', 'CURRENCY', 'FOLD', 'MAPE']
+    assert len(folds) == 2 * 2 * 3
+    mean_MAPE = folds.groupby(['P', 'D', 'Q', 'CURRENCY'])['MAPE'].mean()
+    for row in models.itertuples():
+        assert np.isclose(mean_MAPE[(row.P, row.D, row.Q, 'EUR')], row.MAPE_EUR)
+        assert np.isclose(mean_MAPE[(row.P, row.D, row.Q, 'INR')], row.MAPE_INR)
+
+    # Without a backtest there are no folds, the halving search returns the folds of its last round
+    assert evaluate_model(rates, 3, ARIMA_models, return_folds=True)[1] is None
+    search = {'MODE': 'halving', 'P': [0, 1], 'D': [1, 1], 'Q': [0, 1], 'MIN_WINDOW': 10, 'ETA': 2}
+    search_models, search_folds = evaluate_model(rates, 3, None, BACKTEST_FOLDS=3, SEARCH=search, return_folds=True)
+    assert len(search_folds) == 2 * 3
+    assert np.isclose(search_folds[search_folds['CURRENCY'] == 'EUR']['MAPE'].mean(),
+                      search_models['MAPE_EUR'].min())
+
+    engine = sqlalchemy.create_engine('sqlite://')
+    create_dataset.Base.metadata.create_all(engine)
+    monkeypatch.setattr('src.train_model.get_engine', lambda: engine)
+    best_models = find_best_model(models)
+    store_best_models(best_models, folds)
+
+    actual_result = pd.read_sql("SELECT * FROM ARIMA_Backtest ORDER BY CURRENCY, FOLD", con=engine)
+    assert list(actual_result['CURRENCY']) == ['EUR'] * 3 + ['INR'] * 3
+    assert list(actual_result['FOLD']) == [0, 1, 2] * 2
+    assert np.allclose(actual_result.groupby('CURRENCY')['MAPE'].mean(), best_models['MAPE'])
+
+def test_instrumentation_1(tmp_path):
+    # Test that the run report has the stages and the fits of the command, also when the command exits with an error
+    def command(args):
+        with instrumentation.stage("db_write", table="Predictions"):
+            map_tasks(abs, [-1, 2], labels=[('EUR', (1, 1, 0)), ('INR', (0, 1, 2))])
+        sys.exit(1)
+
+    with pytest.raises(SystemExit):
+        instrumentation.run(command, None, "score", report_dir=str(tmp_path))
+
+    reports = os.listdir(str(tmp_path))
+    assert len(reports) == 1
+    with open(os.path.join(str(tmp_path), reports[0])) as f:
+        report = json.load(f)
+
+    assert report['command'] == 'score'
+    assert report['status'] == 'failed'
+    assert [(stage['stage'], stage['table']) for stage in report['stages']] == [('db_write', 'Predictions')]
+    assert [(fit['currency'], fit['order']) for fit in report['fits']['by_fit']] == [('EUR', [1, 1, 0]),
+                                                                                      ('INR', [0, 1, 2])]
+    assert instrumentation.current_report() is None
+
+
+def test_stream_rates_1():
+    # Test that the streamed JSON gives the date sorted rates matrix, whatever the chunks it is cut into
+    records = {'base': 'USD', 'start_at': '2019-05-01',
+               'rates': {'2019-05-02': {'EUR': 0.8925, 'GBP': 0.7667, 'INR': 69.7},
+                         '2019-05-01': {'EUR': 0.891, 'GBP': 7.658e-1, 'INR': 69.5, 'XAU': [1, {"a": 2}]}},
+               'end_at': '2019-05-03'}
+    body = json.dumps(records, indent=2).encode()
+    expected_output = pd.DataFrame(data={'EUR': [0.891, 0.8925], 'GBP': [0.7658, 0.7667]},
+                                   index=pd.DatetimeIndex(['2019-05-01', '2019-05-02'], name='DATE'))
+
+    for size in [1, 3, 16, len(body)]:
+        chunks = [body[i:i + size] for i in range(0, len(body), size)]
+        assert_frame_equal(stream_rates(chunks, ['EUR', 'GBP']), expected_output)
+        assert_frame_equal(stream_rates(chunks, ['EUR', 'GBP'], '2019-05-01', '2019-05-03'), expected_output)
+
+    assert list(stream_rates([body]).columns) == ['EUR', 'GBP', 'INR']
+
+    with pytest.raises(SystemExit):
+        stream_rates([body], ['EUR', 'JPY'])
+
+    with pytest.raises(SystemExit):
+        stream_rates([body[:-10]], ['EUR'])
+
+
+def test_fetch_all_1():
+    # Test against a local stub server that the responses come back in order, that at most max_concurrency calls are in
+    # flight at once, and that failed calls are retried
+    calls = []
+    in_flight = [0, 0]
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                calls.append(self.path)
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            try:
+                time.sleep(0.05)
+                self.respond()
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        def respond(self):
+            # The first call of /b fails with a temporary error, /missing always fails
+            if self.path == '/missing' or (self.path == '/b' and calls.count('/b') == 1):
+                self.send_response(404 if self.path == '/missing' else 503)
+                self.end_headers()
+                return
+            body = self.path[1:].encode() * 3
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_port)
+    try:
+        actual_result = helpers.fetch_all([url + 'a', url + 'b', url + 'c', url + 'd'], max_concurrency=2, backoff=0)
+        assert actual_result == [b'aaa', b'bbb', b'ccc', b'ddd']
+        assert calls.count('/b') == 2
+        assert in_flight[1] == 2
+
+        # A client error is not retried
+        with pytest.raises(requests.exceptions.HTTPError):
+            helpers.fetch_all([url + 'missing'], backoff=0)
+        assert calls.count('/missing') == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_s3_transfer_1(monkeypatch, tmp_path):
+    # Test that unchanged files are neither uploaded nor downloaded again, and that compressed and multipart objects
+    # come back identical
+    moto = pytest.importorskip("moto", minversion="5.0")
+    import boto3
+    from src.helpers import s3_transfer
+    for key, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                       ("AWS_DEFAULT_REGION", "us-east-1")]:
+        monkeypatch.setenv(key, value)
+
+    local_file = str(tmp_path / "rates.npz")
+    np.savez(local_file, rates=np.random.RandomState(0).normal(size=(1000, 800)))
+    download_location = str(tmp_path / "rates_dl.npz")
+
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket="bucket")
+        assert s3_transfer.upload_file(local_file, "bucket", "rates.npz")
+        assert not s3_transfer.upload_file(local_file, "bucket", "rates.npz")
+        assert s3_transfer.download_file("bucket", "rates.npz", download_location)
+        assert not s3_transfer.download_file("bucket", "rates.npz", download_location)
+        with open(local_file, "rb") as f, open(download_location, "rb") as g:
+            assert f.read() == g.read()
+
+        # Uncompressed, in 5MB parts
+        settings = {"COMPRESS": False, "MULTIPART_THRESHOLD_MB": 5, "MULTIPART_CHUNKSIZE_MB": 5}
+        os.remove(download_location)
+        assert s3_transfer.upload_file(local_file, "bucket", "rates_parts.npz", **settings)
+        assert "-" in boto3.client("s3").head_object(Bucket="bucket", Key="rates_parts.npz")["ETag"]
+        assert not s3_transfer.upload_file(local_file, "bucket", "rates_parts.npz", **settings)
+        assert s3_transfer.download_file("bucket", "rates_parts.npz", download_location, **settings)
+        with open(local_file, "rb") as f, open(download_location, "rb") as g:
+            assert f.read() == g.read()
+
+        with pytest.raises(FileNotFoundError):
+            s3_transfer.download_file("bucket", "missing.npz", download_location)
+
+
+def test_run_pipeline_1(monkeypatch, tmp_path):
+    # Test that the pipeline stores the best models and the predictions of the freshly acquired rates, and uploads the
+    # rate store once, in one process
+    from src import pipeline, train_model
+    dates = pd.bdate_range(end=datetime.now(), periods=120).strftime("%Y-%m-%d")
+    walk = 1 + np.cumsum(np.random.RandomState(0).normal(0, 0.01, size=(len(dates), 2)), axis=0)
+    api_rates = {dt: {'EUR': walk[i, 0], 'GBP': walk[i, 1]} for i, dt in enumerate(dates)}
+
+    uploads = []
+    engine = helpers.get_engine(engine_string='sqlite:///{}'.format(tmp_path / 'pipeline.db'))
+    create_dataset.Base.metadata.create_all(engine)
+    monkeypatch.setattr(acquire_data, 'fetch_all', fake_fetch_all(api_rates))
+    monkeypatch.setattr(pipeline, 'write_to_S3', lambda *args: uploads.append(args[1:3]))
+    monkeypatch.setattr(pipeline, 'get_engine', lambda: engine)
+    monkeypatch.setattr(train_model, 'get_engine', lambda: engine)
+
+    model_config = {
+        'acquire_rates': {'BASE_URL': 'http://api', 'START_DATE': dates[0], 'END_DATE': None,
+                          'RAW_DATA_LOCATION': str(tmp_path / 'rates.npz'), 'S3_LOCATION': 'bucket',
+                          'S3_FILE_NAME': 'rates.npz'},
+        'train_model': {'FORECAST_PERIOD': 3, 'CURRENCIES': ['EUR', 'GBP'],
+                        'ARIMA_models': {'P': [0, 1], 'D': [1, 0], 'Q': [1, 0]}},
+        'score_model': {'BASE_URL': 'http://api', 'FORECAST_PERIOD': 3, 'CURRENCIES': ['EUR', 'GBP'],
+                        'NUM_LOOK_BACK_YRS': 0.25, 'RAW_DATA_LOCATION': str(tmp_path / 'rates.npz')}}
+    config_file = tmp_path / 'model_config.yml'
+    config_file.write_text(json.dumps(model_config))
+    monkeypatch.setattr(config, 'MODEL_CONFIG', str(config_file))
+    monkeypatch.setattr(config, 'SNAPSHOT_DIR', str(tmp_path / 'snapshot'))
+
+    pipeline.run_pipeline(None)
+
+    assert uploads == [('bucket', 'rates.npz')]
+    params = pd.read_sql("SELECT * FROM ARIMA_Params ORDER BY CURRENCY", con=engine)
+    assert list(params['CURRENCY']) == ['EUR', 'GBP']
+    predictions = pd.read_sql("SELECT * FROM Predictions ORDER BY CURRENCY, PRED_DATE", con=engine)
+    assert len(predictions) == 6
+    assert predictions['PRED_DATE'].min() > dates[-1]
+    assert os.path.exists(str(tmp_path / 'snapshot' / 'manifest.json'))
+
+
+def test_run_imports_1(tmp_path):
+    # Test that create_db and the Flask app start without pandas, scipy or statsmodels (create_db also without boto3,
+    # Flask or requests), and that their imports take at most a fixed multiple of the import of the packages they cannot
+    # do without, timed in the same way on the same machine. Every import is timed in a fresh interpreter, best of 3
+    import subprocess
+    heavy = ['pandas', 'scipy', 'statsmodels', 'boto3', 'botocore', 'flask', 'requests']
+    script = ("import sys, time, json; start = time.perf_counter(); {}; "
+              "print(json.dumps([time.perf_counter() - start, [m for m in " + repr(heavy) + " if m in sys.modules]]))")
+    environment = dict(os.environ, SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(tmp_path / 'app.db'))
+
+    def timed_import(statement):
+        runs = [json.loads(subprocess.check_output([sys.executable, "-c", script.format(statement)],
+                                                   cwd=config.PROJECT_HOME, env=environment).decode())
+                for _ in range(3)]
+        return min(seconds for seconds, _ in runs), runs[0][1]
+
+    # (statement, modules that may be loaded, baseline statement, budget as a multiple of the baseline)
+    checks = {
+        'create_db': ("import run; run.load_command('create_db')", [], "import sqlalchemy, yaml", 3),
+        'app': ("import app.app", ['flask'], "import flask, sqlalchemy, yaml, numpy", 2),
+    }
+    for command, (statement, allowed, baseline, multiple) in checks.items():
+        seconds, loaded = timed_import(statement)
+        baseline_seconds, _ = timed_import(baseline)
+        assert sorted(loaded) == allowed, "{} loads {}".format(command, loaded)
+        assert seconds < multiple * baseline_seconds, \
+            "{} took {:.2f} s to import, over {} x {:.2f} s".format(command, seconds, multiple, baseline_seconds)
+
+
+def test_write_snapshot_1(monkeypatch, tmp_path):
+    # Test that the snapshot holds the rendered page and the JSON with their content hash, in every encoding, and that
+    # a snapshot that cannot be written is taken out of service
+    import gzip
+    import hashlib
+    from src import snapshot
+    predictions = pd.DataFrame(data={
+        'CURRENCY': ['GBP', 'EUR', 'EUR'],
+        'PRED_DATE': ['2019-06-10', '2019-06-11', '2019-06-10'],
+        'PRED_RATE': [0.79, 0.87, 0.88]
+    })
+    version = {'ID': 1, 'VERSION': 'v1', 'UPDATED_AT': datetime(2019, 6, 7, 18, 0)}
+    directory = str(tmp_path)
+
+    manifest = snapshot.write_snapshot(predictions, version, directory)
+    assert snapshot.read_manifest(directory) == manifest
+    assert (manifest['version'], manifest['updated_at']) == ('v1', '2019-06-07T18:00:00')
+
+    documents = {}
+    for name, entry in manifest['files'].items():
+        with open(os.path.join(directory, entry['encodings']['identity']), 'rb') as f:
+            documents[name] = f.read()
+        with open(os.path.join(directory, entry['encodings']['gzip']), 'rb') as f:
+            assert gzip.decompress(f.read()) == documents[name]
+        assert hashlib.sha256(documents[name]).hexdigest() == entry['sha256']
+
+    assert json.loads(documents['predictions'].decode()) == {
+        'version': 'v1', 'next': None,
+        'predictions': [{'CURRENCY': 'EUR', 'PRED_DATE': '2019-06-10', 'PRED_RATE': 0.88},
+                        {'CURRENCY': 'EUR', 'PRED_DATE': '2019-06-11', 'PRED_RATE': 0.87},
+                        {'CURRENCY': 'GBP', 'PRED_DATE': '2019-06-10', 'PRED_RATE': 0.79}]}
+    assert documents['index'].count(b'<tr>') == 4
+    assert b'Next page' not in documents['index']
+
+    # The index page holds the first page only, and links to the next page of the app like the page from the database
+    manifest = snapshot.write_snapshot(predictions, version, directory, page_size=2)
+    with open(os.path.join(directory, manifest['files']['index']['encodings']['identity']), 'rb') as f:
+        page = f.read()
+    assert manifest['page_size'] == 2
+    assert page.count(b'<tr>') == 3
+    assert b'href="/?after=EUR%3A2019-06-11"' in page
+
+    def broken_render(predictions, next_url=None):
+        raise IOError("template missing")
+
+    monkeypatch.setattr(snapshot, 'render_index', broken_render)
+    with pytest.raises(SystemExit):
+        snapshot.publish_snapshot(predictions, version, directory)
+    assert snapshot.read_manifest(directory) is None
+
+
+def test_generate_predictions_3(monkeypatch):
+    # Test that stored filter states forecast without refitting after appending the new observations, and that only
+    # the models without a usable state are refitted
+    from src import score_model
+    from src.evaluate_model import fit_states
+    dates = pd.bdate_range('2019-01-01', periods=140).strftime('%Y-%m-%d')
+    walk = 1 + np.cumsum(np.random.RandomState(1).normal(0, 0.01, size=(len(dates), 2)), axis=0)
+    rates = pd.DataFrame({'DATE': dates, 'EUR': walk[:, 0], 'GBP': walk[:, 1]})
+
+    # Trained on the first 130 days
+    best_models = pd.DataFrame({'CURRENCY': ['EUR', 'GBP'], 'P': [1, 0], 'D': [1, 1], 'Q': [0, 1], 'MAPE': [0.5, 0.6]})
+    best_models['STATE'] = fit_states(rates[:130], best_models)
+    best_models['STATE_END_DATE'] = dates[129]
+
+    # The round trip of a state keeps its forecasts
+    state = ARIMAStateSpace.from_bytes(best_models['STATE'][0])
+    assert state.order == (1, 1, 0) and state.nobs == 130
+    expected_EUR = ARIMAStateSpace(np.r_[state.const, state.ar], (1, 1, 0), state.sigma2)
+    expected_EUR = expected_EUR.update(walk[:, 0]).forecast(5)
+
+    # GBP has no usable state: its state ends on a date that is not in the rates
+    best_models.loc[1, 'STATE_END_DATE'] = '2018-12-31'
+    refitted = []
+
+    def fake_run_forecasts(tasks, N_WORKERS=1, cache=None):
+        refitted.extend(task[0] for task in tasks)
+        return [np.zeros(task[2]) for task in tasks]
+
+    monkeypatch.setattr(score_model, 'run_forecasts', fake_run_forecasts)
+    predictions = score_model.generate_predictions(rates[10:], best_models, 5)
+
+    assert refitted == ['GBP']
+    np.testing.assert_allclose(predictions['PRED_RATE'].values[:5], expected_EUR)
+    assert list(predictions['PRED_RATE'].values[5:]) == [0.0] * 5
+
+
+def test_cross_rates_1():
+    # Test that the rate of every pair is triangulated from the USD rates, that USD itself is a currency of the pairs,
+    # and that a pair leaves out the dates on which either currency has no rate
+    from src.cross_rates import CrossRates, cross_rate_matrix
+    matrix = cross_rate_matrix([[0.9, 70.0, 0.8]])
+    assert matrix.shape == (1, 3, 3)
+    np.testing.assert_allclose(matrix[0, 0], [1.0, 70.0 / 0.9, 0.8 / 0.9])
+    np.testing.assert_allclose(np.diagonal(matrix[0]), 1.0)
+
+    predictions = [{'CURRENCY': 'EUR', 'PRED_DATE': '2019-06-10', 'PRED_RATE': 0.9},
+                   {'CURRENCY': 'INR', 'PRED_DATE': '2019-06-10', 'PRED_RATE': 70.0},
+                   {'CURRENCY': 'EUR', 'PRED_DATE': '2019-06-11', 'PRED_RATE': 0.8},
+                   {'CURRENCY': 'INR', 'PRED_DATE': '2019-06-11', 'PRED_RATE': 72.0},
+                   {'CURRENCY': 'EUR', 'PRED_DATE': '2019-06-12', 'PRED_RATE': 0.85}]
+    cross_rates = CrossRates.from_records(predictions, 'PRED_DATE', 'PRED_RATE')
+    assert sorted(cross_rates.currencies) == ['EUR', 'INR', 'USD']
+
+    dates, rates = cross_rates.pair('EUR', 'INR')
+    assert list(dates) == ['2019-06-10', '2019-06-11']
+    np.testing.assert_allclose(rates, [70.0 / 0.9, 72.0 / 0.8])
+
+    dates, rates = cross_rates.pair('EUR', 'USD', start_date='2019-06-11')
+    assert list(dates) == ['2019-06-11', '2019-06-12']
+    np.testing.assert_allclose(rates, [1 / 0.8, 1 / 0.85])
+
+    # The history comes from the rate store the same way
+    store = {'dates': np.array(['2019-05-29', '2019-05-30'], dtype='datetime64[D]'),
+             'currencies': np.array(['EUR', 'INR']), 'rates': np.array([[0.9, 69.0], [0.9, 70.0]])}
+    dates, rates = CrossRates.from_store(store, start_date='2019-05-30').pair('INR', 'EUR')
+    assert list(dates) == ['2019-05-30']
+    np.testing.assert_allclose(rates, [0.9 / 70.0])